@@ -0,0 +1,115 @@
+"""
+Request-scoped GraphQL context.
+
+Every HTTP request to /graphql (including every operation of a batch) shares
+one context holding its database sessions and a loader cache. Sessions are
+reused by resolvers that run one after the other and only multiplied for
+resolvers that run concurrently; all of them are closed when the request ends.
+The context also carries the school the request was resolved to, which every
+resolver passes on to the data layer.
+"""
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List
+import threading
+
+from sqlalchemy.orm import Session
+from strawberry.fastapi import BaseContext
+
+from app.database.db import SessionLocal
+from app.database.directory import DirectoryCache, directory
+from app.database.tenancy import current_school_id
+
+
+class GraphQLContext(BaseContext):
+    """School, database sessions and loader cache of one GraphQL HTTP request."""
+
+    def __init__(self, school_id: int = None):
+        super().__init__()
+        self.school_id = current_school_id.get() if school_id is None else school_id
+        self._lock = threading.Lock()
+        self._idle: List[Session] = []
+        self._sessions: List[Session] = []
+        self._cache: Dict[Hashable, Any] = {}
+        self._pending: Dict[Hashable, threading.Event] = {}
+
+    @property
+    def directory(self) -> DirectoryCache:
+        """Directory cache of the request's school."""
+        return directory.school(self.school_id)
+
+    @contextmanager
+    def session(self) -> Iterator[Session]:
+        """
+        Lends a database session of this request to a resolver.
+
+        Yields:
+            SQLAlchemy session, not used by any other resolver until the block exits
+        """
+        with self._lock:
+            if self._idle:
+                db = self._idle.pop()
+            else:
+                db = SessionLocal()
+                self._sessions.append(db)
+        try:
+            yield db
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            with self._lock:
+                self._idle.append(db)
+
+    def load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Returns a value computed once per request.
+
+        Concurrent resolvers asking for the same key wait for the first one
+        instead of computing the value again.
+
+        Args:
+            key: Cache key
+            loader: Function computing the value on a miss
+
+        Returns:
+            The cached or freshly computed value
+        """
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = threading.Event()
+        if pending is not None:
+            pending.wait()
+            return self.load(key, loader)
+
+        try:
+            value = loader()
+            with self._lock:
+                self._cache[key] = value
+            return value
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def invalidate(self) -> None:
+        """Drops the loader cache (called after a mutation)."""
+        with self._lock:
+            self._cache.clear()
+
+    def close(self) -> None:
+        """Closes every session opened for the request."""
+        with self._lock:
+            sessions, self._sessions, self._idle = self._sessions, [], []
+        for db in sessions:
+            db.close()
+
+
+async def get_context():
+    """FastAPI dependency providing the GraphQL context and closing it after the response."""
+    context = GraphQLContext()
+    try:
+        yield context
+    finally:
+        context.close()
@@ -0,0 +1,101 @@
+"""
+Thread pool running the blocking database work of GraphQL resolvers.
+
+Resolvers use synchronous SQLAlchemy sessions. Running them on the event
+loop would stall every other request of the worker while one of them waits
+on the database, so they are run in a bounded pool of threads instead. The
+top-level fields of a query then resolve concurrently, while mutations are
+still executed one after the other.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial, wraps
+from typing import Dict
+import asyncio
+import os
+import threading
+
+from app.profiling import current_profile
+
+# Threads running resolvers; keep it at or below the connection pool size plus overflow
+RESOLVER_THREADS = int(os.getenv("RESOLVER_THREADS", "10"))
+
+
+class ResolverExecutor:
+    """
+    Bounded thread pool with active and queued call counters.
+
+    Args:
+        max_workers: Number of threads
+    """
+
+    def __init__(self, max_workers: int = RESOLVER_THREADS):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="resolver")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.active = 0
+        self.completed = 0
+
+    def _call(self, context, func):
+        with self._lock:
+            self.active += 1
+        # Lets the profiler of a profiled request sample this thread while it works for it
+        profile = context.get(current_profile)
+        if profile is not None:
+            profile.add_thread(threading.get_ident())
+        try:
+            # Runs in a copy of the caller's context, so request-scoped
+            # context variables (e.g. the cancel scope) stay visible
+            return context.run(func)
+        finally:
+            if profile is not None:
+                profile.remove_thread(threading.get_ident())
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs a blocking function in the pool and waits for its result.
+
+        Args:
+            func: Function to run
+            *args: Positional arguments
+            **kwargs: Keyword arguments
+
+        Returns:
+            The function's return value
+        """
+        with self._lock:
+            self.submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, self._call, copy_context(), partial(func, *args, **kwargs))
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "threads": self.max_workers,
+                "active": self.active,
+                "queued": self.submitted - self.completed - self.active,
+                "completed": self.completed,
+            }
+
+
+resolver_executor = ResolverExecutor()
+
+
+def in_thread_pool(resolver):
+    """
+    Turns a blocking resolver into a coroutine run in the resolver thread pool.
+
+    Args:
+        resolver: Synchronous resolver
+
+    Returns:
+        Asynchronous resolver with the same signature
+    """
+    @wraps(resolver)
+    async def wrapper(*args, **kwargs):
+        return await resolver_executor.run(resolver, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,117 @@
+"""
+GraphQL router for the Hogwarts house points system.
+"""
+from typing import Any, List, Union
+import asyncio
+import os
+
+import orjson
+from fastapi import HTTPException
+from strawberry import UNSET
+from strawberry.exceptions import MissingQueryError
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLHTTPResponse
+from strawberry.http.exceptions import HTTPException as GraphQLHTTPException
+from strawberry.schema.exceptions import InvalidOperationTypeError
+from strawberry.types.graphql import OperationType
+
+from app.middleware.admission import WRITES, classify_graphql_query
+
+# Maximum number of operations accepted in one batched request
+GRAPHQL_BATCH_MAX_SIZE = int(os.getenv("GRAPHQL_BATCH_MAX_SIZE", "10"))
+
+
+class ORJSONGraphQLRouter(GraphQLRouter):
+    """
+    GraphQLRouter that parses requests and encodes responses with orjson,
+    and accepts batches of operations.
+
+    Strawberry has already serialized scalars (datetimes as ISO strings, enums
+    as their names) by the time the response is encoded, so orjson only sees
+    plain JSON types and produces the same payload as the stdlib encoder.
+
+    A POST body holding a JSON array is executed as a batch: every operation
+    shares the request's context (sessions and loader cache), and the
+    response is the array of results in the same order.
+
+    Request errors are raised as FastAPI's HTTPException, like the REST
+    routes, so every 4xx of the endpoint carries a JSON ``{"detail": ...}``
+    body instead of Strawberry's plain text.
+    """
+
+    def __init__(self, *args, batch_max_size: int = GRAPHQL_BATCH_MAX_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_max_size = batch_max_size
+
+    def parse_json(self, data: Union[str, bytes]) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(400, "Unable to parse request body as JSON") from e
+
+    def encode_json(self, response_data: Union[GraphQLHTTPResponse, List[GraphQLHTTPResponse]]) -> bytes:
+        return orjson.dumps(response_data)
+
+    async def run(self, request, context=UNSET, root_value=UNSET):
+        if request.method == "POST" and "application/json" in (request.headers.get("content-type") or ""):
+            body = await request.body()
+            if body.lstrip()[:1] == b"[":
+                return await self.run_batch(request, self.parse_json(body), context, root_value)
+        try:
+            return await super().run(request, context=context, root_value=root_value)
+        except GraphQLHTTPException as e:
+            raise HTTPException(e.status_code, e.reason) from e
+
+    async def run_batch(self, request, operations: List[Any], context, root_value):
+        """
+        Executes a batch of operations.
+
+        Batches of queries run concurrently; a batch containing a mutation runs
+        its operations one after the other, in order.
+
+        Args:
+            request: The HTTP request
+            operations: Parsed JSON array of operations
+            context: Context shared by every operation
+            root_value: Root value shared by every operation
+
+        Returns:
+            JSON response holding the array of results
+        """
+        if not operations:
+            raise HTTPException(400, "Empty batch")
+        if len(operations) > self.batch_max_size:
+            raise HTTPException(400, f"Batch too large: at most {self.batch_max_size} operations are allowed")
+        if not all(isinstance(operation, dict) for operation in operations):
+            raise HTTPException(400, "Every operation of a batch must be a JSON object")
+
+        async def execute(operation: dict) -> GraphQLHTTPResponse:
+            try:
+                result = await self.schema.execute(
+                    operation.get("query"),
+                    root_value=root_value,
+                    variable_values=operation.get("variables"),
+                    context_value=context,
+                    operation_name=operation.get("operationName"),
+                    allowed_operation_types=OperationType.from_http("POST"),
+                )
+            except MissingQueryError:
+                return {"data": None, "errors": [{"message": "No GraphQL query found in the operation"}]}
+            except InvalidOperationTypeError as e:
+                return {"data": None, "errors": [{"message": e.as_http_error_reason("POST")}]}
+            response_data = await self.process_result(request=request, result=result)
+            if result.errors:
+                self._handle_errors(result.errors, response_data)
+            return response_data
+
+        has_mutation = any(
+            isinstance(operation.get("query"), str)
+            and classify_graphql_query(operation["query"], operation.get("operationName")) == WRITES
+            for operation in operations
+        )
+        if has_mutation:
+            results = [await execute(operation) for operation in operations]
+        else:
+            results = await asyncio.gather(*(execute(operation) for operation in operations))
+
+        return self.create_response(response_data=list(results), sub_response=await self.get_sub_response(request))
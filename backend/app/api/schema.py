@@ -1,10 +1,30 @@
 import strawberry
-from typing import List, Optional
+from functools import lru_cache, wraps
+from graphql import GraphQLError
+from typing import Annotated, Any, Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
-from app.models.models import Wizard, House, Teacher, HousePoints
-from app.database.db import get_db
+from app.models.models import Wizard, House, Teacher, HousePoints, ReportJob, ReportKind
+from app.database.directory import TeacherRecord, WizardRecord, bump_directory_version, directory
+from app.database.checkpoints import (
+    calculate_balance, calculate_running_balances, transaction_models, get_standings_at, get_standings_series
+)
+from app.database.search import apply_search
+from app.database.dashboard import dashboard_cache
+from app.database.changes import change_notifier, record_change
+from app.database.shared_state import shared_state
+from app.database.reports import create_report_job, get_report_job, get_report_jobs, report_runner
+from app.database.analytics import GroupedPoints, analytics_store, get_teacher_names, period_key
+from app.database.sketches import (
+    HLL_RELATIVE_ERROR, KLL_RANK_ERROR, get_distinct_wizards, get_point_quantiles, sketch_store
+)
+from app.api.executor import in_thread_pool
+from app.api.selection import HOUSE_POINTS_COLUMNS, projected_columns, selected_fields
+from app.database.deadlines import QueryCancelledError, QueryTimeoutError, statement_deadline
+from app.database.leaderboards import get_top_teachers, get_top_wizards, leaderboards, record_award
+from app.utils.helpers import to_naive_utc
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc
+from sqlalchemy import case, func, desc, select
 from enum import Enum
 
 @strawberry.enum
@@ -24,6 +44,28 @@ class GroupByEnum(Enum):
     TEACHER = "teacher"
     HOUSE = "house"
 
+@strawberry.enum
+class StepEnum(Enum):
+    """Enum for the interval between points of a standings series"""
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+@strawberry.enum
+class ReportKindEnum(Enum):
+    """Reports generated in the background by requestReport"""
+    STUDENT_TOTALS = "student_totals"
+    TEACHER_SUMMARY = "teacher_summary"
+    WEEKLY_SERIES = "weekly_series"
+
+@strawberry.enum
+class ReportStatusEnum(Enum):
+    """Lifecycle of a report job"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
 @strawberry.type
 class WizardType:
     """GraphQL type that represents a wizard, maps to Wizard model"""
@@ -64,7 +106,7 @@ class HousePointsType:
     points: int
     reason: Optional[str] = None
     timestamp: datetime
-    teacher: TeacherType
+    teacher: Optional[TeacherType]
     is_deduction: bool
 
 @strawberry.input
@@ -74,6 +116,7 @@ class HousePointsInput:
     points: int  # Can be positive (award) or negative (deduct)
     reason: Optional[str] = None
     teacher_id: int
+    wizard_id: Optional[int] = None  # Student who earned the points, None for house-wide points
 
 @strawberry.type
 class PointHistoryEntry:
@@ -84,7 +127,7 @@ class PointHistoryEntry:
     cumulative_points: int
     is_deduction: bool
     reason: Optional[str] = None
-    teacher: TeacherType
+    teacher: Optional[TeacherType]
 
 @strawberry.type
 class PointHistoryGroupedEntry:
@@ -96,194 +139,196 @@ class PointHistoryGroupedEntry:
 
 # ====== WIZARD DATABASE OPERATIONS ======
 
-def get_all_wizards(db: Session) -> List[Wizard]:
-    """
-    Retrieves all wizards from the database.
-    
-    Args:
-        db: SQLAlchemy database session
-        
-    Returns:
-        List of Wizard database models
-    """
-    return db.query(Wizard).all()
-
-def get_wizard_by_id(id: int, db: Session) -> Optional[Wizard]:
+def create_wizard(wizard_data: WizardInput, db: Session, school_id: int) -> Wizard:
     """
-    Retrieves a specific wizard by ID.
-    
-    Args:
-        id: The ID of the wizard to find
-        db: SQLAlchemy database session
-        
-    Returns:
-        Wizard model if found, None otherwise
-    """
-    return db.query(Wizard).filter(Wizard.id == id).first()
-
-def create_wizard(wizard_data: WizardInput, db: Session) -> Wizard:
-    """
-    Creates a new wizard in the database.
+    Creates a new wizard in a school.
     
     Args:
         wizard_data: Input data with wizard details
         db: SQLAlchemy database session
+        school_id: School of the wizard
         
     Returns:
         The newly created Wizard model instance
     """
     db_wizard = Wizard(
+        school_id=school_id,
         name=wizard_data.name,
         house=wizard_data.house.value,
         wand=wizard_data.wand,
         patronus=wizard_data.patronus
     )
     db.add(db_wizard)
+    bump_directory_version(db, school_id)
     db.commit()
     db.refresh(db_wizard)
+    directory.school(school_id).load(db)
     return db_wizard
 
 # ====== TEACHER DATABASE OPERATIONS ======
 
-def get_all_teachers(db: Session) -> List[Teacher]:
+def create_teacher(teacher_data: TeacherInput, db: Session, school_id: int) -> Teacher:
     """
-    Retrieves all teachers from the database.
-    
-    Args:
-        db: SQLAlchemy database session
-        
-    Returns:
-        List of Teacher database models
-    """
-    return db.query(Teacher).all()
-
-def get_teacher_by_id(id: int, db: Session) -> Optional[Teacher]:
-    """
-    Retrieves a specific teacher by ID.
-    
-    Args:
-        id: The ID of the teacher to find
-        db: SQLAlchemy database session
-        
-    Returns:
-        Teacher model if found, None otherwise
-    """
-    return db.query(Teacher).filter(Teacher.id == id).first()
-
-def create_teacher(teacher_data: TeacherInput, db: Session) -> Teacher:
-    """
-    Creates a new teacher in the database.
+    Creates a new teacher in a school.
     
     Args:
         teacher_data: Input data with teacher details
         db: SQLAlchemy database session
+        school_id: School of the teacher
         
     Returns:
         The newly created Teacher model instance
     """
     db_teacher = Teacher(
+        school_id=school_id,
         name=teacher_data.name,
         subject=teacher_data.subject,
         house=teacher_data.house.value if teacher_data.house else None
     )
     db.add(db_teacher)
+    bump_directory_version(db, school_id)
     db.commit()
     db.refresh(db_teacher)
+    directory.school(school_id).load(db)
     return db_teacher
 
 # ====== HOUSE POINTS DATABASE OPERATIONS ======
 
-def get_all_house_points(db: Session) -> List[HousePoints]:
+def select_house_points(
+    db: Session,
+    school_id: int,
+    columns: Sequence[Any],
+    house: Optional[House] = None
+) -> List[Row]:
     """
-    Retrieves all house points records from the database.
+    Retrieves only the given columns of the house points records of a school.
     
-    Args:
-        db: SQLAlchemy database session
-        
-    Returns:
-        List of HousePoints database models
-    """
-    return db.query(HousePoints).all()
-
-def get_house_points_by_house(house: House, db: Session) -> List[HousePoints]:
-    """
-    Retrieves house points for a specific house.
+    Rows are plain tuples, so no ORM entity is built or tracked.
     
     Args:
-        house: The house to filter by
         db: SQLAlchemy database session
+        school_id: School of the records
+        columns: HousePoints columns to load (see projected_columns)
+        house: Optional house to filter by
         
     Returns:
-        List of HousePoints database models for the specified house
+        List of rows with the requested columns
     """
-    return db.query(HousePoints).filter(HousePoints.house == house).all()
+    statement = select(*columns).where(HousePoints.school_id == school_id)
+    if house:
+        statement = statement.where(HousePoints.house == house)
+    return db.execute(statement).all()
 
-def get_house_points_sum(house: House, db: Session) -> int:
+def get_house_points_sum(house: House, db: Session, school_id: int) -> int:
     """
-    Calculates the total points for a specific house.
+    Calculates the total points for a specific house of a school.
+    
+    Starts from the latest balance checkpoint and only sums the transactions after it.
     
     Args:
         house: The house to calculate points for
         db: SQLAlchemy database session
+        school_id: School of the house
         
     Returns:
         Integer representing total points (can be negative)
     """
-    result = db.query(
-        HousePoints.house, 
-        func.sum(HousePoints.points).label('total')
-    ).filter(HousePoints.house == house).group_by(HousePoints.house).first()
-    
-    return result.total if result else 0
+    # Published by the worker that recorded the latest award of the house
+    shared_totals = shared_state.house_totals(school_id)
+    if shared_totals is not None:
+        return shared_totals[House(house)]
+    if analytics_store.enabled:
+        analytics_store.ensure_fresh(db)
+        return analytics_store.balance(school_id, house)
+    return calculate_balance(db, school_id, house)
 
-def modify_house_points(points_data: HousePointsInput, db: Session) -> HousePoints:
+def modify_house_points(points_data: HousePointsInput, db: Session, school_id: int) -> HousePoints:
     """
     Adds a new house points record (positive for awards, negative for deductions).
     
     Args:
         points_data: Input data with points details
         db: SQLAlchemy database session
+        school_id: School of the house; the teacher and wizard must belong to it
         
     Returns:
         The newly created HousePoints model instance
     """
+    # Teachers and wizards of other schools are reported as missing, not as forbidden
+    school_directory = directory.school(school_id)
+    if school_directory.teacher(db, points_data.teacher_id) is None:
+        raise ValueError(f"Teacher {points_data.teacher_id} not found")
+    wizard = school_directory.wizard(db, points_data.wizard_id) if points_data.wizard_id is not None else None
+    if points_data.wizard_id is not None and wizard is None:
+        raise ValueError(f"Wizard {points_data.wizard_id} not found")
+    
     # Store the points value as is (positive for award, negative for deduction)
     db_points = HousePoints(
+        school_id=school_id,
         house=points_data.house.value,
         points=points_data.points,
         reason=points_data.reason,
-        teacher_id=points_data.teacher_id
+        teacher_id=points_data.teacher_id,
+        wizard_id=points_data.wizard_id
     )
     db.add(db_points)
+    
+    # Keep the leaderboard running totals and the change feed outbox in the same transaction
+    wizard_total, teacher_total = record_award(db, db_points, wizard.house if wizard else None)
+    db.flush()
+    change_id = record_change(db, db_points)
     db.commit()
     db.refresh(db_points)
+    change_notifier.notify(school_id, change_id)
+    if shared_state.enabled:
+        # Read after the commit, so the balance includes this change
+        shared_state.publish_balance(
+            school_id, db_points.house, change_id, calculate_balance(db, school_id, db_points.house)
+        )
+    leaderboards.school(school_id).apply(
+        wizard.house if wizard else None, db_points.wizard_id, wizard_total, db_points.teacher_id, teacher_total
+    )
+    dashboard_cache.invalidate(school_id)
+    if analytics_store.enabled:
+        analytics_store.append(db_points)
+    if sketch_store.enabled:
+        sketch_store.append(db_points)
     return db_points
 
 # ====== POINT HISTORY OPERATIONS ======
 
 def get_points_history(
     db: Session, 
+    school_id: int,
     house: Optional[House] = None,
     teacher_id: Optional[int] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    limit: int = 50
+    limit: int = 50,
+    search: Optional[str] = None,
+    columns: Optional[Sequence[Any]] = None
 ) -> List[HousePoints]:
     """
-    Retrieves house points history with optional filtering.
+    Retrieves house points history of a school with optional filtering.
     
     Args:
         db: SQLAlchemy database session
+        school_id: School of the history
         house: Optional house to filter by
         teacher_id: Optional teacher ID to filter by
         start_date: Optional start date for filtering
         end_date: Optional end date for filtering
         limit: Maximum number of records to return
+        search: Optional text to search in reasons, teacher and student names
+            (results are ordered by relevance, then newest first)
+        columns: Optional HousePoints columns to load instead of whole models
         
     Returns:
-        List of HousePoints database models matching the filters
+        List of HousePoints database models matching the filters, or rows of
+        the given columns
     """
-    query = db.query(HousePoints)
+    query = db.query(*columns) if columns else db.query(HousePoints)
+    query = query.filter(HousePoints.school_id == school_id)
     
     if house:
         query = query.filter(HousePoints.house == house)
@@ -291,52 +336,60 @@ def get_points_history(
     if teacher_id:
         query = query.filter(HousePoints.teacher_id == teacher_id)
     
+    # Compare the raw timestamp column so PostgreSQL can prune partitions
     if start_date:
         query = query.filter(HousePoints.timestamp >= start_date)
     
     if end_date:
         query = query.filter(HousePoints.timestamp <= end_date)
     
+    if search:
+        query = apply_search(db, query, search)
+    
     return query.order_by(desc(HousePoints.timestamp)).limit(limit).all()
 
-def calculate_cumulative_points(
+def get_cumulative_points(
     db: Session,
-    house: House,
-    up_to_timestamp: datetime
-) -> int:
+    school_id: int,
+    instants: List[Tuple[House, datetime]]
+) -> Dict[Tuple[House, datetime], int]:
     """
-    Calculates the total points for a house up to a specific point in time.
+    Calculates the total points of houses up to several points in time.
+    
+    Uses one windowed query after the nearest balance checkpoints (or the columnar store).
     
     Args:
         db: SQLAlchemy database session
-        house: The house to calculate points for
-        up_to_timestamp: Datetime up to which to calculate points
+        school_id: School of the houses
+        instants: (house, datetime) pairs to calculate points for
         
     Returns:
-        Integer representing cumulative points
+        Dictionary mapping each (House, datetime) pair to the cumulative points
     """
-    result = db.query(
-        func.sum(HousePoints.points).label('total')
-    ).filter(
-        HousePoints.house == house,
-        HousePoints.timestamp <= up_to_timestamp
-    ).first()
-    
-    return result.total if result and result.total else 0
+    if analytics_store.enabled:
+        analytics_store.ensure_fresh(db)
+        return {
+            (House(house), at): analytics_store.balance(school_id, house, at) for house, at in instants
+        }
+    return calculate_running_balances(db, school_id, instants)
 
 def get_points_grouped(
     db: Session,
+    school_id: int,
     group_by: str,
     house: Optional[House] = None,
     teacher_id: Optional[int] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None
-) -> List[dict]:
+) -> List[GroupedPoints]:
     """
-    Groups house points by various criteria for analytics.
+    Groups the house points of a school by various criteria for analytics.
+    
+    Served from the columnar analytics store when it is enabled, from SQL otherwise.
     
     Args:
         db: SQLAlchemy database session
+        school_id: School of the transactions
         group_by: Criteria to group by (day, week, month, teacher, house)
         house: Optional house to filter by
         teacher_id: Optional teacher ID to filter by
@@ -344,43 +397,62 @@ def get_points_grouped(
         end_date: Optional end date for filtering
         
     Returns:
-        List of dictionaries with grouped data
-    """
-    
-    if group_by == "day":
-        # PostgreSQL date_trunc for grouping by day
-        group_expr = func.date_trunc('day', HousePoints.timestamp).label('group_key')
-    elif group_by == "week":
-        group_expr = func.date_trunc('week', HousePoints.timestamp).label('group_key')
-    elif group_by == "month":
-        group_expr = func.date_trunc('month', HousePoints.timestamp).label('group_key')
-    elif group_by == "teacher":
-        group_expr = Teacher.name.label('group_key')
-    elif group_by == "house":
-        group_expr = HousePoints.house.label('group_key')
-    else:
-        raise ValueError(f"Invalid group_by parameter: {group_by}")
-    
-    query = db.query(
-        group_expr,
-        func.sum(HousePoints.points).label('total_points'),
-        func.count(func.case([(HousePoints.points > 0, 1)])).label('awards_count'),
-        func.count(func.case([(HousePoints.points < 0, 1)])).label('deductions_count')
-    ).join(Teacher, HousePoints.teacher_id == Teacher.id)
-    
-    if house:
-        query = query.filter(HousePoints.house == house)
-    
-    if teacher_id:
-        query = query.filter(HousePoints.teacher_id == teacher_id)
+        List of GroupedPoints ordered by group key (YYYY-MM-DD for periods,
+        the teacher name or the house name otherwise)
+    """
+    if analytics_store.enabled:
+        analytics_store.ensure_fresh(db)
+        return analytics_store.grouped(
+            school_id,
+            group_by,
+            get_teacher_names(db, school_id) if group_by == "teacher" else {},
+            house=house,
+            teacher_id=teacher_id,
+            start_date=start_date,
+            end_date=end_date
+        )
     
-    if start_date:
-        query = query.filter(HousePoints.timestamp >= start_date)
+    if group_by not in ("day", "week", "month", "teacher", "house"):
+        raise ValueError(f"Invalid group_by parameter: {group_by}")
     
-    if end_date:
-        query = query.filter(HousePoints.timestamp <= end_date)
+    # Compacted transactions are grouped from the archive and merged in
+    groups = {}
+    for model in transaction_models(db, school_id, start_date, end_date):
+        if group_by == "teacher":
+            group_expr = Teacher.name.label('group_key')
+        elif group_by == "house":
+            group_expr = model.house.label('group_key')
+        else:
+            group_expr = period_key(db.get_bind().dialect.name, model.timestamp, group_by).label('group_key')
+        
+        query = db.query(
+            group_expr,
+            func.sum(model.points).label('total_points'),
+            func.count(case((model.points > 0, 1))).label('awards_count'),
+            func.count(case((model.points < 0, 1))).label('deductions_count')
+        ).join(Teacher, model.teacher_id == Teacher.id).filter(model.school_id == school_id)
+        
+        if house:
+            query = query.filter(model.house == house)
+        
+        if teacher_id:
+            query = query.filter(model.teacher_id == teacher_id)
+        
+        # Filter on the raw column (not the truncated group key) to keep partition pruning
+        if start_date:
+            query = query.filter(model.timestamp >= start_date)
+        
+        if end_date:
+            query = query.filter(model.timestamp <= end_date)
+        
+        for group_key, total_points, awards_count, deductions_count in query.group_by(group_expr):
+            key = group_key.value if isinstance(group_key, House) else group_key
+            totals = groups.setdefault(key, [0, 0, 0])
+            totals[0] += total_points
+            totals[1] += awards_count
+            totals[2] += deductions_count
     
-    return query.group_by(group_expr).all()
+    return [GroupedPoints(key, *totals) for key, totals in sorted(groups.items())]
 
 @strawberry.type
 class HouseTotalType:
@@ -388,6 +460,220 @@ class HouseTotalType:
     house: HouseEnum
     total_points: int
 
+@strawberry.type
+class WizardLeaderboardEntry:
+    """GraphQL type for a wizard's position on the student leaderboard"""
+    wizard: WizardType
+    total_points: int
+
+@strawberry.type
+class TeacherLeaderboardEntry:
+    """GraphQL type for a teacher's position on the teacher leaderboard"""
+    teacher: TeacherType
+    total_points: int
+
+@strawberry.type
+class StandingsSnapshotType:
+    """GraphQL type for the house cup standings at a point in time"""
+    at: datetime
+    standings: List[HouseTotalType]
+
+@strawberry.type
+class HouseTrendEntry:
+    """GraphQL type for a house's points on one day, used for dashboard trends"""
+    day: str
+    house: HouseEnum
+    total_points: int
+    awards_count: int
+    deductions_count: int
+
+@strawberry.type
+class ReportJobType:
+    """GraphQL type for a background report job, maps to ReportJob model"""
+    id: str
+    kind: ReportKindEnum
+    status: ReportStatusEnum
+    progress: float  # 0 to 1
+    start_date: datetime
+    end_date: datetime
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    rows: Optional[int] = None
+    size: Optional[int] = None  # Bytes
+    download_url: Optional[str] = None  # CSV file, supports HTTP range requests
+
+@strawberry.type
+class DistinctWizardsEntry:
+    """GraphQL type for the number of distinct wizards awarded points in a house (whole school when house is null)"""
+    house: Optional[HouseEnum]
+    wizards: int
+    approximate: bool
+    relative_error: float  # Relative standard error of approximate counts, 0 when exact
+
+@strawberry.type
+class PointQuantile:
+    """GraphQL type for the award size at a quantile"""
+    quantile: float
+    points: Optional[int]  # None when there were no awards
+
+@strawberry.type
+class PointQuantilesType:
+    """GraphQL type for the distribution of award sizes over a period"""
+    awards: int
+    quantiles: List[PointQuantile]
+    approximate: bool
+    rank_error: float  # Maximum rank error of approximate quantiles (99% confidence), 0 when exact
+
+@strawberry.type
+class DashboardType:
+    """GraphQL type for everything shown on the dashboard page"""
+    standings: List[HouseTotalType]
+    recent_history: List[PointHistoryEntry]
+    trends: List[HouseTrendEntry]
+
+def to_house_totals(standings: dict) -> List[HouseTotalType]:
+    """
+    Converts a house-to-points mapping into HouseTotalType objects.
+    
+    Args:
+        standings: Dictionary mapping House to points
+        
+    Returns:
+        List of HouseTotalType objects in house order
+    """
+    return [
+        HouseTotalType(house=HouseEnum(house.value), total_points=standings.get(house, 0))
+        for house in House
+    ]
+
+@lru_cache(maxsize=4096)
+def to_teacher_type(record: Optional[TeacherRecord]) -> Optional[TeacherType]:
+    """
+    Converts a cached teacher record into a TeacherType.
+    
+    Records are immutable, so the same TeacherType instance is reused
+    for every row awarded by that teacher.
+    
+    Args:
+        record: TeacherRecord from the directory cache, or None when the
+            teacher was not found
+        
+    Returns:
+        TeacherType for the record, or None without a record
+    """
+    if record is None:
+        return None
+    return TeacherType(
+        id=record.id,
+        name=record.name,
+        subject=record.subject,
+        house=HouseEnum(record.house) if record.house else None
+    )
+
+@lru_cache(maxsize=4096)
+def to_wizard_type(record: WizardRecord) -> WizardType:
+    """
+    Converts a cached wizard record into a WizardType.
+    
+    Args:
+        record: WizardRecord from the directory cache
+        
+    Returns:
+        WizardType for the record
+    """
+    return WizardType(
+        id=record.id,
+        name=record.name,
+        house=HouseEnum(record.house),
+        wand=record.wand,
+        patronus=record.patronus
+    )
+
+def to_points_values(
+    row: Row,
+    fields: FrozenSet[str],
+    teacher_of: Callable[[int], TeacherType]
+) -> Dict[str, Any]:
+    """
+    Maps a projected house points row to the fields of HousePointsType / PointHistoryEntry.
+    
+    Fields that were not selected are None: GraphQL never resolves them.
+    
+    Args:
+        row: Row loaded with the columns of projected_columns(fields, HOUSE_POINTS_COLUMNS)
+        fields: Selected fields
+        teacher_of: Returns the TeacherType of a teacher id (only called when teacher is selected)
+        
+    Returns:
+        Dictionary of field values (points as an absolute value)
+    """
+    values = row._mapping
+    points = values.get("points")
+    return {
+        "house": HouseEnum(values["house"]) if "house" in fields else None,
+        "points": abs(points) if points is not None else None,
+        "is_deduction": points < 0 if points is not None else None,
+        "reason": values.get("reason"),
+        "timestamp": values.get("timestamp"),
+        "teacher": teacher_of(values["teacher_id"]) if "teacher" in fields else None,
+    }
+
+def to_report_job_type(job: ReportJob) -> ReportJobType:
+    """
+    Converts a ReportJob model into a ReportJobType.
+    
+    Args:
+        job: ReportJob database model
+        
+    Returns:
+        ReportJobType, with a download URL once the report succeeded
+    """
+    succeeded = job.status == ReportStatusEnum.SUCCEEDED.value
+    return ReportJobType(
+        id=job.id,
+        kind=ReportKindEnum(job.kind),
+        status=ReportStatusEnum(job.status),
+        progress=job.progress,
+        start_date=job.start_date,
+        end_date=job.end_date,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+        rows=job.rows,
+        size=job.size,
+        # Prefixed with the school, so the link works without an X-School-Id header
+        download_url=f"/schools/{job.school_id}/api/reports/{job.id}/download" if succeeded else None
+    )
+
+def with_deadline(name: str):
+    """
+    Bounds the database statements of a resolver by its configured deadline.
+    
+    Interrupted statements are reported as GraphQL errors with a
+    QUERY_TIMEOUT or QUERY_CANCELLED code in their extensions.
+    
+    Args:
+        name: Resolver name, used to look up STATEMENT_TIMEOUT_<NAME>
+        
+    Returns:
+        Decorator for a resolver
+    """
+    def decorator(resolver):
+        @wraps(resolver)
+        def wrapper(*args, **kwargs):
+            try:
+                with statement_deadline(name):
+                    return resolver(*args, **kwargs)
+            except QueryTimeoutError as e:
+                raise GraphQLError(str(e), extensions={"code": "QUERY_TIMEOUT", "timeoutSeconds": e.seconds}) from e
+            except QueryCancelledError as e:
+                raise GraphQLError(str(e), extensions={"code": "QUERY_CANCELLED"}) from e
+        return wrapper
+    return decorator
+
 @strawberry.type
 class Query:
     """
@@ -396,6 +682,7 @@ class Query:
     """
     
     @strawberry.field
+    @in_thread_pool
     def wizards(self, info) -> List[WizardType]:
         """
         GraphQL resolver that returns all wizards.
@@ -406,20 +693,11 @@ class Query:
         Returns:
             List of WizardType objects
         """
-        db = next(get_db())
-        wizards = get_all_wizards(db)
-        return [
-            WizardType(
-                id=w.id,
-                name=w.name,
-                house=HouseEnum(w.house),
-                wand=w.wand,
-                patronus=w.patronus
-            )
-            for w in wizards
-        ]
+        with info.context.session() as db:
+            return [to_wizard_type(w) for w in info.context.directory.wizards(db)]
     
     @strawberry.field
+    @in_thread_pool
     def wizard(self, info, id: int) -> Optional[WizardType]:
         """
         GraphQL resolver that returns a specific wizard by ID.
@@ -431,19 +709,12 @@ class Query:
         Returns:
             WizardType if found, None otherwise
         """
-        db = next(get_db())
-        wizard = get_wizard_by_id(id, db)
-        if wizard:
-            return WizardType(
-                id=wizard.id,
-                name=wizard.name,
-                house=HouseEnum(wizard.house),
-                wand=wizard.wand,
-                patronus=wizard.patronus
-            )
-        return None
+        with info.context.session() as db:
+            wizard = info.context.directory.wizard(db, id)
+            return to_wizard_type(wizard) if wizard else None
     
     @strawberry.field
+    @in_thread_pool
     def teachers(self, info) -> List[TeacherType]:
         """
         GraphQL resolver that returns all teachers.
@@ -454,19 +725,11 @@ class Query:
         Returns:
             List of TeacherType objects
         """
-        db = next(get_db())
-        teachers = get_all_teachers(db)
-        return [
-            TeacherType(
-                id=t.id,
-                name=t.name,
-                subject=t.subject,
-                house=HouseEnum(t.house) if t.house else None
-            )
-            for t in teachers
-        ]
+        with info.context.session() as db:
+            return [to_teacher_type(t) for t in info.context.directory.teachers(db)]
     
     @strawberry.field
+    @in_thread_pool
     def teacher(self, info, id: int) -> Optional[TeacherType]:
         """
         GraphQL resolver that returns a specific teacher by ID.
@@ -478,18 +741,13 @@ class Query:
         Returns:
             TeacherType if found, None otherwise
         """
-        db = next(get_db())
-        teacher = get_teacher_by_id(id, db)
-        if teacher:
-            return TeacherType(
-                id=teacher.id,
-                name=teacher.name,
-                subject=teacher.subject,
-                house=HouseEnum(teacher.house) if teacher.house else None
-            )
-        return None
+        with info.context.session() as db:
+            teacher = info.context.directory.teacher(db, id)
+            return to_teacher_type(teacher) if teacher else None
     
     @strawberry.field
+    @in_thread_pool
+    @with_deadline("house_points")
     def house_points(self, info, house: Optional[HouseEnum] = None) -> List[HousePointsType]:
         """
         GraphQL resolver that returns house points records, optionally filtered by house.
@@ -501,31 +759,24 @@ class Query:
         Returns:
             List of HousePointsType objects
         """
-        db = next(get_db())
-        if house:
-            points = get_house_points_by_house(house.value, db)
-        else:
-            points = get_all_house_points(db)
-            
-        return [
-            HousePointsType(
-                id=p.id,
-                house=HouseEnum(p.house),
-                points=abs(p.points),  # Always return absolute value
-                reason=p.reason,
-                timestamp=p.timestamp,
-                is_deduction=p.points < 0,  # Determine if this was a deduction
-                teacher=TeacherType(
-                    id=p.teacher.id,
-                    name=p.teacher.name,
-                    subject=p.teacher.subject,
-                    house=HouseEnum(p.teacher.house) if p.teacher.house else None
-                )
+        # Only load the columns of the selected fields (no reason / teacher unless asked for)
+        fields = selected_fields(info)
+        with info.context.session() as db:
+            rows = select_house_points(
+                db,
+                info.context.school_id,
+                projected_columns(fields, HOUSE_POINTS_COLUMNS),
+                house=house.value if house else None
             )
-            for p in points
-        ]
+            teacher_of = lambda id: to_teacher_type(info.context.directory.teacher(db, id))
+            
+            return [
+                HousePointsType(id=row._mapping.get("id"), **to_points_values(row, fields, teacher_of))
+                for row in rows
+            ]
     
     @strawberry.field
+    @in_thread_pool
     def house_totals(self, info) -> List[HouseTotalType]:
         """
         GraphQL resolver that returns total points for all houses (house cup standings).
@@ -536,24 +787,181 @@ class Query:
         Returns:
             List of HouseTotalType objects with current standings
         """
-        db = next(get_db())
-        houses = [h.value for h in House]
-        return [
-            HouseTotalType(
-                house=HouseEnum(house),
-                total_points=get_house_points_sum(house, db)
+        with info.context.session() as db:
+            houses = [h.value for h in House]
+            return [
+                HouseTotalType(
+                    house=HouseEnum(house),
+                    total_points=info.context.load(("balance", house), lambda: get_house_points_sum(house, db, info.context.school_id))
+                )
+                for house in houses
+            ]
+    
+    @strawberry.field
+    @in_thread_pool
+    @with_deadline("standings_at")
+    def standings_at(self, info, at: datetime) -> List[HouseTotalType]:
+        """
+        GraphQL resolver that returns the house cup standings at a point in time.
+        
+        Args:
+            info: GraphQL resolver info
+            at: Point in time (inclusive)
+            
+        Returns:
+            List of HouseTotalType objects with the standings at that time
+        """
+        with info.context.session() as db:
+            return to_house_totals(get_standings_at(db, info.context.school_id, to_naive_utc(at)))
+    
+    @strawberry.field
+    @in_thread_pool
+    @with_deadline("standings_series")
+    def standings_series(
+        self,
+        info,
+        from_: Annotated[datetime, strawberry.argument(name="from")],
+        to: datetime,
+        step: StepEnum = StepEnum.DAY
+    ) -> List[StandingsSnapshotType]:
+        """
+        GraphQL resolver that returns the standings at every step between two instants.
+        
+        Args:
+            info: GraphQL resolver info
+            from_: First instant of the series
+            to: Last instant allowed in the series
+            step: Interval between two instants (day, week, month)
+            
+        Returns:
+            List of StandingsSnapshotType objects in chronological order
+        """
+        with info.context.session() as db:
+            series = get_standings_series(db, info.context.school_id, to_naive_utc(from_), to_naive_utc(to), step.value)
+            return [
+                StandingsSnapshotType(at=at, standings=to_house_totals(standings))
+                for at, standings in series
+            ]
+    
+    @strawberry.field
+    @in_thread_pool
+    @with_deadline("top_wizards")
+    def top_wizards(
+        self,
+        info,
+        house: Optional[HouseEnum] = None,
+        limit: int = 10,
+        since: Optional[datetime] = None
+    ) -> List[WizardLeaderboardEntry]:
+        """
+        GraphQL resolver that returns the students who earned the most points.
+        
+        Args:
+            info: GraphQL resolver info
+            house: Optional house to restrict the leaderboard to (the students' own house)
+            limit: Number of students to return (1 to LEADERBOARD_MAX_LIMIT)
+            since: Optional start of the period to rank over (default: all time)
+            
+        Returns:
+            List of WizardLeaderboardEntry objects, best first
+        """
+        with info.context.session() as db:
+            ranking = get_top_wizards(
+                db,
+                info.context.school_id,
+                house=house.value if house else None,
+                limit=limit,
+                since=to_naive_utc(since) if since else None
             )
-            for house in houses
-        ]
+            return [
+                WizardLeaderboardEntry(wizard=to_wizard_type(wizard), total_points=total)
+                for wizard, total in ((info.context.directory.wizard(db, id), total) for id, total in ranking)
+                if wizard
+            ]
+    
+    @strawberry.field
+    @in_thread_pool
+    @with_deadline("top_teachers")
+    def top_teachers(
+        self,
+        info,
+        limit: int = 10,
+        since: Optional[datetime] = None
+    ) -> List[TeacherLeaderboardEntry]:
+        """
+        GraphQL resolver that returns the teachers who gave the most points.
+        
+        Args:
+            info: GraphQL resolver info
+            limit: Number of teachers to return (1 to LEADERBOARD_MAX_LIMIT)
+            since: Optional start of the period to rank over (default: all time)
+            
+        Returns:
+            List of TeacherLeaderboardEntry objects, best first
+        """
+        with info.context.session() as db:
+            ranking = get_top_teachers(db, info.context.school_id, limit=limit, since=to_naive_utc(since) if since else None)
+            return [
+                TeacherLeaderboardEntry(teacher=to_teacher_type(teacher), total_points=total)
+                for teacher, total in ((info.context.directory.teacher(db, id), total) for id, total in ranking)
+                if teacher
+            ]
     
     @strawberry.field
+    @in_thread_pool
+    @with_deadline("dashboard")
+    def dashboard(self, info, days: int = 30, limit: int = 10) -> DashboardType:
+        """
+        GraphQL resolver that returns the standings, recent history and daily
+        trends of the dashboard in one response.
+        
+        Args:
+            info: GraphQL resolver info
+            days: Number of days covered by the history and trends (1 to DASHBOARD_MAX_DAYS)
+            limit: Maximum number of history entries to return (1 to DASHBOARD_MAX_LIMIT)
+            
+        Returns:
+            DashboardType object
+        """
+        with info.context.session() as db:
+            data = dashboard_cache.get(db, info.context.school_id, days, limit)
+            return DashboardType(
+                standings=to_house_totals(data.standings),
+                recent_history=[
+                    PointHistoryEntry(
+                        timestamp=p.timestamp,
+                        house=HouseEnum(p.house.value),
+                        points=abs(p.points),
+                        cumulative_points=p.cumulative_points,
+                        is_deduction=p.points < 0,
+                        reason=p.reason,
+                        teacher=to_teacher_type(info.context.directory.teacher(db, p.teacher_id))
+                    )
+                    for p in data.recent
+                ],
+                trends=[
+                    HouseTrendEntry(
+                        day=t.day,
+                        house=HouseEnum(t.house.value),
+                        total_points=t.total_points,
+                        awards_count=t.awards_count,
+                        deductions_count=t.deductions_count
+                    )
+                    for t in data.trends
+                ]
+            )
+    
+    @strawberry.field
+    @in_thread_pool
+    @with_deadline("points_history")
     def points_history(
         self, 
         info, 
         house: Optional[HouseEnum] = None,
         teacher_id: Optional[int] = None,
         days_ago: Optional[int] = None,
-        limit: int = 50
+        limit: int = 50,
+        search: Optional[str] = None
     ) -> List[PointHistoryEntry]:
         """
         GraphQL resolver that returns detailed points history with filtering options.
@@ -564,48 +972,46 @@ class Query:
             teacher_id: Optional teacher ID to filter by
             days_ago: Optional number of days to look back
             limit: Maximum number of records to return
+            search: Optional text to search in reasons, teacher and student names
             
         Returns:
             List of PointHistoryEntry objects
         """
-        db = next(get_db())
+        fields = selected_fields(info)
+        with info.context.session() as db:
         
-        # Calculate start date if days_ago is provided
-        start_date = None
-        if days_ago:
-            start_date = datetime.utcnow() - timedelta(days=days_ago)
+            # Calculate start date if days_ago is provided
+            start_date = None
+            if days_ago:
+                start_date = datetime.utcnow() - timedelta(days=days_ago)
         
-        points = get_points_history(
-            db, 
-            house=house.value if house else None,
-            teacher_id=teacher_id,
-            start_date=start_date,
-            limit=limit
-        )
+            rows = get_points_history(
+                db, 
+                info.context.school_id,
+                house=house.value if house else None,
+                teacher_id=teacher_id,
+                start_date=start_date,
+                limit=limit,
+                search=search,
+                columns=projected_columns(fields, HOUSE_POINTS_COLUMNS)
+            )
+            teacher_of = lambda id: to_teacher_type(info.context.directory.teacher(db, id))
         
-        result = []
-        for p in points:
-            # Calculate cumulative points up to this point for the house
-            cumulative = calculate_cumulative_points(db, p.house, p.timestamp)
-            
-            result.append(PointHistoryEntry(
-                timestamp=p.timestamp,
-                house=HouseEnum(p.house),
-                points=abs(p.points),
-                cumulative_points=cumulative,
-                is_deduction=p.points < 0,
-                reason=p.reason,
-                teacher=TeacherType(
-                    id=p.teacher.id,
-                    name=p.teacher.name,
-                    subject=p.teacher.subject,
-                    house=HouseEnum(p.teacher.house) if p.teacher.house else None
-                )
-            ))
+            balances = {}
+            if "cumulative_points" in fields:
+                # Running balances of the house of every row, computed at once
+                balances = get_cumulative_points(db, info.context.school_id, [(row.house, row.timestamp) for row in rows])
         
-        return result
+            result = []
+            for row in rows:
+                cumulative = balances.get((House(row.house), row.timestamp)) if balances else None
+                result.append(PointHistoryEntry(cumulative_points=cumulative, **to_points_values(row, fields, teacher_of)))
+        
+            return result
     
     @strawberry.field
+    @in_thread_pool
+    @with_deadline("points_history_grouped")
     def points_history_grouped(
         self,
         info,
@@ -627,36 +1033,135 @@ class Query:
         Returns:
             List of PointHistoryGroupedEntry objects with analytics data
         """
-        db = next(get_db())
+        with info.context.session() as db:
         
-        # Calculate start date if days_ago is provided
-        start_date = None
-        if days_ago:
-            start_date = datetime.utcnow() - timedelta(days=days_ago)
+            # Calculate start date if days_ago is provided
+            start_date = None
+            if days_ago:
+                start_date = datetime.utcnow() - timedelta(days=days_ago)
         
-        groups = get_points_grouped(
-            db,
-            group_by=group_by.value,
-            house=house.value if house else None,
-            teacher_id=teacher_id,
-            start_date=start_date
-        )
+            groups = get_points_grouped(
+                db,
+                info.context.school_id,
+                group_by=group_by.value,
+                house=house.value if house else None,
+                teacher_id=teacher_id,
+                start_date=start_date
+            )
+        
+            # Period keys are already YYYY-MM-DD strings
+            return [
+                PointHistoryGroupedEntry(
+                    group_key=g.group_key,
+                    total_points=g.total_points,
+                    awards_count=g.awards_count,
+                    deductions_count=g.deductions_count
+                )
+                for g in groups
+            ]
+
+    @strawberry.field
+    @in_thread_pool
+    @with_deadline("distinct_wizards")
+    def distinct_wizards(self, info, days_ago: int = 30, exact: bool = False) -> List[DistinctWizardsEntry]:
+        """
+        GraphQL resolver that returns the number of distinct wizards awarded points per house.
+        
+        Args:
+            info: GraphQL resolver info
+            days_ago: The period starts on the (UTC) day of now - days_ago
+            exact: Count with SQL instead of the sketches
+            
+        Returns:
+            List of DistinctWizardsEntry objects, one per house then one for the whole school
+        """
+        with info.context.session() as db:
+            counts, approximate = get_distinct_wizards(db, info.context.school_id, days_ago, exact)
+            return [
+                DistinctWizardsEntry(
+                    house=HouseEnum(house.value) if house else None,
+                    wizards=wizards,
+                    approximate=approximate,
+                    relative_error=HLL_RELATIVE_ERROR if approximate else 0.0
+                )
+                for house, wizards in counts.items()
+            ]
+    
+    @strawberry.field
+    @in_thread_pool
+    @with_deadline("point_quantiles")
+    def point_quantiles(
+        self,
+        info,
+        quantiles: List[float] = (0.5, 0.9, 0.95, 0.99),
+        days_ago: int = 30,
+        house: Optional[HouseEnum] = None,
+        teacher_id: Optional[int] = None,
+        exact: bool = False
+    ) -> PointQuantilesType:
+        """
+        GraphQL resolver that returns quantiles of the award sizes (deductions excluded).
+        
+        Args:
+            info: GraphQL resolver info
+            quantiles: Quantiles to return, between 0 and 1
+            days_ago: The period starts on the (UTC) day of now - days_ago
+            house: Optional house to filter by
+            teacher_id: Optional teacher ID to filter by
+            exact: Compute with SQL instead of the sketches
+            
+        Returns:
+            PointQuantilesType with the award size at each quantile
+        """
+        with info.context.session() as db:
+            awards, values, approximate = get_point_quantiles(
+                db,
+                info.context.school_id,
+                days_ago,
+                list(quantiles),
+                house=house.value if house else None,
+                teacher_id=teacher_id,
+                exact=exact
+            )
+            return PointQuantilesType(
+                awards=awards,
+                quantiles=[PointQuantile(quantile=q, points=points) for q, points in zip(quantiles, values)],
+                approximate=approximate,
+                rank_error=KLL_RANK_ERROR if approximate else 0.0
+            )
+
+    @strawberry.field
+    @in_thread_pool
+    def report_job(self, info, id: str) -> Optional[ReportJobType]:
+        """
+        GraphQL resolver that returns the status and progress of a report job.
         
-        result = []
-        for g in groups:
-            # Convert date objects to strings for consistent return type
-            group_key = g.group_key
-            if group_by.value in ["day", "week", "month"]:
-                group_key = g.group_key.strftime("%Y-%m-%d")
+        Args:
+            info: GraphQL resolver info
+            id: ID of the job returned by requestReport
             
-            result.append(PointHistoryGroupedEntry(
-                group_key=str(group_key),
-                total_points=g.total_points,
-                awards_count=g.awards_count,
-                deductions_count=g.deductions_count
-            ))
+        Returns:
+            ReportJobType if found, None otherwise
+        """
+        with info.context.session() as db:
+            job = get_report_job(db, info.context.school_id, id)
+            return to_report_job_type(job) if job else None
+    
+    @strawberry.field
+    @in_thread_pool
+    def report_jobs(self, info, limit: int = 20) -> List[ReportJobType]:
+        """
+        GraphQL resolver that returns the latest report jobs.
         
-        return result
+        Args:
+            info: GraphQL resolver info
+            limit: Maximum number of jobs to return
+            
+        Returns:
+            List of ReportJobType objects, newest first
+        """
+        with info.context.session() as db:
+            return [to_report_job_type(job) for job in get_report_jobs(db, info.context.school_id, limit)]
 
 @strawberry.type
 class Mutation:
@@ -666,6 +1171,7 @@ class Mutation:
     """
     
     @strawberry.mutation
+    @in_thread_pool
     def create_wizard(self, info, wizard_data: WizardInput) -> WizardType:
         """
         GraphQL mutation that creates a new wizard.
@@ -677,17 +1183,12 @@ class Mutation:
         Returns:
             The newly created WizardType
         """
-        db = next(get_db())
-        wizard = create_wizard(wizard_data, db)
-        return WizardType(
-            id=wizard.id,
-            name=wizard.name,
-            house=HouseEnum(wizard.house),
-            wand=wizard.wand,
-            patronus=wizard.patronus
-        )
+        with info.context.session() as db:
+            wizard = create_wizard(wizard_data, db, info.context.school_id)
+            return to_wizard_type(info.context.directory.wizard(db, wizard.id))
     
     @strawberry.mutation
+    @in_thread_pool
     def create_teacher(self, info, teacher_data: TeacherInput) -> TeacherType:
         """
         GraphQL mutation that creates a new teacher.
@@ -699,16 +1200,12 @@ class Mutation:
         Returns:
             The newly created TeacherType
         """
-        db = next(get_db())
-        teacher = create_teacher(teacher_data, db)
-        return TeacherType(
-            id=teacher.id,
-            name=teacher.name,
-            subject=teacher.subject,
-            house=HouseEnum(teacher.house) if teacher.house else None
-        )
+        with info.context.session() as db:
+            teacher = create_teacher(teacher_data, db, info.context.school_id)
+            return to_teacher_type(info.context.directory.teacher(db, teacher.id))
     
     @strawberry.mutation
+    @in_thread_pool
     def award_house_points(self, info, points_data: HousePointsInput) -> HousePointsType:
         """
         GraphQL mutation that awards points to a house.
@@ -723,26 +1220,24 @@ class Mutation:
         if points_data.points <= 0:
             raise ValueError("Points must be positive when awarding")
             
-        db = next(get_db())
-        points = modify_house_points(points_data, db)
-        teacher = get_teacher_by_id(points.teacher_id, db)
-        
-        return HousePointsType(
-            id=points.id,
-            house=HouseEnum(points.house),
-            points=points.points,
-            reason=points.reason,
-            timestamp=points.timestamp,
-            is_deduction=False,
-            teacher=TeacherType(
-                id=teacher.id,
-                name=teacher.name,
-                subject=teacher.subject,
-                house=HouseEnum(teacher.house) if teacher.house else None
+        with info.context.session() as db:
+            points = modify_house_points(points_data, db, info.context.school_id)
+            # Balances loaded earlier in the request are stale now
+            info.context.invalidate()
+            teacher = info.context.directory.teacher(db, points.teacher_id)
+        
+            return HousePointsType(
+                id=points.id,
+                house=HouseEnum(points.house),
+                points=points.points,
+                reason=points.reason,
+                timestamp=points.timestamp,
+                is_deduction=False,
+                teacher=to_teacher_type(teacher)
             )
-        )
     
     @strawberry.mutation
+    @in_thread_pool
     def deduct_house_points(self, info, points_data: HousePointsInput) -> HousePointsType:
         """
         GraphQL mutation that deducts points from a house.
@@ -760,24 +1255,43 @@ class Mutation:
         # Convert to negative for deduction
         points_data.points = -points_data.points
             
-        db = next(get_db())
-        points = modify_house_points(points_data, db)
-        teacher = get_teacher_by_id(points.teacher_id, db)
-        
-        return HousePointsType(
-            id=points.id,
-            house=HouseEnum(points.house),
-            points=abs(points.points),  # Return absolute value
-            reason=points.reason,
-            timestamp=points.timestamp,
-            is_deduction=True,
-            teacher=TeacherType(
-                id=teacher.id,
-                name=teacher.name,
-                subject=teacher.subject,
-                house=HouseEnum(teacher.house) if teacher.house else None
+        with info.context.session() as db:
+            points = modify_house_points(points_data, db, info.context.school_id)
+            # Balances loaded earlier in the request are stale now
+            info.context.invalidate()
+            teacher = info.context.directory.teacher(db, points.teacher_id)
+        
+            return HousePointsType(
+                id=points.id,
+                house=HouseEnum(points.house),
+                points=abs(points.points),  # Return absolute value
+                reason=points.reason,
+                timestamp=points.timestamp,
+                is_deduction=True,
+                teacher=to_teacher_type(teacher)
             )
-        )
+    
+    @strawberry.mutation
+    @in_thread_pool
+    def request_report(self, info, kind: ReportKindEnum, days: int = 365) -> ReportJobType:
+        """
+        GraphQL mutation that queues a report, generated in the background.
+        
+        Poll reportJob(id) for its progress; the CSV file is downloaded from
+        the job's downloadUrl once it succeeded.
+        
+        Args:
+            info: GraphQL resolver info
+            kind: Report to generate
+            days: Number of days before now covered by the report
+            
+        Returns:
+            The queued ReportJobType
+        """
+        with info.context.session() as db:
+            job = create_report_job(db, info.context.school_id, ReportKind(kind.value), days)
+            report_runner.submit(job.id)
+            return to_report_job_type(job)
 
 # Create the GraphQL schema with the Query and Mutation types
 schema = strawberry.Schema(query=Query, mutation=Mutation) 
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+Projection pushdown for GraphQL resolvers.
+
+Resolvers returning database rows read the fields the client selected and
+only load the columns those fields need, as plain rows instead of ORM
+entities (no identity map, no unused strings such as `reason`). Fields
+under @skip / @include are treated as selected, so a projection may load
+more columns than needed but never fewer.
+"""
+from typing import Any, Dict, FrozenSet, Iterable, List, Sequence
+import re
+
+from app.models.models import HousePoints
+
+_CAMEL_BOUNDARY = re.compile(r"(?<!^)(?=[A-Z])")
+
+# Columns needed by each field of HousePointsType / PointHistoryEntry
+HOUSE_POINTS_COLUMNS: Dict[str, Sequence[Any]] = {
+    "id": (HousePoints.id,),
+    "house": (HousePoints.house,),
+    "points": (HousePoints.points,),
+    "is_deduction": (HousePoints.points,),
+    "reason": (HousePoints.reason,),
+    "timestamp": (HousePoints.timestamp,),
+    "teacher": (HousePoints.teacher_id,),
+    # The running balance is computed from the house and time of the transaction
+    "cumulative_points": (HousePoints.house, HousePoints.timestamp),
+}
+
+
+def _field_names(selections: Iterable[Any]) -> Iterable[str]:
+    for selection in selections:
+        # Fragment spreads and inline fragments have no name of their own
+        if hasattr(selection, "alias"):
+            yield selection.name
+        else:
+            yield from _field_names(selection.selections)
+
+
+def selected_fields(info) -> FrozenSet[str]:
+    """
+    Lists the fields selected on the value returned by a resolver.
+
+    Args:
+        info: GraphQL resolver info
+
+    Returns:
+        Python (snake_case) names of the selected fields, fragments included
+    """
+    names = set()
+    for field in info.selected_fields:
+        names.update(_field_names(field.selections))
+    names.discard("__typename")
+    return frozenset(_CAMEL_BOUNDARY.sub("_", name).lower() for name in names)
+
+
+def projected_columns(fields: FrozenSet[str], columns: Dict[str, Sequence[Any]]) -> List[Any]:
+    """
+    Computes the columns to load for a selection.
+
+    Args:
+        fields: Selected fields (see selected_fields)
+        columns: Columns needed by each field
+
+    Returns:
+        Columns in a stable order, without duplicates; the first column of
+        the mapping when no field needs one (one row per result still counts)
+    """
+    projection = {}
+    for name, needed in columns.items():
+        if name in fields:
+            projection.update((column.key, column) for column in needed)
+    return list(projection.values()) or list(next(iter(columns.values()))[:1])
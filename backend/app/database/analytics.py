@@ -0,0 +1,391 @@
+"""
+Columnar analytics engine for house points.
+
+When COLUMNAR_ANALYTICS=true and NumPy is installed (`pip install numpy`), every
+worker loads the house points transactions once into compact typed arrays and
+appends new awards as they are recorded. House totals, cumulative balances and
+grouped analytics are then answered with vectorized operations instead of SQL.
+The store holds every school; each query masks the rows of one school.
+Results are the same as the SQL path; without NumPy, SQL is used.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.models import House, HousePoints, HousePointsArchive, Teacher
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Serve analytics from the in-memory columnar store (requires NumPy)
+COLUMNAR_ANALYTICS = os.getenv("COLUMNAR_ANALYTICS", "false").lower() == "true"
+
+# Seconds after which the store picks up awards recorded by other worker processes
+COLUMNAR_REFRESH_SECONDS = float(os.getenv("COLUMNAR_REFRESH_SECONDS", "5"))
+
+# Ids below the highest loaded id that are read again when catching up, so
+# transactions committed out of id order are not missed
+COLUMNAR_CATCH_UP_OVERLAP = 1000
+
+# Rows fetched per round trip when loading the store
+LOAD_BATCH_SIZE = 100_000
+
+HOUSES = list(House)
+HOUSE_CODES = {house: code for code, house in enumerate(HOUSES)}
+
+EPOCH = datetime(1970, 1, 1)
+US_PER_DAY = 86_400_000_000
+
+# Largest code range aggregated with a dense bincount regardless of the row count
+MAX_DENSE_SPAN = 1 << 20
+
+
+class GroupedPoints(NamedTuple):
+    group_key: str
+    total_points: int
+    awards_count: int
+    deductions_count: int
+
+
+def period_key(dialect_name: str, timestamp_column, unit: str):
+    """
+    Returns an expression formatting the start of the day, week (Monday) or
+    month of a timestamp column as a YYYY-MM-DD string.
+
+    Args:
+        dialect_name: Name of the database dialect
+        timestamp_column: Timestamp column or expression
+        unit: "day", "week" or "month"
+
+    Returns:
+        SQL expression of the period key
+    """
+    if dialect_name == "postgresql":
+        return func.to_char(func.date_trunc(unit, timestamp_column), "YYYY-MM-DD")
+    if unit == "day":
+        return func.strftime("%Y-%m-%d", timestamp_column)
+    if unit == "week":
+        return func.date(timestamp_column, "weekday 0", "-6 days")
+    if unit == "month":
+        return func.strftime("%Y-%m-01", timestamp_column)
+    raise ValueError(f"Invalid period unit: {unit}")
+
+
+def to_microseconds(timestamp: datetime) -> int:
+    """Converts a naive UTC datetime to microseconds since the epoch."""
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def day_label(day: int, unit: str) -> str:
+    """
+    Formats the start of the day, week (Monday) or month containing a day as YYYY-MM-DD.
+
+    Args:
+        day: Days since the epoch
+        unit: "day", "week" or "month"
+
+    Returns:
+        Period key, as produced by period_key in SQL
+    """
+    if unit == "week":
+        # 1970-01-01 was a Thursday
+        day -= (day + 3) % 7
+    date = np.datetime64(day, "D")
+    if unit == "month":
+        date = date.astype("datetime64[M]").astype("datetime64[D]")
+    return str(date)
+
+
+def _aggregate(codes, points):
+    """
+    Sums points and counts awards and deductions per distinct code.
+
+    Dense code ranges (days, teacher ids, houses) are aggregated with
+    bincount in O(n); sparse ones fall back to sorting.
+
+    Returns:
+        Tuple of the distinct codes and their totals, award counts and deduction counts
+    """
+    if len(codes) == 0:
+        empty = np.empty(0, dtype="int64")
+        return empty, empty, empty, empty
+    low = int(codes.min())
+    span = int(codes.max()) - low + 1
+    if span <= max(len(codes), MAX_DENSE_SPAN):
+        index = codes - low
+        present = np.bincount(index, minlength=span) > 0
+        keys = np.flatnonzero(present) + low
+    else:
+        keys, index = np.unique(codes, return_inverse=True)
+        span = len(keys)
+        present = slice(None)
+    totals = np.bincount(index, weights=points, minlength=span)[present]
+    awards = np.bincount(index, weights=points > 0, minlength=span)[present]
+    deductions = np.bincount(index, weights=points < 0, minlength=span)[present]
+    return keys, totals, awards, deductions
+
+
+class ColumnarStore:
+    """
+    House points transactions held as NumPy arrays.
+
+    Columns: id (int64), school (int32), house (int8 code), points (int32), teacher_id (int32),
+    wizard_id (int32, -1 for house-wide points) and timestamp (int64
+    microseconds since the epoch). Arrays grow by doubling, so appends are
+    amortized O(1).
+    """
+
+    COLUMNS = (
+        ("id", "int64"),
+        ("school", "int32"),
+        ("house", "int8"),
+        ("points", "int32"),
+        ("teacher_id", "int32"),
+        ("wizard_id", "int32"),
+        ("timestamp", "int64"),
+    )
+
+    def __init__(self, enabled: bool = COLUMNAR_ANALYTICS, refresh_seconds: float = COLUMNAR_REFRESH_SECONDS):
+        self.enabled = enabled and np is not None
+        if enabled and np is None:
+            logger.warning("COLUMNAR_ANALYTICS is set but NumPy is not installed, using SQL analytics")
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._loaded_at: Optional[float] = None
+        self._size = 0
+        self._columns: Dict[str, "np.ndarray"] = {}
+        self._schools: set = set()
+        self._balances: Dict[Tuple[int, House], Tuple["np.ndarray", "np.ndarray"]] = {}
+
+    def _reset(self, capacity: int) -> None:
+        self._size = 0
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS}
+        self._schools = set()
+        self._balances = {}
+
+    def _reserve(self, extra: int) -> None:
+        capacity = len(self._columns["id"])
+        if self._size + extra <= capacity:
+            return
+        capacity = max(capacity * 2, self._size + extra, 1024)
+        for name, dtype in self.COLUMNS:
+            column = np.empty(capacity, dtype=dtype)
+            column[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = column
+
+    def _append_rows(self, rows: List[tuple]) -> None:
+        """Appends (id, school_id, house, points, teacher_id, wizard_id, timestamp) tuples."""
+        if not rows:
+            return
+        ids, schools, houses, points, teacher_ids, wizard_ids, timestamps = zip(*rows)
+        self._reserve(len(rows))
+        start, end = self._size, self._size + len(rows)
+        self._columns["id"][start:end] = ids
+        self._columns["school"][start:end] = schools
+        self._schools.update(schools)
+        self._columns["house"][start:end] = [HOUSE_CODES[House(house)] for house in houses]
+        self._columns["points"][start:end] = points
+        self._columns["teacher_id"][start:end] = teacher_ids
+        self._columns["wizard_id"][start:end] = [-1 if wizard_id is None else wizard_id for wizard_id in wizard_ids]
+        self._columns["timestamp"][start:end] = np.array(timestamps, dtype="datetime64[us]").astype("int64")
+        self._size = end
+        self._balances = {}
+
+    @staticmethod
+    def _select(db: Session, model):
+        return db.query(
+            model.id, model.school_id, model.house, model.points, model.teacher_id, model.wizard_id, model.timestamp
+        )
+
+    def load(self, db: Session) -> None:
+        """Loads every transaction of every school (archived ones included) into the store."""
+        with self._lock:
+            self._reset(1024)
+            for model in (HousePointsArchive, HousePoints):
+                batch = []
+                for row in self._select(db, model).yield_per(LOAD_BATCH_SIZE):
+                    batch.append(tuple(row))
+                    if len(batch) >= LOAD_BATCH_SIZE:
+                        self._append_rows(batch)
+                        batch = []
+                self._append_rows(batch)
+            self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {self._size} house points transactions into the columnar store")
+
+    def catch_up(self, db: Session) -> None:
+        """Appends the transactions recorded since the last load or catch-up."""
+        with self._lock:
+            ids = self._columns["id"][:self._size]
+            threshold = int(ids.max()) - COLUMNAR_CATCH_UP_OVERLAP if self._size else 0
+            known = set(ids[ids > threshold].tolist())
+            rows = self._select(db, HousePoints).filter(HousePoints.id > threshold).all()
+            self._append_rows([tuple(row) for row in rows if row.id not in known])
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session) -> None:
+        """Loads the store on first use and catches up once per refresh interval."""
+        if self._loaded_at is None:
+            self.load(db)
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.catch_up(db)
+
+    def append(self, points: HousePoints) -> None:
+        """Appends a transaction committed by this worker."""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            recent_ids = self._columns["id"][max(0, self._size - COLUMNAR_CATCH_UP_OVERLAP):self._size]
+            if (recent_ids == points.id).any():
+                # Already picked up by a catch-up
+                return
+            self._append_rows([(
+                points.id, points.school_id, points.house, points.points, points.teacher_id, points.wizard_id, points.timestamp
+            )])
+
+    def _view(self, school_id: int) -> Dict[str, "np.ndarray"]:
+        """Returns the columns restricted to the rows of one school."""
+        if self._schools == {school_id}:
+            # Single-school store: the columns are used as they are, without a copy
+            return {name: column[:self._size] for name, column in self._columns.items()}
+        mask = self._columns["school"][:self._size] == school_id
+        return {name: column[:self._size][mask] for name, column in self._columns.items()}
+
+    def house_totals(self, school_id: int) -> Dict[House, int]:
+        """
+        Returns every house's balance in a school.
+
+        Args:
+            school_id: School of the houses
+
+        Returns:
+            Dictionary mapping each house to its points
+        """
+        with self._lock:
+            columns = self._view(school_id)
+            totals = np.bincount(columns["house"], weights=columns["points"], minlength=len(HOUSES))
+        return {house: int(totals[code]) for code, house in enumerate(HOUSES)}
+
+    def balance(self, school_id: int, house: House, up_to_timestamp: Optional[datetime] = None) -> int:
+        """
+        Returns a house balance up to a point in time (inclusive).
+
+        Uses per-school, per-house cumulative sums sorted by timestamp, built on
+        first use after a change, so each call is a binary search.
+
+        Args:
+            school_id: School of the house
+            house: House to calculate points for
+            up_to_timestamp: Datetime up to which to calculate points (default: now)
+
+        Returns:
+            Integer representing cumulative points
+        """
+        key = (school_id, House(house))
+        with self._lock:
+            if key not in self._balances:
+                columns = self._view(school_id)
+                mask = columns["house"] == HOUSE_CODES[key[1]]
+                order = np.argsort(columns["timestamp"][mask], kind="stable")
+                self._balances[key] = (
+                    columns["timestamp"][mask][order],
+                    np.cumsum(columns["points"][mask][order], dtype="int64"),
+                )
+            timestamps, cumulative = self._balances[key]
+        if up_to_timestamp is None:
+            return int(cumulative[-1]) if len(cumulative) else 0
+        index = int(np.searchsorted(timestamps, to_microseconds(up_to_timestamp), side="right"))
+        return int(cumulative[index - 1]) if index else 0
+
+    def grouped(
+        self,
+        school_id: int,
+        group_by: str,
+        teacher_names: Dict[int, str],
+        house: Optional[House] = None,
+        teacher_id: Optional[int] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> List[GroupedPoints]:
+        """
+        Groups transactions by day, week, month, teacher or house.
+
+        Args:
+            school_id: School of the transactions
+            group_by: Criteria to group by (day, week, month, teacher, house)
+            teacher_names: Mapping of teacher ids to names, used to group by teacher
+            house: Optional house to filter by
+            teacher_id: Optional teacher ID to filter by
+            start_date: Optional start date for filtering
+            end_date: Optional end date for filtering
+
+        Returns:
+            List of GroupedPoints ordered by group key
+        """
+        if group_by not in ("day", "week", "month", "teacher", "house"):
+            raise ValueError(f"Invalid group_by parameter: {group_by}")
+
+        with self._lock:
+            columns = self._view(school_id)
+            conditions = []
+            if house:
+                conditions.append(columns["house"] == HOUSE_CODES[House(house)])
+            if teacher_id:
+                conditions.append(columns["teacher_id"] == teacher_id)
+            if start_date:
+                conditions.append(columns["timestamp"] >= to_microseconds(start_date))
+            if end_date:
+                conditions.append(columns["timestamp"] <= to_microseconds(end_date))
+            # Without filters the columns are used as they are, without another copy
+            mask = np.logical_and.reduce(conditions) if conditions else None
+            key_column = {"teacher": "teacher_id", "house": "house"}.get(group_by, "timestamp")
+            points = columns["points"] if mask is None else columns["points"][mask]
+            codes = columns[key_column] if mask is None else columns[key_column][mask]
+
+        if key_column == "timestamp":
+            # Aggregate per day first; weeks and months are merged from the days below
+            codes = codes // US_PER_DAY
+        keys, totals, awards, deductions = _aggregate(codes, points)
+
+        groups: Dict[str, List[int]] = {}
+        for key, total, award_count, deduction_count in zip(keys.tolist(), totals, awards, deductions):
+            if group_by == "teacher":
+                if key not in teacher_names:
+                    # Transactions of unknown teachers are dropped, like the SQL join
+                    continue
+                # Teachers sharing a name are one group, like GROUP BY teachers.name
+                label = teacher_names[key]
+            elif group_by == "house":
+                label = HOUSES[key].value
+            else:
+                label = day_label(key, group_by)
+            group = groups.setdefault(label, [0, 0, 0])
+            group[0] += int(total)
+            group[1] += int(award_count)
+            group[2] += int(deduction_count)
+        return [GroupedPoints(key, *values) for key, values in sorted(groups.items())]
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "rows": self._size,
+                "bytes": sum(column.nbytes for column in self._columns.values()),
+            }
+
+
+analytics_store = ColumnarStore()
+
+
+def get_teacher_names(db: Session, school_id: int) -> Dict[int, str]:
+    """Returns the name of every teacher of a school by id."""
+    return dict(db.query(Teacher.id, Teacher.name).filter(Teacher.school_id == school_id).all())
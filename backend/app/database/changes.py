@@ -0,0 +1,217 @@
+"""
+Change feed of house points transactions (transactional outbox).
+
+`modify_house_points` writes one house_points_changes row per transaction in
+the same database transaction. Each school has its own feed: change ids are
+taken from the school's sequence row, whose lock is held until commit, so
+ids become visible in increasing order within a school (and writers of
+different schools never wait for each other): a consumer that remembers the last id it processed and
+asks for `id > since_id` never misses or repeats a change, across restarts
+of either side. Changes older than CHANGE_FEED_RETENTION_DAYS are pruned;
+consumers behind the pruned range are told to resynchronize.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+import threading
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.database.db import insert_for
+from app.models.models import HousePoints, HousePointsChange, HousePointsChangeSequence
+
+logger = logging.getLogger(__name__)
+
+# Days changes are kept in the outbox (0: forever)
+CHANGE_FEED_RETENTION_DAYS = int(os.getenv("CHANGE_FEED_RETENTION_DAYS", "30"))
+
+# Seconds between two reads of a waiting consumer (changes recorded by other workers)
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "1"))
+
+
+class ChangesPage(NamedTuple):
+    changes: List[HousePointsChange]
+    pruned_through: int
+
+
+def record_change(db: Session, points: HousePoints) -> int:
+    """
+    Writes the outbox row of a transaction; call before committing it.
+
+    Args:
+        db: SQLAlchemy database session
+        points: The flushed HousePoints row
+
+    Returns:
+        Id of the change within the transaction's school
+    """
+    # One upsert: creates the school's sequence row on its first change (continuing
+    # after any existing change ids) or increments it, and locks it until commit,
+    # so the school's change ids commit in order
+    first_id = select(func.coalesce(func.max(HousePointsChange.id), 0) + 1).where(
+        HousePointsChange.school_id == points.school_id
+    ).scalar_subquery()
+    change_id = db.execute(
+        insert_for(db, HousePointsChangeSequence)
+        .values(id=points.school_id, last_id=first_id, pruned_through=0)
+        .on_conflict_do_update(
+            index_elements=[HousePointsChangeSequence.id],
+            set_={"last_id": HousePointsChangeSequence.last_id + 1}
+        )
+        .returning(HousePointsChangeSequence.last_id)
+    ).scalar_one()
+
+    db.add(HousePointsChange(
+        school_id=points.school_id,
+        id=change_id,
+        transaction_id=points.id,
+        house=points.house,
+        points=points.points,
+        reason=points.reason,
+        teacher_id=points.teacher_id,
+        wizard_id=points.wizard_id,
+        timestamp=points.timestamp or datetime.utcnow(),
+    ))
+    return change_id
+
+
+def get_last_change_id(db: Session, school_id: int) -> int:
+    """
+    Reads the id of a school's latest change (its data version).
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the feed
+
+    Returns:
+        Id of the latest committed change (0 if none was recorded)
+    """
+    return db.query(HousePointsChangeSequence.last_id).filter(
+        HousePointsChangeSequence.id == school_id
+    ).scalar() or 0
+
+
+def get_changes(db: Session, school_id: int, since_id: int, limit: int) -> ChangesPage:
+    """
+    Reads a school's changes after `since_id` (primary key range scan).
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the feed
+        since_id: Id of the last change the consumer processed
+        limit: Maximum number of changes to return
+
+    Returns:
+        ChangesPage with the changes in id order and the last pruned id
+    """
+    pruned_through = db.query(HousePointsChangeSequence.pruned_through).filter(
+        HousePointsChangeSequence.id == school_id
+    ).scalar() or 0
+    changes = db.query(HousePointsChange).filter(
+        HousePointsChange.school_id == school_id,
+        HousePointsChange.id > since_id
+    ).order_by(HousePointsChange.id).limit(limit).all()
+    return ChangesPage(changes=changes, pruned_through=pruned_through)
+
+
+def serialize_change(change: HousePointsChange) -> Dict[str, Any]:
+    return {
+        "id": change.id,
+        "transaction_id": change.transaction_id,
+        "house": change.house.value if hasattr(change.house, "value") else change.house,
+        "points": change.points,
+        "reason": change.reason,
+        "teacher_id": change.teacher_id,
+        "wizard_id": change.wizard_id,
+        "timestamp": change.timestamp.isoformat(),
+        "recorded_at": change.recorded_at.isoformat(),
+    }
+
+
+def prune_changes(db: Session, school_id: int, retention_days: int, now: Optional[datetime] = None) -> int:
+    """
+    Deletes a school's changes recorded before the retention window.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the feed
+        retention_days: Number of days of changes to keep
+        now: Current time (default: utcnow)
+
+    Returns:
+        Number of changes deleted
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    through = db.query(func.max(HousePointsChange.id)).filter(
+        HousePointsChange.school_id == school_id,
+        HousePointsChange.recorded_at < cutoff
+    ).scalar()
+    if through is None:
+        return 0
+    deleted = db.query(HousePointsChange).filter(
+        HousePointsChange.school_id == school_id,
+        HousePointsChange.id <= through
+    ).delete(synchronize_session=False)
+    db.execute(
+        update(HousePointsChangeSequence)
+        .where(HousePointsChangeSequence.id == school_id)
+        .values(pruned_through=through)
+    )
+    db.commit()
+    logger.info(f"Pruned {deleted} changes of school {school_id} up to id {through}")
+    return deleted
+
+
+class ChangeNotifier:
+    """
+    Wakes up the consumers of this worker waiting for new changes.
+
+    Changes recorded by other workers are picked up by the consumers' periodic
+    reads (CHANGE_FEED_POLL_SECONDS).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self.latest_ids: Dict[int, int] = {}
+
+    def notify(self, school_id: int, change_id: int) -> None:
+        """Signals a committed change of a school (callable from any thread)."""
+        with self._lock:
+            self.latest_ids[school_id] = max(self.latest_ids.get(school_id, 0), change_id)
+            waiters = list(self._waiters.get(school_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, school_id: int, after_id: int, timeout: float) -> None:
+        """
+        Waits until a change of a school newer than `after_id` is signaled, or for `timeout` seconds.
+
+        Args:
+            school_id: School of the feed
+            after_id: Last change id the consumer has seen
+            timeout: Maximum number of seconds to wait
+        """
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self.latest_ids.get(school_id, 0) > after_id:
+                return
+            self._waiters.setdefault(school_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(school_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[school_id]
+
+
+change_notifier = ChangeNotifier()
@@ -0,0 +1,504 @@
+"""
+Balance checkpoints and compaction of old house points transactions.
+
+At every term boundary a checkpoint row is written per school, house and
+wizard holding the balance up to that instant. Balances are then computed as the
+nearest checkpoint plus the transactions after it, so their cost follows
+recent activity instead of the whole history. Transactions older than the
+retention window can be moved to house_points_archive once a checkpoint
+covers them. Every function works on the ledger of one school.
+"""
+from calendar import monthrange
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+import threading
+
+from sqlalchemy import desc, func, select, tuple_, union_all
+from sqlalchemy.orm import Session
+
+from app.database.changes import CHANGE_FEED_RETENTION_DAYS, prune_changes
+from app.database.db import SessionLocal, insert_for
+from app.database.partitioning import next_period, period_start
+from app.database.tenancy import school_registry
+from app.models.models import House, HousePoints, HousePointsArchive, HousePointsCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Transactions older than this many days are compacted into the archive (unset: never)
+RETENTION_DAYS = os.getenv("HOUSE_POINTS_RETENTION_DAYS")
+
+# How often the background maintenance writes due checkpoints (seconds)
+CHECKPOINT_MAINTENANCE_INTERVAL = int(os.getenv("HOUSE_POINTS_CHECKPOINT_INTERVAL", "3600"))
+
+# Checkpoints are taken at term boundaries
+CHECKPOINT_GRANULARITY = "term"
+
+# Maximum number of instants returned by a standings series
+MAX_SERIES_POINTS = 1000
+
+
+def get_nearest_checkpoint(
+    db: Session,
+    school_id: int,
+    house: House,
+    at: Optional[datetime] = None,
+    wizard_id: Optional[int] = None
+) -> Optional[HousePointsCheckpoint]:
+    """
+    Finds the latest checkpoint taken at or before a point in time.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the balance
+        house: House of the balance
+        at: Point in time (default: latest checkpoint)
+        wizard_id: Wizard of the balance, None for the house balance
+
+    Returns:
+        HousePointsCheckpoint if one exists, None otherwise
+    """
+    query = db.query(HousePointsCheckpoint).filter(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.house == house
+    )
+    if wizard_id is None:
+        query = query.filter(HousePointsCheckpoint.wizard_id.is_(None))
+    else:
+        query = query.filter(HousePointsCheckpoint.wizard_id == wizard_id)
+    if at is not None:
+        query = query.filter(HousePointsCheckpoint.checkpoint_at <= at)
+    return query.order_by(desc(HousePointsCheckpoint.checkpoint_at)).first()
+
+
+def get_compaction_watermark(db: Session, school_id: int) -> Optional[datetime]:
+    """
+    Returns the instant up to which a school's transactions were moved to the archive.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the transactions
+
+    Returns:
+        Datetime of the newest compacted checkpoint, None if nothing was compacted
+    """
+    return db.query(func.max(HousePointsCheckpoint.checkpoint_at)).filter(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.compacted.is_(True)
+    ).scalar()
+
+
+def transaction_models(db: Session, school_id: int, after: Optional[datetime], up_to: Optional[datetime]) -> list:
+    """
+    Returns the tables holding a school's transactions in (after, up_to], oldest first.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the transactions
+        after: Exclusive lower bound, None for the beginning of time
+        up_to: Inclusive upper bound, None for now
+
+    Returns:
+        List of HousePointsArchive and/or HousePoints models
+    """
+    watermark = get_compaction_watermark(db, school_id)
+    if watermark is None:
+        return [HousePoints]
+    if up_to is not None and up_to <= watermark:
+        return [HousePointsArchive]
+    if after is not None and after >= watermark:
+        return [HousePoints]
+    return [HousePointsArchive, HousePoints]
+
+
+def calculate_balance(
+    db: Session,
+    school_id: int,
+    house: House,
+    up_to_timestamp: Optional[datetime] = None,
+    wizard_id: Optional[int] = None
+) -> int:
+    """
+    Calculates a house (or wizard) balance from the nearest checkpoint plus the tail after it.
+
+    Checkpoints are taken at the compaction watermark, so the tail lies either
+    entirely in house_points or entirely in the archive.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the house
+        house: House to calculate points for
+        up_to_timestamp: Datetime up to which to calculate points (default: now)
+        wizard_id: Optional wizard to restrict the balance to
+
+    Returns:
+        Integer representing cumulative points
+    """
+    checkpoint = get_nearest_checkpoint(db, school_id, house, up_to_timestamp, wizard_id)
+    after = checkpoint.checkpoint_at if checkpoint else None
+
+    total = checkpoint.total_points if checkpoint else 0
+    for model in transaction_models(db, school_id, after, up_to_timestamp):
+        query = db.query(func.sum(model.points)).filter(model.school_id == school_id, model.house == house)
+        if wizard_id is not None:
+            query = query.filter(model.wizard_id == wizard_id)
+        if after is not None:
+            query = query.filter(model.timestamp > after)
+        if up_to_timestamp is not None:
+            query = query.filter(model.timestamp <= up_to_timestamp)
+        total += query.scalar() or 0
+    return total
+
+
+def calculate_running_balances(
+    db: Session,
+    school_id: int,
+    instants: Iterable[Tuple[House, datetime]]
+) -> Dict[Tuple[House, datetime], int]:
+    """
+    Calculates the balance of houses at several instants with one windowed query.
+
+    The standings just before the earliest instant come from the checkpoints;
+    a running sum per house over the transactions between the earliest and the
+    latest instant adds the rest.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the houses
+        instants: (house, instant) pairs, e.g. the house and timestamp of transactions
+
+    Returns:
+        Dictionary mapping each (house, instant) pair to the house balance at that instant (inclusive)
+    """
+    pairs = {(House(house), at) for house, at in instants}
+    if not pairs:
+        return {}
+    first = min(at for _, at in pairs)
+    last = max(at for _, at in pairs)
+    before = first - timedelta(microseconds=1)
+    base = get_standings_at(db, school_id, before)
+
+    window = union_all(*[
+        select(model.house.label("house"), model.timestamp.label("timestamp"), model.points.label("points")).where(
+            model.school_id == school_id,
+            model.timestamp >= first,
+            model.timestamp <= last,
+            model.house.in_({house for house, _ in pairs})
+        )
+        for model in transaction_models(db, school_id, before, last)
+    ]).subquery()
+    # The default frame (RANGE ... CURRENT ROW) includes transactions sharing the timestamp
+    running = select(
+        window.c.house,
+        window.c.timestamp,
+        func.sum(window.c.points).over(partition_by=window.c.house, order_by=window.c.timestamp).label("points")
+    ).subquery()
+    rows = db.execute(
+        select(running.c.house, running.c.timestamp, running.c.points).where(
+            tuple_(running.c.house, running.c.timestamp).in_(list(pairs))
+        ).distinct()
+    )
+    balances = {(house, at): base[house] for house, at in pairs}
+    for house, at, points in rows:
+        balances[(House(house), at)] = base[House(house)] + points
+    return balances
+
+
+def get_standings_at(db: Session, school_id: int, at: datetime) -> Dict[House, int]:
+    """
+    Calculates every house balance of a school at a point in time.
+
+    Uses the house checkpoints taken at or before `at` plus one grouped query
+    over the transactions after them.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the houses
+        at: Point in time (inclusive)
+
+    Returns:
+        Dictionary mapping each house to its points at `at`
+    """
+    latest = db.query(func.max(HousePointsCheckpoint.checkpoint_at)).filter(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.wizard_id.is_(None),
+        HousePointsCheckpoint.checkpoint_at <= at
+    ).scalar()
+
+    standings = {house: 0 for house in House}
+    if latest is not None:
+        for checkpoint in db.query(HousePointsCheckpoint).filter(
+            HousePointsCheckpoint.school_id == school_id,
+            HousePointsCheckpoint.wizard_id.is_(None),
+            HousePointsCheckpoint.checkpoint_at == latest
+        ):
+            standings[checkpoint.house] = checkpoint.total_points
+
+    for model in transaction_models(db, school_id, latest, at):
+        query = db.query(model.house, func.sum(model.points)).filter(
+            model.school_id == school_id,
+            model.timestamp <= at
+        )
+        if latest is not None:
+            query = query.filter(model.timestamp > latest)
+        for house, total in query.group_by(model.house):
+            standings[house] += total
+    return standings
+
+
+def advance(start: datetime, step: str, count: int = 1) -> datetime:
+    """
+    Moves a datetime forward by a number of series steps.
+
+    Args:
+        start: Datetime to advance
+        step: "day", "week" or "month"
+        count: Number of steps
+
+    Returns:
+        datetime: The instant `count` steps after `start`
+    """
+    if step == "day":
+        return start + timedelta(days=count)
+    if step == "week":
+        return start + timedelta(weeks=count)
+    if step == "month":
+        year, month = divmod(start.month - 1 + count, 12)
+        year, month = start.year + year, month + 1
+        return start.replace(year=year, month=month, day=min(start.day, monthrange(year, month)[1]))
+    raise ValueError(f"Invalid step parameter: {step}")
+
+
+def get_standings_series(
+    db: Session,
+    school_id: int,
+    start: datetime,
+    end: datetime,
+    step: str
+) -> List[Tuple[datetime, Dict[House, int]]]:
+    """
+    Calculates the standings at every step between two instants in a single pass.
+
+    The standings at `start` come from the checkpoints, then the transactions
+    in (start, end] are streamed once in timestamp order and the running
+    totals are captured as each step boundary is crossed.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the houses
+        start: First instant of the series
+        end: Last instant allowed in the series
+        step: "day", "week" or "month"
+
+    Returns:
+        List of (instant, standings) tuples in chronological order
+    """
+    instants = []
+    at = start
+    while at <= end:
+        instants.append(at)
+        if len(instants) > MAX_SERIES_POINTS:
+            raise ValueError(f"Series is limited to {MAX_SERIES_POINTS} points")
+        at = advance(start, step, len(instants))
+    if not instants:
+        return []
+
+    standings = get_standings_at(db, school_id, start)
+    series = [(start, dict(standings))]
+    last = instants[-1]
+    index = 1
+
+    for model in transaction_models(db, school_id, start, last):
+        rows = db.query(model.house, model.points, model.timestamp).filter(
+            model.school_id == school_id,
+            model.timestamp > start,
+            model.timestamp <= last
+        ).order_by(model.timestamp).yield_per(1000)
+        for house, points, timestamp in rows:
+            while timestamp > instants[index]:
+                series.append((instants[index], dict(standings)))
+                index += 1
+            standings[house] += points
+
+    for instant in instants[index:]:
+        series.append((instant, dict(standings)))
+    return series
+
+
+def create_checkpoint(db: Session, school_id: int, at: datetime) -> int:
+    """
+    Writes the house and wizard balance checkpoints of a school as of `at`.
+
+    Balances are carried forward from the previous checkpoint, so only the
+    transactions between the two checkpoints are aggregated.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the balances
+        at: Instant of the checkpoint (inclusive)
+
+    Returns:
+        Number of checkpoint rows written (0 if the checkpoint already exists, e.g. written by another worker)
+    """
+    exists = db.query(HousePointsCheckpoint.id).filter(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.checkpoint_at == at
+    ).first()
+    if exists:
+        return 0
+
+    previous_at = db.query(func.max(HousePointsCheckpoint.checkpoint_at)).filter(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.checkpoint_at < at
+    ).scalar()
+
+    balances: Dict[Tuple[House, Optional[int]], int] = {(house, None): 0 for house in House}
+    tail = db.query(
+        HousePoints.house,
+        HousePoints.wizard_id,
+        func.sum(HousePoints.points).label('total')
+    ).filter(HousePoints.school_id == school_id, HousePoints.timestamp <= at)
+
+    if previous_at is not None:
+        for checkpoint in db.query(HousePointsCheckpoint).filter(
+            HousePointsCheckpoint.school_id == school_id,
+            HousePointsCheckpoint.checkpoint_at == previous_at
+        ):
+            balances[(checkpoint.house, checkpoint.wizard_id)] = checkpoint.total_points
+        tail = tail.filter(HousePoints.timestamp > previous_at)
+
+    for house, wizard_id, total in tail.group_by(HousePoints.house, HousePoints.wizard_id):
+        balances[(house, None)] += total
+        if wizard_id is not None:
+            balances[(house, wizard_id)] = balances.get((house, wizard_id), 0) + total
+
+    # Every worker runs the maintenance: rows another worker already wrote for this instant are skipped
+    result = db.execute(
+        insert_for(db, HousePointsCheckpoint).values([
+            {"school_id": school_id, "house": house, "wizard_id": wizard_id, "checkpoint_at": at, "total_points": total}
+            for (house, wizard_id), total in balances.items()
+        ]).on_conflict_do_nothing()
+    )
+    db.commit()
+    if result.rowcount:
+        logger.info(f"Created {result.rowcount} balance checkpoints of school {school_id} at {at}")
+    return max(result.rowcount, 0)
+
+
+def create_due_checkpoints(db: Session, school_id: int, now: Optional[datetime] = None) -> List[datetime]:
+    """
+    Writes a checkpoint of a school for every term boundary passed since its last one.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the balances
+        now: Current time (default: utcnow)
+
+    Returns:
+        List of checkpoint instants that were created
+    """
+    now = now or datetime.utcnow()
+    latest = db.query(func.max(HousePointsCheckpoint.checkpoint_at)).filter(
+        HousePointsCheckpoint.school_id == school_id
+    ).scalar()
+    if latest is None:
+        latest = db.query(func.min(HousePoints.timestamp)).filter(HousePoints.school_id == school_id).scalar()
+        if latest is None:
+            return []
+
+    created = []
+    boundary = next_period(period_start(latest, CHECKPOINT_GRANULARITY), CHECKPOINT_GRANULARITY)
+    while boundary <= now:
+        if create_checkpoint(db, school_id, boundary):
+            created.append(boundary)
+        boundary = next_period(boundary, CHECKPOINT_GRANULARITY)
+    return created
+
+
+def compact_transactions(db: Session, school_id: int, retention_days: int, now: Optional[datetime] = None) -> int:
+    """
+    Moves a school's transactions covered by a checkpoint older than the retention window to the archive.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the transactions
+        retention_days: Number of days of transactions to keep in house_points
+        now: Current time (default: utcnow)
+
+    Returns:
+        Number of transactions archived
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    watermark = db.query(func.max(HousePointsCheckpoint.checkpoint_at)).filter(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.checkpoint_at <= cutoff
+    ).scalar()
+    if watermark is None:
+        return 0
+
+    columns = ["id", "school_id", "house", "points", "reason", "timestamp", "teacher_id", "wizard_id"]
+    old_rows = db.query(*[getattr(HousePoints, c) for c in columns]).filter(
+        HousePoints.school_id == school_id,
+        HousePoints.timestamp <= watermark
+    )
+    db.execute(
+        HousePointsArchive.__table__.insert().from_select(columns, old_rows)
+    )
+    archived = db.query(HousePoints).filter(
+        HousePoints.school_id == school_id,
+        HousePoints.timestamp <= watermark
+    ).delete(synchronize_session=False)
+    db.query(HousePointsCheckpoint).filter(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.checkpoint_at <= watermark
+    ).update({HousePointsCheckpoint.compacted: True}, synchronize_session=False)
+    db.commit()
+
+    logger.info(f"Archived {archived} transactions of school {school_id} up to {watermark}")
+    return archived
+
+
+def run_checkpoint_maintenance() -> None:
+    """
+    Writes due checkpoints, compacts old transactions if a retention window is
+    set and prunes the change feed, school by school.
+    """
+    school_registry.load()
+    db = SessionLocal()
+    try:
+        for school_id in school_registry.ids():
+            create_due_checkpoints(db, school_id)
+            if RETENTION_DAYS:
+                compact_transactions(db, school_id, int(RETENTION_DAYS))
+            if CHANGE_FEED_RETENTION_DAYS:
+                prune_changes(db, school_id, CHANGE_FEED_RETENTION_DAYS)
+    finally:
+        db.close()
+
+
+def start_checkpoint_maintenance(interval: int = CHECKPOINT_MAINTENANCE_INTERVAL) -> threading.Thread:
+    """
+    Runs checkpoint maintenance now, then periodically in a daemon thread.
+
+    Args:
+        interval: Seconds between maintenance runs
+
+    Returns:
+        The maintenance thread
+    """
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                run_checkpoint_maintenance()
+            except Exception as e:
+                logger.error(f"Error maintaining balance checkpoints: {e}")
+            if stop.wait(interval):
+                return
+
+    thread = threading.Thread(target=run, name="checkpoint-maintenance", daemon=True)
+    thread.stop = stop
+    thread.start()
+    return thread
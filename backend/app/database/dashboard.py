@@ -0,0 +1,279 @@
+"""
+House points dashboard: current standings, recent history and daily trends.
+
+Everything the dashboard page shows is read with a single SQL statement and
+cached per worker and school as one unit, so a page load costs one round trip to the
+API and at most one to the database.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import os
+import threading
+import time
+
+from sqlalchemy import DateTime, Integer, String, case, desc, func, literal, null, select, type_coerce, union_all
+from sqlalchemy.orm import Session
+
+from app.database.analytics import period_key
+from app.models.models import House, HousePoints, HousePointsArchive, HousePointsCheckpoint
+
+# Seconds a computed dashboard is served from memory (0: no caching)
+DASHBOARD_CACHE_SECONDS = float(os.getenv("DASHBOARD_CACHE_SECONDS", "5"))
+
+# Maximum number of dashboards cached per worker; the least recently used one is dropped first
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", "256"))
+
+# Largest window (days) and number of recent transactions a dashboard can ask for
+DASHBOARD_MAX_DAYS = int(os.getenv("DASHBOARD_MAX_DAYS", "365"))
+DASHBOARD_MAX_LIMIT = int(os.getenv("DASHBOARD_MAX_LIMIT", "100"))
+
+STANDINGS = "standings"
+RECENT = "recent"
+TRENDS = "trends"
+
+
+class RecentTransaction(NamedTuple):
+    id: int
+    house: House
+    points: int
+    reason: Optional[str]
+    timestamp: datetime
+    teacher_id: int
+    cumulative_points: int
+
+
+class DailyTrend(NamedTuple):
+    day: str
+    house: House
+    total_points: int
+    awards_count: int
+    deductions_count: int
+
+
+class Dashboard(NamedTuple):
+    standings: Dict[House, int]
+    recent: List[RecentTransaction]
+    trends: List[DailyTrend]
+
+
+def _typed_null(type_):
+    # Renders NULL but keeps the type, so union results are processed like the real column
+    return type_coerce(null(), type_)
+
+
+def build_dashboard_statement(dialect_name: str, school_id: int, since: datetime, limit: int):
+    """
+    Builds the statement returning a school's standings, its latest
+    transactions since `since` and its per-day, per-house totals since `since`.
+
+    Rows are tagged with their kind in the first column; the points of a
+    recent transaction are returned in the total_points column.
+
+    Args:
+        dialect_name: Name of the database dialect
+        school_id: School of the dashboard
+        since: Start of the history and trends window
+        limit: Number of recent transactions to return
+
+    Returns:
+        SQLAlchemy selectable
+    """
+    house_type = HousePoints.__table__.c.house.type
+
+    # Standings: latest house checkpoints plus the transactions after them
+    # (always in house_points, checkpoints are never older than the compaction watermark)
+    latest_checkpoint = select(func.max(HousePointsCheckpoint.checkpoint_at)).where(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.wizard_id.is_(None)
+    ).scalar_subquery()
+    balances = union_all(
+        select(HousePointsCheckpoint.house.label("house"), HousePointsCheckpoint.total_points.label("points")).where(
+            HousePointsCheckpoint.school_id == school_id,
+            HousePointsCheckpoint.wizard_id.is_(None),
+            HousePointsCheckpoint.checkpoint_at == latest_checkpoint
+        ),
+        select(HousePoints.house, HousePoints.points).where(
+            HousePoints.school_id == school_id,
+            HousePoints.timestamp > func.coalesce(latest_checkpoint, datetime.min)
+        ),
+    ).cte("balances")
+
+    # Transactions of the window; the archive is only read when the window
+    # starts before the compaction watermark
+    watermark = select(func.max(HousePointsCheckpoint.checkpoint_at)).where(
+        HousePointsCheckpoint.school_id == school_id,
+        HousePointsCheckpoint.compacted.is_(True)
+    ).scalar_subquery()
+    window = union_all(*[
+        select(
+            model.id.label("id"), model.house.label("house"), model.points.label("points"),
+            model.reason.label("reason"), model.timestamp.label("timestamp"),
+            model.teacher_id.label("teacher_id")
+        ).where(model.school_id == school_id, model.timestamp >= since, *conditions)
+        for model, conditions in (
+            (HousePointsArchive, [literal(since, DateTime) <= watermark]),
+            (HousePoints, []),
+        )
+    ]).cte("window_points")
+
+    standings = select(
+        literal(STANDINGS).label("kind"),
+        balances.c.house,
+        _typed_null(String).label("day"),
+        func.sum(balances.c.points).label("total_points"),
+        _typed_null(Integer).label("awards_count"),
+        _typed_null(Integer).label("deductions_count"),
+        _typed_null(Integer).label("id"),
+        _typed_null(String).label("reason"),
+        _typed_null(DateTime).label("timestamp"),
+        _typed_null(Integer).label("teacher_id"),
+    ).group_by(balances.c.house)
+
+    latest = select(window).order_by(desc(window.c.timestamp), desc(window.c.id)).limit(limit).subquery()
+    recent = select(
+        literal(RECENT),
+        type_coerce(latest.c.house, house_type),
+        _typed_null(String),
+        latest.c.points,
+        _typed_null(Integer),
+        _typed_null(Integer),
+        latest.c.id,
+        latest.c.reason,
+        latest.c.timestamp,
+        latest.c.teacher_id,
+    )
+
+    day = period_key(dialect_name, window.c.timestamp, "day")
+    trends = select(
+        literal(TRENDS),
+        type_coerce(window.c.house, house_type),
+        day,
+        func.sum(window.c.points),
+        func.sum(case((window.c.points > 0, 1), else_=0)),
+        func.sum(case((window.c.points < 0, 1), else_=0)),
+        _typed_null(Integer),
+        _typed_null(String),
+        _typed_null(DateTime),
+        _typed_null(Integer),
+    ).group_by(day, window.c.house)
+
+    return union_all(standings, recent, trends)
+
+
+def compute_dashboard(db: Session, school_id: int, days: int, limit: int, now: Optional[datetime] = None) -> Dashboard:
+    """
+    Reads the dashboard of a school with one statement.
+
+    Cumulative points of the recent transactions are derived from the current
+    standings: every transaction newer than a listed one is also listed.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the dashboard
+        days: Size of the history and trends window in days
+        limit: Number of recent transactions to return
+        now: Current time (default: utcnow)
+
+    Returns:
+        Dashboard
+    """
+    since = (now or datetime.utcnow()) - timedelta(days=days)
+    statement = build_dashboard_statement(db.get_bind().dialect.name, school_id, since, limit)
+
+    standings = {house: 0 for house in House}
+    recent_rows = []
+    trends = []
+    for row in db.execute(statement):
+        if row.kind == STANDINGS:
+            standings[House(row.house)] = row.total_points
+        elif row.kind == RECENT:
+            recent_rows.append(row)
+        else:
+            trends.append(DailyTrend(
+                day=row.day,
+                house=House(row.house),
+                total_points=row.total_points,
+                awards_count=row.awards_count,
+                deductions_count=row.deductions_count
+            ))
+
+    recent_rows.sort(key=lambda row: (row.timestamp, row.id), reverse=True)
+    balance = dict(standings)
+    recent = []
+    index = 0
+    while index < len(recent_rows):
+        # Transactions sharing a timestamp all count towards that instant's balance
+        end = index
+        while end < len(recent_rows) and recent_rows[end].timestamp == recent_rows[index].timestamp:
+            end += 1
+        group = recent_rows[index:end]
+        for row in group:
+            recent.append(RecentTransaction(
+                id=row.id,
+                house=House(row.house),
+                points=row.total_points,
+                reason=row.reason,
+                timestamp=row.timestamp,
+                teacher_id=row.teacher_id,
+                cumulative_points=balance[House(row.house)]
+            ))
+        for row in group:
+            balance[House(row.house)] -= row.total_points
+        index = end
+
+    trends.sort(key=lambda trend: (trend.day, trend.house.value))
+    return Dashboard(standings=standings, recent=recent, trends=trends)
+
+
+class DashboardCache:
+    """
+    Process-local LRU cache of computed dashboards, keyed by school, window and limit.
+
+    Windows are clamped to 1..max_days days and limits to 1..max_limit
+    transactions, so clients cannot grow the cache or the statement without bound.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DASHBOARD_CACHE_SECONDS,
+        max_size: int = DASHBOARD_CACHE_SIZE,
+        max_days: int = DASHBOARD_MAX_DAYS,
+        max_limit: int = DASHBOARD_MAX_LIMIT
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_days = max_days
+        self.max_limit = max_limit
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[int, int, int], Tuple[float, Dashboard]]" = OrderedDict()
+
+    def get(self, db: Session, school_id: int, days: int, limit: int) -> Dashboard:
+        """Returns the cached dashboard of a school, computing it when missing or expired."""
+        days = min(max(days, 1), self.max_days)
+        limit = min(max(limit, 1), self.max_limit)
+        key = (school_id, days, limit)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        dashboard = compute_dashboard(db, school_id, days, limit)
+        if self.ttl > 0 and self.max_size > 0:
+            with self._lock:
+                self._entries[key] = (time.monotonic(), dashboard)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return dashboard
+
+    def invalidate(self, school_id: int) -> None:
+        """Drops the cached dashboards of a school (called after an award in this worker)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == school_id]:
+                del self._entries[key]
+
+
+dashboard_cache = DashboardCache()
@@ -1,8 +1,11 @@
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import os
 
+from app.database.pool import MonitoredQueuePool, get_pool_settings
+
 # Check if running in Docker (environment variable set in Docker Compose)
 IN_DOCKER = os.getenv("IN_DOCKER", "false").lower() == "true"
 
@@ -23,7 +26,18 @@ connect_args = {}
 if DATABASE_URL.startswith("sqlite"):
     connect_args["check_same_thread"] = False
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+# Range partitioning of house_points on PostgreSQL: "none", "month" or "term"
+HOUSE_POINTS_PARTITIONING = os.getenv("HOUSE_POINTS_PARTITIONING", "none").lower()
+if HOUSE_POINTS_PARTITIONING not in ("none", "month", "term"):
+    raise ValueError(f"Invalid HOUSE_POINTS_PARTITIONING value: {HOUSE_POINTS_PARTITIONING}")
+
+# Partitioning is a PostgreSQL feature; other backends keep a single table
+PARTITIONING_ENABLED = HOUSE_POINTS_PARTITIONING != "none" and DATABASE_URL.startswith("postgresql")
+
+# Connection pool settings: per-environment defaults (APP_ENV) overridden by DB_POOL_* variables
+POOL_SETTINGS = get_pool_settings()
+
+engine = create_engine(DATABASE_URL, connect_args=connect_args, poolclass=MonitoredQueuePool, **POOL_SETTINGS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -32,4 +46,21 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+
+def insert_for(db: Session, model):
+    """
+    Returns an INSERT of a model supporting ON CONFLICT clauses
+    (on_conflict_do_nothing / on_conflict_do_update) on the session's database.
+
+    Args:
+        db: SQLAlchemy database session
+        model: Model or table to insert into
+
+    Returns:
+        PostgreSQL or SQLite Insert construct
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
@@ -0,0 +1,234 @@
+"""
+Per-resolver statement deadlines and cancellation.
+
+A deadline is opened around an expensive resolver or route. While it is
+active, every statement executed on the engine is bounded by the time left:
+PostgreSQL gets a transaction-local statement_timeout, reset once the
+statement has run, SQLite gets a progress handler that interrupts the
+statement. The deadline can also be cancelled
+from another task (e.g. when the client disconnects), which cancels the
+running statement on the server.
+"""
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from typing import List, Optional
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+# Default deadline in seconds for resolvers and routes without their own setting (0: none)
+STATEMENT_TIMEOUT_DEFAULT = float(os.getenv("STATEMENT_TIMEOUT_DEFAULT", "30"))
+
+# Number of SQLite virtual machine instructions between two deadline checks
+SQLITE_PROGRESS_INTERVAL = 1000
+
+# Key of Connection.info marking a statement_timeout to reset after the statement
+TIMEOUT_SET = "deadline_statement_timeout"
+
+
+class QueryTimeoutError(Exception):
+    """Raised when a statement runs past the deadline of its resolver or route."""
+
+    def __init__(self, name: str, seconds: float):
+        super().__init__(f"Query '{name}' exceeded its {seconds:g}s deadline")
+        self.name = name
+        self.seconds = seconds
+
+
+class QueryCancelledError(Exception):
+    """Raised when a statement is cancelled because the client went away."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Query '{name}' was cancelled")
+        self.name = name
+
+
+def get_statement_timeout(name: str) -> float:
+    """
+    Returns the configured deadline of a resolver or route.
+
+    Read from STATEMENT_TIMEOUT_<NAME> (e.g. STATEMENT_TIMEOUT_POINTS_HISTORY_GROUPED),
+    falling back to STATEMENT_TIMEOUT_DEFAULT.
+
+    Args:
+        name: Resolver or route name
+
+    Returns:
+        Deadline in seconds, 0 for no deadline
+    """
+    return float(os.getenv(f"STATEMENT_TIMEOUT_{name.upper()}", STATEMENT_TIMEOUT_DEFAULT))
+
+
+class CancelScope:
+    """Deadlines opened while serving one request, cancelled together on disconnect."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._deadlines: List["StatementDeadline"] = []
+        self._lock = threading.Lock()
+
+    def register(self, deadline: "StatementDeadline") -> None:
+        with self._lock:
+            self._deadlines.append(deadline)
+        if self.cancelled:
+            deadline.cancel()
+
+    def unregister(self, deadline: "StatementDeadline") -> None:
+        with self._lock:
+            if deadline in self._deadlines:
+                self._deadlines.remove(deadline)
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        with self._lock:
+            deadlines = list(self._deadlines)
+        for deadline in deadlines:
+            deadline.cancel()
+
+
+current_cancel_scope: ContextVar[Optional[CancelScope]] = ContextVar("current_cancel_scope", default=None)
+current_deadline: ContextVar[Optional["StatementDeadline"]] = ContextVar("current_deadline", default=None)
+
+
+class StatementDeadline(ContextDecorator):
+    """
+    Bounds the statements executed inside the block (or decorated function).
+
+    Raises QueryTimeoutError or QueryCancelledError in place of the driver
+    error when a statement is interrupted.
+
+    Args:
+        name: Resolver or route name, used for configuration and error messages
+        seconds: Deadline in seconds (default: configured value for `name`)
+    """
+
+    def __init__(self, name: str, seconds: Optional[float] = None):
+        self.name = name
+        self.seconds = get_statement_timeout(name) if seconds is None else seconds
+
+    def __enter__(self):
+        self.expires_at = time.monotonic() + self.seconds if self.seconds > 0 else None
+        self.cancelled = False
+        self.connection = None
+        self._token = current_deadline.set(self)
+        self._scope = current_cancel_scope.get()
+        if self._scope is not None:
+            self._scope.register(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_deadline.reset(self._token)
+        if self._scope is not None:
+            self._scope.unregister(self)
+        if exc is None:
+            return False
+        if self.cancelled:
+            raise QueryCancelledError(self.name) from exc
+        if isinstance(exc, DBAPIError) and self.expired:
+            raise QueryTimeoutError(self.name, self.seconds) from exc
+        return False
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def remaining_ms(self) -> Optional[int]:
+        if self.expires_at is None:
+            return None
+        return max(1, int((self.expires_at - time.monotonic()) * 1000))
+
+    def should_interrupt(self) -> bool:
+        return self.cancelled or self.expired
+
+    def cancel(self) -> None:
+        """Cancels the statement currently running under this deadline, if any."""
+        self.cancelled = True
+        connection = self.connection
+        if connection is None:
+            return
+        try:
+            if hasattr(connection, "interrupt"):
+                connection.interrupt()  # sqlite3
+            elif hasattr(connection, "cancel"):
+                connection.cancel()  # psycopg2
+        except Exception as e:
+            logger.warning(f"Could not cancel query '{self.name}': {e}")
+
+
+statement_deadline = StatementDeadline
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    if deadline.cancelled:
+        raise QueryCancelledError(deadline.name)
+    if deadline.expired:
+        raise QueryTimeoutError(deadline.name, deadline.seconds)
+
+    dbapi_connection = conn.connection.dbapi_connection
+    deadline.connection = dbapi_connection
+    if conn.dialect.name == "postgresql":
+        remaining = deadline.remaining_ms()
+        if remaining is not None:
+            # SET LOCAL lasts until the transaction ends, which request sessions reused by
+            # other resolvers do not do between resolvers: reset after the statement
+            cursor.execute(f"SET LOCAL statement_timeout = {remaining}")
+            conn.info[TIMEOUT_SET] = True
+    elif conn.dialect.name == "sqlite":
+        dbapi_connection.set_progress_handler(
+            lambda: 1 if deadline.should_interrupt() else 0, SQLITE_PROGRESS_INTERVAL
+        )
+
+
+def _reset_statement_timeout(conn) -> None:
+    """Restores the session's statement_timeout after a statement run under a deadline."""
+    if conn.info.pop(TIMEOUT_SET, False):
+        # A separate cursor, so the statement's results stay readable
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = DEFAULT")
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.name == "postgresql":
+        _reset_statement_timeout(conn)
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    deadline.connection = None
+    if conn.dialect.name == "sqlite":
+        conn.connection.dbapi_connection.set_progress_handler(None, SQLITE_PROGRESS_INTERVAL)
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        # The failed transaction is rolled back, and the timeout with it
+        context.connection.info.pop(TIMEOUT_SET, None)
+    deadline = current_deadline.get()
+    if deadline is None or context.connection is None:
+        return
+    deadline.connection = None
+    if context.connection.dialect.name == "sqlite":
+        context.connection.connection.dbapi_connection.set_progress_handler(None, SQLITE_PROGRESS_INTERVAL)
+
+
+def install_statement_deadlines(engine: Engine) -> None:
+    """
+    Registers the engine event listeners enforcing statement deadlines.
+
+    Args:
+        engine: SQLAlchemy engine
+    """
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,177 @@
+"""
+Process-local directory cache of teachers and wizards.
+
+Teachers and wizards only change through the create mutations, so every
+worker keeps all of them in memory as immutable records, one cache per
+school. Creating one bumps the school's directory_versions row in the same
+transaction; workers compare that version at most once per check interval
+(on every use when the shared state is enabled, see app.database.shared_state)
+and reload that school's cache on change.
+"""
+from typing import Dict, List, NamedTuple, Optional
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from app.database.db import insert_for
+from app.database.shared_state import shared_state
+from app.models.models import DirectoryVersion, House, Teacher, Wizard
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two version checks against the database
+DIRECTORY_CHECK_INTERVAL = float(os.getenv("DIRECTORY_CHECK_INTERVAL", "1"))
+
+
+class TeacherRecord(NamedTuple):
+    id: int
+    name: str
+    subject: str
+    house: Optional[House]
+
+
+class WizardRecord(NamedTuple):
+    id: int
+    name: str
+    house: House
+    wand: str
+    patronus: Optional[str]
+
+
+def get_directory_version(db: Session, school_id: int) -> int:
+    """
+    Reads the current directory version of a school.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the directory
+
+    Returns:
+        Integer version (0 if never bumped)
+    """
+    version = db.query(DirectoryVersion.version).filter(
+        DirectoryVersion.id == school_id
+    ).scalar()
+    return version or 0
+
+
+def bump_directory_version(db: Session, school_id: int) -> None:
+    """
+    Increments a school's directory version; call before committing a teacher or wizard change.
+
+    A single upsert, so concurrent first changes of a school cannot both insert the row.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the directory
+    """
+    db.execute(
+        insert_for(db, DirectoryVersion)
+        .values(id=school_id, version=1)
+        .on_conflict_do_update(
+            index_elements=[DirectoryVersion.id],
+            set_={"version": DirectoryVersion.version + 1}
+        )
+    )
+
+
+class DirectoryCache:
+    """Versioned in-memory copy of the teachers and wizards of one school."""
+
+    def __init__(self, school_id: int, check_interval: float = DIRECTORY_CHECK_INTERVAL):
+        self.school_id = school_id
+        self.check_interval = check_interval
+        self.version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._teachers: Dict[int, TeacherRecord] = {}
+        self._wizards: Dict[int, WizardRecord] = {}
+
+    def load(self, db: Session) -> None:
+        """Reloads every teacher and wizard along with the current version."""
+        with self._lock:
+            version = get_directory_version(db, self.school_id)
+            teachers = {
+                t.id: TeacherRecord(t.id, t.name, t.subject, t.house)
+                for t in db.query(Teacher.id, Teacher.name, Teacher.subject, Teacher.house).filter(
+                    Teacher.school_id == self.school_id
+                )
+            }
+            wizards = {
+                w.id: WizardRecord(w.id, w.name, w.house, w.wand, w.patronus)
+                for w in db.query(Wizard.id, Wizard.name, Wizard.house, Wizard.wand, Wizard.patronus).filter(
+                    Wizard.school_id == self.school_id
+                )
+            }
+            # Swap whole dictionaries so readers never see a partial reload
+            self._teachers, self._wizards = teachers, wizards
+            self.version = version
+            self._checked_at = time.monotonic()
+        shared_state.publish_directory_version(self.school_id, version)
+        logger.info(
+            f"Loaded directory version {version} of school {self.school_id}: "
+            f"{len(teachers)} teachers, {len(wizards)} wizards"
+        )
+
+    def ensure_fresh(self, db: Session, force: bool = False) -> None:
+        """Reloads the directory if its version changed (checked at most once per interval)."""
+        # Versions published by the other workers are read from shared memory on every call
+        shared_version = shared_state.directory_version(self.school_id)
+        if not force and shared_version is not None and self.version is not None:
+            if shared_version != self.version:
+                self.load(db)
+            return
+        now = time.monotonic()
+        if not force and self.version is not None and now - self._checked_at < self.check_interval:
+            return
+        if self.version is None or get_directory_version(db, self.school_id) != self.version:
+            self.load(db)
+        else:
+            self._checked_at = now
+
+    def teachers(self, db: Session) -> List[TeacherRecord]:
+        self.ensure_fresh(db)
+        return list(self._teachers.values())
+
+    def wizards(self, db: Session) -> List[WizardRecord]:
+        self.ensure_fresh(db)
+        return list(self._wizards.values())
+
+    def teacher(self, db: Session, id: int) -> Optional[TeacherRecord]:
+        self.ensure_fresh(db)
+        record = self._teachers.get(id)
+        if record is None:
+            # May have been created by another worker since the last check
+            self.ensure_fresh(db, force=True)
+            record = self._teachers.get(id)
+        return record
+
+    def wizard(self, db: Session, id: int) -> Optional[WizardRecord]:
+        self.ensure_fresh(db)
+        record = self._wizards.get(id)
+        if record is None:
+            self.ensure_fresh(db, force=True)
+            record = self._wizards.get(id)
+        return record
+
+
+class SchoolDirectories:
+    """Directory caches of every school served by this process, created on first use."""
+
+    def __init__(self, check_interval: float = DIRECTORY_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._schools: Dict[int, DirectoryCache] = {}
+
+    def school(self, school_id: int) -> DirectoryCache:
+        cache = self._schools.get(school_id)
+        if cache is None:
+            with self._lock:
+                cache = self._schools.setdefault(school_id, DirectoryCache(school_id, self.check_interval))
+        return cache
+
+
+directory = SchoolDirectories()
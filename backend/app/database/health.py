@@ -0,0 +1,166 @@
+"""
+Readiness check of the database.
+
+Orchestrator probes hit every worker every few seconds, so the database
+ping is cached for HEALTH_CACHE_SECONDS and bounded by HEALTH_DB_TIMEOUT;
+at most one ping per worker runs at a time, so a slow or dead database never
+accumulates probe connections. Pool saturation is read from memory on every
+probe.
+"""
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds a database check result is reused by readiness probes
+HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", "5"))
+
+# Seconds a readiness probe waits for the database ping
+HEALTH_DB_TIMEOUT = float(os.getenv("HEALTH_DB_TIMEOUT", "1"))
+
+ALEMBIC_CONFIG = os.path.join(os.path.dirname(__file__), "..", "..", "alembic.ini")
+
+
+def get_migration_heads() -> Optional[List[str]]:
+    """
+    Returns the head revisions of the migration scripts.
+
+    Returns:
+        Sorted revision ids, or None when the scripts cannot be read
+    """
+    try:
+        from alembic.config import Config
+        from alembic.script import ScriptDirectory
+
+        config = Config(ALEMBIC_CONFIG)
+        config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_CONFIG), "migrations"))
+        return sorted(ScriptDirectory.from_config(config).get_heads())
+    except Exception as e:
+        logger.warning(f"Could not read the migration heads: {e}")
+        return None
+
+
+class ReadinessCheck:
+    """
+    Cached, single-flight database check of one worker.
+
+    Args:
+        engine: SQLAlchemy engine
+        cache_seconds: Seconds a database check result is reused
+        timeout: Seconds a probe waits for the database ping
+    """
+
+    def __init__(self, engine: Engine, cache_seconds: float = HEALTH_CACHE_SECONDS, timeout: float = HEALTH_DB_TIMEOUT):
+        self.engine = engine
+        self.cache_seconds = cache_seconds
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._result: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._inflight: Optional[Future] = None
+        self._heads: Optional[List[str]] = None
+        self._heads_loaded = False
+
+    def _ping(self) -> Dict[str, Any]:
+        if not self._heads_loaded:
+            self._heads = get_migration_heads()
+            self._heads_loaded = True
+
+        started_at = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                latency_ms = round((time.perf_counter() - started_at) * 1000, 3)
+                if inspect(conn).has_table("alembic_version"):
+                    current = sorted(conn.execute(text("SELECT version_num FROM alembic_version")).scalars())
+                else:
+                    current = None
+        except Exception as e:
+            return {
+                "database": {"status": "error", "error": f"{type(e).__name__}: {e}"},
+                "migrations": {"status": "unknown"},
+            }
+
+        if current is None:
+            # Tables created by the application at startup, not by migrations
+            migrations = {"status": "unversioned", "head": self._heads}
+        elif self._heads is None:
+            migrations = {"status": "unknown", "current": current}
+        else:
+            migrations = {
+                "status": "ok" if current == self._heads else "mismatch",
+                "current": current,
+                "head": self._heads,
+            }
+        return {"database": {"status": "ok", "latency_ms": latency_ms}, "migrations": migrations}
+
+    def _run_ping(self, future: Future) -> None:
+        try:
+            result = self._ping()
+        except Exception as e:
+            result = {"database": {"status": "error", "error": str(e)}, "migrations": {"status": "unknown"}}
+        with self._lock:
+            self._result = (time.monotonic(), result)
+            self._inflight = None
+        future.set_result(result)
+
+    def _database_checks(self) -> Tuple[Dict[str, Any], bool]:
+        with self._lock:
+            if self._result is not None and time.monotonic() - self._result[0] < self.cache_seconds:
+                return self._result[1], True
+            future = self._inflight
+            if future is None:
+                future = self._inflight = Future()
+                threading.Thread(target=self._run_ping, args=(future,), name="readiness-ping", daemon=True).start()
+        try:
+            return future.result(timeout=self.timeout), False
+        except FutureTimeoutError:
+            # The ping keeps running; later probes wait for it instead of starting another one
+            return {
+                "database": {"status": "timeout", "timeout_seconds": self.timeout},
+                "migrations": {"status": "unknown"},
+            }, False
+
+    def _pool_check(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        if not hasattr(pool, "snapshot"):
+            return {"status": "ok"}
+        stats = pool.snapshot()
+        capacity = stats["pool_size"] + stats["max_overflow"]
+        saturated = stats["checked_out"] >= capacity and stats["waiting"] > 0
+        return {
+            "status": "saturated" if saturated else "ok",
+            "checked_out": stats["checked_out"],
+            "capacity": capacity,
+            "waiting": stats["waiting"],
+            "utilization": round(stats["checked_out"] / capacity, 3) if capacity else 0.0,
+        }
+
+    def check(self) -> Dict[str, Any]:
+        """
+        Runs the readiness checks.
+
+        Returns:
+            dict: "ready" flag, whether the database result came from the cache, and each check
+        """
+        database_checks, cached = self._database_checks()
+        checks = {**database_checks, "pool": self._pool_check()}
+        ready = (
+            checks["database"]["status"] == "ok"
+            and checks["migrations"]["status"] != "mismatch"
+            and checks["pool"]["status"] == "ok"
+        )
+        return {
+            "status": "ready" if ready else "not_ready",
+            "ready": ready,
+            "timestamp": datetime.utcnow().isoformat(),
+            "cached": cached,
+            "checks": checks,
+        }
@@ -0,0 +1,320 @@
+"""
+Student and teacher leaderboards for the Hogwarts house points system.
+
+Per-wizard and per-teacher running totals are stored in wizard_points_totals
+and teacher_points_totals and updated in the same transaction as each award.
+Wizards are ranked within their own house (Wizard.house), whichever house an
+award goes to.
+Every process keeps an in-memory sorted view of those totals per school and
+house, so all-time leaderboard reads never touch house_points.
+"""
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.database.checkpoints import transaction_models
+from app.database.db import insert_for
+from app.database.tenancy import get_school_ids
+from app.models.models import House, HousePoints, TeacherPointsTotal, Wizard, WizardPointsTotal
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which the in-memory leaderboards are reloaded from the totals tables,
+# which picks up awards recorded by other worker processes
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "5"))
+
+# Largest number of entries a leaderboard returns
+LEADERBOARD_MAX_LIMIT = int(os.getenv("LEADERBOARD_MAX_LIMIT", "100"))
+
+
+class TopK:
+    """
+    Totals kept sorted by (-total, id), so the leaders are always the first entries.
+
+    Updates cost O(n) list moves and reads of the top K cost O(K).
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[int, int]] = []
+        self._totals: Dict[int, int] = {}
+
+    def set(self, id: int, total: int) -> None:
+        old = self._totals.get(id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, id))]
+        self._totals[id] = total
+        insort(self._keys, (-total, id))
+
+    def top(self, limit: int) -> List[Tuple[int, int]]:
+        return [(id, -negated) for negated, id in self._keys[:max(limit, 0)]]
+
+
+class Leaderboards:
+    """Process-local leaderboards of the wizards (overall and per house) and teachers of one school."""
+
+    def __init__(self, school_id: int, refresh_seconds: float = LEADERBOARD_REFRESH_SECONDS):
+        self.school_id = school_id
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._wizards = TopK()
+        self._wizards_by_house = {house: TopK() for house in House}
+        self._teachers = TopK()
+
+    def load(self, db: Session) -> None:
+        """Rebuilds the in-memory leaderboards from the totals tables."""
+        wizards = db.query(
+            WizardPointsTotal.wizard_id, WizardPointsTotal.house, WizardPointsTotal.total_points
+        ).filter(WizardPointsTotal.school_id == self.school_id).all()
+        teachers = db.query(TeacherPointsTotal.teacher_id, TeacherPointsTotal.total_points).filter(
+            TeacherPointsTotal.school_id == self.school_id
+        ).all()
+
+        with self._lock:
+            self._reset()
+            for wizard_id, house, total in wizards:
+                self._wizards.set(wizard_id, total)
+                self._wizards_by_house[house].set(wizard_id, total)
+            for teacher_id, total in teachers:
+                self._teachers.set(teacher_id, total)
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session) -> None:
+        """Reloads the leaderboards if they were never loaded or are older than the refresh interval."""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.load(db)
+
+    def apply(
+        self,
+        wizard_house: Optional[House],
+        wizard_id: Optional[int],
+        wizard_total: Optional[int],
+        teacher_id: int,
+        teacher_total: int
+    ) -> None:
+        """Applies the new running totals of a committed award."""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            if wizard_id is not None:
+                self._wizards.set(wizard_id, wizard_total)
+                self._wizards_by_house[House(wizard_house)].set(wizard_id, wizard_total)
+            self._teachers.set(teacher_id, teacher_total)
+
+    def top_wizards(self, house: Optional[House], limit: int) -> List[Tuple[int, int]]:
+        with self._lock:
+            board = self._wizards_by_house[House(house)] if house else self._wizards
+            return board.top(limit)
+
+    def top_teachers(self, limit: int) -> List[Tuple[int, int]]:
+        with self._lock:
+            return self._teachers.top(limit)
+
+
+class SchoolLeaderboards:
+    """Leaderboards of every school served by this process, created on first use."""
+
+    def __init__(self, refresh_seconds: float = LEADERBOARD_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._schools: Dict[int, Leaderboards] = {}
+
+    def school(self, school_id: int) -> Leaderboards:
+        boards = self._schools.get(school_id)
+        if boards is None:
+            with self._lock:
+                boards = self._schools.setdefault(school_id, Leaderboards(school_id, self.refresh_seconds))
+        return boards
+
+
+leaderboards = SchoolLeaderboards()
+
+
+def _increment(db: Session, model, key_column, key: int, points: int, **values) -> int:
+    """
+    Adds points to a running total row with a single upsert and returns the new total.
+
+    Concurrent first awards of the same wizard or teacher both land in the same row.
+    Other values (e.g. the wizard's house) are refreshed on every award.
+    """
+    statement = insert_for(db, model).values(**{key_column.key: key}, total_points=points, **values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[key_column.key],
+        set_={
+            "total_points": model.total_points + statement.excluded.total_points,
+            **{name: statement.excluded[name] for name in values},
+        }
+    ).returning(model.total_points)
+    return db.execute(statement).scalar_one()
+
+
+def record_award(db: Session, points: HousePoints, wizard_house: Optional[House] = None) -> Tuple[Optional[int], int]:
+    """
+    Adds a new transaction to the wizard and teacher running totals.
+
+    Must be called before the transaction inserting `points` is committed.
+
+    Args:
+        db: SQLAlchemy database session
+        points: The HousePoints row being inserted
+        wizard_house: House of the awarded wizard (Wizard.house, as in rebuild_totals)
+
+    Returns:
+        Tuple of the new wizard total (None for house-wide points) and the new teacher total
+    """
+    wizard_total = None
+    if points.wizard_id is not None:
+        wizard_total = _increment(
+            db, WizardPointsTotal, WizardPointsTotal.wizard_id, points.wizard_id, points.points,
+            house=House(wizard_house), school_id=points.school_id
+        )
+    teacher_total = _increment(
+        db, TeacherPointsTotal, TeacherPointsTotal.teacher_id, points.teacher_id, points.points,
+        school_id=points.school_id
+    )
+    return wizard_total, teacher_total
+
+
+def rebuild_totals(db: Session, school_id: int) -> None:
+    """
+    Recomputes the wizard and teacher running totals of a school from every transaction.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the totals
+    """
+    db.query(WizardPointsTotal).filter(WizardPointsTotal.school_id == school_id).delete(synchronize_session=False)
+    db.query(TeacherPointsTotal).filter(TeacherPointsTotal.school_id == school_id).delete(synchronize_session=False)
+
+    wizards: Dict[Tuple[int, House], int] = {}
+    teachers: Dict[int, int] = {}
+    for model in transaction_models(db, school_id, None, None):
+        for wizard_id, house, total in db.query(
+            model.wizard_id, Wizard.house, func.sum(model.points)
+        ).join(Wizard, Wizard.id == model.wizard_id).filter(
+            model.school_id == school_id
+        ).group_by(model.wizard_id, Wizard.house):
+            wizards[(wizard_id, house)] = wizards.get((wizard_id, house), 0) + total
+        for teacher_id, total in db.query(
+            model.teacher_id, func.sum(model.points)
+        ).filter(model.school_id == school_id).group_by(model.teacher_id):
+            teachers[teacher_id] = teachers.get(teacher_id, 0) + total
+
+    db.add_all([
+        WizardPointsTotal(wizard_id=wizard_id, school_id=school_id, house=house, total_points=total)
+        for (wizard_id, house), total in wizards.items()
+    ])
+    db.add_all([
+        TeacherPointsTotal(teacher_id=teacher_id, school_id=school_id, total_points=total)
+        for teacher_id, total in teachers.items()
+    ])
+    db.commit()
+    logger.info(
+        f"Rebuilt running totals of school {school_id} for {len(wizards)} wizards and {len(teachers)} teachers"
+    )
+
+
+def init_totals(db: Session) -> None:
+    """Builds the running totals of every school with transactions but no totals recorded yet."""
+    for school_id in get_school_ids(db):
+        if db.query(TeacherPointsTotal.teacher_id).filter(
+            TeacherPointsTotal.school_id == school_id
+        ).first() is None and db.query(HousePoints.id).filter(HousePoints.school_id == school_id).first() is not None:
+            rebuild_totals(db, school_id)
+
+
+def _windowed_totals(
+    db: Session,
+    school_id: int,
+    key_column_name: str,
+    since: datetime,
+    house: Optional[House] = None
+) -> Dict[int, int]:
+    """
+    Sums points per wizard or teacher of a school over the transactions since a point in time.
+
+    `house` restricts wizard rankings to the wizards of that house (Wizard.house,
+    as in the all-time leaderboards), whichever house their awards went to.
+    """
+    totals: Dict[int, int] = {}
+    for model in transaction_models(db, school_id, since, None):
+        key_column = getattr(model, key_column_name)
+        query = db.query(key_column, func.sum(model.points)).filter(
+            model.school_id == school_id, model.timestamp >= since, key_column.isnot(None)
+        )
+        if house:
+            query = query.join(Wizard, Wizard.id == model.wizard_id).filter(Wizard.house == House(house))
+        for key, total in query.group_by(key_column):
+            totals[key] = totals.get(key, 0) + total
+    return totals
+
+
+def _rank(totals: Dict[int, int], limit: int) -> List[Tuple[int, int]]:
+    return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+def get_top_wizards(
+    db: Session,
+    school_id: int,
+    house: Optional[House] = None,
+    limit: int = 10,
+    since: Optional[datetime] = None
+) -> List[Tuple[int, int]]:
+    """
+    Returns the wizards with the most points.
+
+    All-time leaderboards are served from memory; a `since` window is
+    aggregated from the timestamp-indexed transactions of that window.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the leaderboard
+        house: Optional house to restrict the leaderboard to (the wizards' own house)
+        limit: Number of wizards to return, clamped to 1..LEADERBOARD_MAX_LIMIT
+        since: Optional start of the window to rank over
+
+    Returns:
+        List of (wizard_id, total_points) tuples, best first
+    """
+    limit = min(max(limit, 1), LEADERBOARD_MAX_LIMIT)
+    if since is not None:
+        return _rank(_windowed_totals(db, school_id, "wizard_id", since, house), limit)
+    boards = leaderboards.school(school_id)
+    boards.ensure_fresh(db)
+    return boards.top_wizards(house, limit)
+
+
+def get_top_teachers(
+    db: Session,
+    school_id: int,
+    limit: int = 10,
+    since: Optional[datetime] = None
+) -> List[Tuple[int, int]]:
+    """
+    Returns the teachers who gave the most points.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the leaderboard
+        limit: Number of teachers to return, clamped to 1..LEADERBOARD_MAX_LIMIT
+        since: Optional start of the window to rank over
+
+    Returns:
+        List of (teacher_id, total_points) tuples, best first
+    """
+    limit = min(max(limit, 1), LEADERBOARD_MAX_LIMIT)
+    if since is not None:
+        return _rank(_windowed_totals(db, school_id, "teacher_id", since), limit)
+    boards = leaderboards.school(school_id)
+    boards.ensure_fresh(db)
+    return boards.top_teachers(limit)
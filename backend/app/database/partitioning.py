@@ -0,0 +1,319 @@
+"""
+Range partitioning of the house_points table on PostgreSQL.
+
+When HOUSE_POINTS_PARTITIONING is set to "month" or "term", house_points is
+declared as a table partitioned by RANGE (timestamp). This module creates the
+partitions ahead of time, moves stray rows out of the default partition and
+detaches old partitions so archiving a school year is a metadata-only change.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+import logging
+import os
+import re
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.database.db import HOUSE_POINTS_PARTITIONING, PARTITIONING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "house_points"
+DEFAULT_PARTITION = "house_points_default"
+
+# How many future periods to keep created in advance
+PARTITIONS_AHEAD = int(os.getenv("HOUSE_POINTS_PARTITIONS_AHEAD", "3"))
+
+# How often the background maintenance re-checks the partitions (seconds)
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("HOUSE_POINTS_PARTITION_MAINTENANCE_INTERVAL", "86400"))
+
+# Hogwarts terms as (name, first month); each term runs until the next one starts
+TERMS = [("spring", 1), ("summer", 4), ("autumn", 9)]
+
+_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def period_start(dt: datetime, granularity: str = HOUSE_POINTS_PARTITIONING) -> datetime:
+    """
+    Returns the start of the partition period containing a datetime.
+
+    Args:
+        dt: Datetime to locate
+        granularity: "month" or "term"
+
+    Returns:
+        datetime: Inclusive lower bound of the period
+    """
+    if granularity == "month":
+        return datetime(dt.year, dt.month, 1)
+    if granularity == "term":
+        month = max(first for _, first in TERMS if first <= dt.month)
+        return datetime(dt.year, month, 1)
+    raise ValueError(f"Invalid partition granularity: {granularity}")
+
+
+def next_period(start: datetime, granularity: str = HOUSE_POINTS_PARTITIONING) -> datetime:
+    """
+    Returns the start of the period following the one starting at `start`.
+
+    Args:
+        start: Start of the current period
+        granularity: "month" or "term"
+
+    Returns:
+        datetime: Exclusive upper bound of the current period
+    """
+    if granularity == "month":
+        if start.month == 12:
+            return datetime(start.year + 1, 1, 1)
+        return datetime(start.year, start.month + 1, 1)
+    if granularity == "term":
+        later = [first for _, first in TERMS if first > start.month]
+        if later:
+            return datetime(start.year, later[0], 1)
+        return datetime(start.year + 1, TERMS[0][1], 1)
+    raise ValueError(f"Invalid partition granularity: {granularity}")
+
+
+def partition_name(start: datetime, granularity: str = HOUSE_POINTS_PARTITIONING) -> str:
+    """
+    Builds the partition table name for a period.
+
+    Args:
+        start: Start of the period
+        granularity: "month" or "term"
+
+    Returns:
+        str: Name such as house_points_2024_09 or house_points_2024_autumn
+    """
+    if granularity == "month":
+        return f"{PARENT_TABLE}_{start.year}_{start.month:02d}"
+    term = next(name for name, first in TERMS if first == start.month)
+    return f"{PARENT_TABLE}_{start.year}_{term}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    """
+    Checks whether house_points is a partitioned table in the connected database.
+
+    Args:
+        conn: SQLAlchemy connection
+
+    Returns:
+        bool: True if house_points is declared with PARTITION BY
+    """
+    if conn.dialect.name != "postgresql":
+        return False
+    result = conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :name"
+    ), {"name": PARENT_TABLE}).first()
+    return result is not None
+
+
+def list_partitions(conn: Connection) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """
+    Lists the attached partitions of house_points with their bounds.
+
+    Args:
+        conn: SQLAlchemy connection
+
+    Returns:
+        List of (name, lower, upper) tuples; bounds are None for the default partition
+    """
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name ORDER BY c.relname"
+    ), {"name": PARENT_TABLE}).all()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_PATTERN.search(bound or "")
+        if match:
+            partitions.append((
+                name,
+                datetime.fromisoformat(match.group(1)),
+                datetime.fromisoformat(match.group(2)),
+            ))
+        else:
+            partitions.append((name, None, None))
+    return partitions
+
+
+def create_partition(conn: Connection, start: datetime, granularity: str = HOUSE_POINTS_PARTITIONING) -> Optional[str]:
+    """
+    Creates and attaches the partition for the period starting at `start`.
+
+    Rows already sitting in the default partition for that range are moved
+    into the new partition first, otherwise PostgreSQL would refuse to attach it.
+
+    Args:
+        conn: SQLAlchemy connection (inside a transaction)
+        start: Start of the period
+        granularity: "month" or "term"
+
+    Returns:
+        Name of the created partition, or None if it already existed
+    """
+    name = partition_name(start, granularity)
+    end = next_period(start, granularity)
+
+    exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+    if exists:
+        return None
+
+    bounds = {"start": start, "end": end}
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar():
+        conn.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), bounds)
+    conn.execute(text(
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+    ))
+    logger.info(f"Created partition {name} for [{start}, {end})")
+    return name
+
+
+def create_partitions(
+    conn: Connection,
+    since: datetime,
+    ahead: int = PARTITIONS_AHEAD,
+    granularity: str = HOUSE_POINTS_PARTITIONING
+) -> List[str]:
+    """
+    Creates the default partition and every period partition from `since`
+    up to `ahead` periods after the current one.
+
+    Args:
+        conn: SQLAlchemy connection (inside a transaction)
+        since: Earliest datetime to cover
+        ahead: Number of future periods to pre-create
+        granularity: "month" or "term"
+
+    Returns:
+        List of newly created partition names
+    """
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"
+    ))
+
+    start = period_start(since, granularity)
+    last = period_start(datetime.utcnow(), granularity)
+    for _ in range(ahead):
+        last = next_period(last, granularity)
+
+    created = []
+    while start <= last:
+        name = create_partition(conn, start, granularity)
+        if name:
+            created.append(name)
+        start = next_period(start, granularity)
+    return created
+
+
+def ensure_partitions(
+    engine: Engine,
+    ahead: int = PARTITIONS_AHEAD,
+    granularity: str = HOUSE_POINTS_PARTITIONING
+) -> List[str]:
+    """
+    Makes sure partitions exist for the current period and `ahead` periods in the future.
+
+    Args:
+        engine: SQLAlchemy engine
+        ahead: Number of future periods to pre-create
+        granularity: "month" or "term"
+
+    Returns:
+        List of newly created partition names
+    """
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            logger.warning("house_points is not partitioned, skipping partition maintenance")
+            return []
+        return create_partitions(conn, datetime.utcnow(), ahead, granularity)
+
+
+def detach_partitions_before(engine: Engine, cutoff: datetime) -> List[str]:
+    """
+    Detaches every partition whose range ends on or before `cutoff`.
+
+    Detaching only rewrites catalog entries, so it is instant regardless of
+    partition size. The detached tables stay in the database as standalone
+    tables and can be dumped or dropped by the archiving job.
+
+    Args:
+        engine: SQLAlchemy engine
+        cutoff: Exclusive upper bound of the data to archive
+
+    Returns:
+        List of detached partition names
+    """
+    detached = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return detached
+        for name, _, upper in list_partitions(conn):
+            if upper is not None and upper <= cutoff:
+                conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+                detached.append(name)
+                logger.info(f"Detached partition {name}")
+    return detached
+
+
+def archive_school_year(engine: Engine, year: int) -> List[str]:
+    """
+    Detaches all partitions of the school year starting in September of `year`
+    (and any older ones).
+
+    Args:
+        engine: SQLAlchemy engine
+        year: Calendar year in which the school year started
+
+    Returns:
+        List of detached partition names
+    """
+    return detach_partitions_before(engine, datetime(year + 1, 9, 1))
+
+
+def start_partition_maintenance(engine: Engine, interval: int = PARTITION_MAINTENANCE_INTERVAL) -> Optional[threading.Thread]:
+    """
+    Creates upcoming partitions now, then keeps creating them periodically in a daemon thread.
+
+    The first run is synchronous so inserts made during startup always find a partition.
+
+    Args:
+        engine: SQLAlchemy engine
+        interval: Seconds between maintenance runs
+
+    Returns:
+        The maintenance thread, or None when partitioning is disabled
+    """
+    if not PARTITIONING_ENABLED:
+        return None
+
+    ensure_partitions(engine)
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                ensure_partitions(engine)
+            except Exception as e:
+                logger.error(f"Error maintaining house_points partitions: {e}")
+
+    thread = threading.Thread(target=run, name="partition-maintenance", daemon=True)
+    thread.stop = stop
+    thread.start()
+    return thread
@@ -0,0 +1,197 @@
+"""
+Database connection pool settings and statistics.
+
+Pool settings default per environment (APP_ENV, set by `run.py --env`) and
+can be overridden one by one with DB_POOL_* environment variables or the
+matching `run.py` flags. The pool records how long every checkout waited
+for a connection, so pool sizes can be checked against the number of
+workers and resolver threads instead of guessed.
+"""
+from bisect import bisect_left
+from typing import Any, Dict
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Pool defaults per environment
+POOL_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "dev": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "pool_use_lifo": False,
+    },
+    "test": {
+        "pool_size": 2,
+        "max_overflow": 2,
+        "pool_timeout": 5,
+        "pool_recycle": -1,
+        "pool_pre_ping": False,
+        "pool_use_lifo": False,
+    },
+    # LIFO keeps the connections needed by steady traffic busy, so the
+    # others stay idle long enough to be recycled after a burst
+    "prod": {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_timeout": 10,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "pool_use_lifo": True,
+    },
+}
+
+# Longer APP_ENV spellings accepted for the environments above
+ENVIRONMENT_ALIASES = {"development": "dev", "testing": "test", "production": "prod"}
+
+# Environment whose defaults are used when APP_ENV is unset or unknown
+DEFAULT_ENVIRONMENT = "dev"
+
+# Upper bounds (milliseconds) of the checkout wait histogram buckets
+WAIT_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ("1", "true", "yes")
+
+
+def get_pool_settings(environment: str = None) -> Dict[str, Any]:
+    """
+    Returns the pool settings of an environment with the DB_POOL_* overrides applied.
+
+    Args:
+        environment: "dev", "test" or "prod", or one of their long names such as
+            "production" (default: APP_ENV); unknown values log a warning and
+            use the "dev" defaults
+
+    Returns:
+        dict: create_engine keyword arguments
+    """
+    environment = environment or os.getenv("APP_ENV", DEFAULT_ENVIRONMENT)
+    environment = ENVIRONMENT_ALIASES.get(environment.lower(), environment.lower())
+    if environment not in POOL_DEFAULTS:
+        logger.warning(
+            f"Unknown APP_ENV value {environment!r}, using the {DEFAULT_ENVIRONMENT} pool defaults "
+            f"(expected one of {', '.join(POOL_DEFAULTS)})"
+        )
+        environment = DEFAULT_ENVIRONMENT
+    defaults = POOL_DEFAULTS[environment]
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", defaults["pool_size"])),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", defaults["max_overflow"])),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", defaults["pool_timeout"])),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", defaults["pool_recycle"])),
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", defaults["pool_pre_ping"]),
+        "pool_use_lifo": _env_flag("DB_POOL_USE_LIFO", defaults["pool_use_lifo"]),
+    }
+
+
+class PoolStats:
+    """Checkout wait histogram and connection lifecycle counters of a pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.checkouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.timeouts = 0
+        self.waiting = 0
+        self.peak_checked_out = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def record_wait(self, wait_ms: float, checked_out: int) -> None:
+        with self._lock:
+            self.buckets[bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+            self.checkouts += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            histogram = {f"le_{bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self.buckets)}
+            histogram["inf"] = self.buckets[-1]
+            return {
+                "checkouts": self.checkouts,
+                "waiting": self.waiting,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+                "wait_ms_histogram": histogram,
+                "peak_checked_out": self.peak_checked_out,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+            }
+
+
+class MonitoredQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waits for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        # A recreated pool inherits the listeners (and, below, the statistics) of the original
+        if "_dispatch" not in kwargs:
+            event.listen(self, "connect", self._on_connect)
+            event.listen(self, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.stats._lock:
+            self.stats.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.stats._lock:
+            self.stats.invalidations += 1
+
+    def recreate(self):
+        # Keeps the statistics when the engine recreates its pool (e.g. after dispose)
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        with self.stats._lock:
+            self.stats.waiting += 1
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self.stats._lock:
+                self.stats.timeouts += 1
+            raise
+        finally:
+            with self.stats._lock:
+                self.stats.waiting -= 1
+        self.stats.record_wait((time.perf_counter() - started_at) * 1000, self.checkedout())
+        return connection
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the live state and statistics of the pool.
+
+        Returns:
+            dict: Settings, current occupancy and checkout statistics
+        """
+        return {
+            "pid": os.getpid(),
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "timeout": self._timeout,
+            "recycle": self._recycle,
+            "pre_ping": self._pre_ping,
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            **self.stats.snapshot(),
+        }
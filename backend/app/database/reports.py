@@ -0,0 +1,509 @@
+"""
+Background report jobs.
+
+End-of-term reports (per-student totals, per-teacher summaries, weekly
+standings for the year) scan a whole year of transactions, archive included,
+which is too slow for a request. `requestReport` records a report_jobs row
+and submits the job to the report process pool of the worker, so reports run
+on the other cores without holding an HTTP worker or a resolver thread.
+
+The report process reads with its own connections, writes its progress to
+the job row, writes the result as CSV under REPORTS_DIR (to a temporary name,
+renamed once complete) and marks the job succeeded or failed. Any worker
+can report the status and serve the file. A worker shutting down fails the
+jobs it had not started yet and lets the running ones finish. A maintenance
+thread fails the jobs left queued or running by workers that died, and
+deletes the jobs and files older than the retention window.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence
+from uuid import uuid4
+import csv
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.orm import Session
+
+from app.database.checkpoints import get_standings_series, transaction_models
+from app.database.db import SessionLocal
+from app.models.models import House, ReportJob, ReportKind, ReportStatus, Teacher, Wizard
+
+logger = logging.getLogger(__name__)
+
+# Processes generating reports in each worker. Every worker has its own pool, and every
+# report process its own connection pool: a host runs workers x REPORT_PROCESSES report
+# processes, each holding up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+REPORT_PROCESSES = int(os.getenv("REPORT_PROCESSES", str(min(2, os.cpu_count() or 1))))
+
+# Directory the report files are written to
+REPORTS_DIR = os.path.abspath(os.getenv("REPORTS_DIR", "reports"))
+
+# Longest period a report may cover
+REPORT_MAX_DAYS = int(os.getenv("REPORT_MAX_DAYS", "366"))
+
+# Days finished jobs and their files are kept (0: forever)
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "7"))
+
+# Minutes after which a job still queued or running is considered abandoned by a dead worker
+REPORT_STALE_MINUTES = int(os.getenv("REPORT_STALE_MINUTES", "60"))
+
+# Seconds between two sweeps of stale and expired jobs
+REPORT_MAINTENANCE_INTERVAL = int(os.getenv("REPORT_MAINTENANCE_INTERVAL", "3600"))
+
+# Minimum number of seconds between two progress updates of a job row
+REPORT_PROGRESS_INTERVAL = 0.5
+
+# Weeks of the standings series computed between two progress updates
+SERIES_CHUNK_WEEKS = 13
+
+Progress = Callable[[float], None]
+
+
+def _student_totals(db: Session, school_id: int, start: datetime, end: datetime, progress: Progress) -> List[Sequence]:
+    """Points, awards and deductions of every wizard over the period, best first."""
+    totals: Dict[int, List[int]] = {}
+    models = transaction_models(db, school_id, start, end)
+    for index, model in enumerate(models):
+        query = db.query(
+            model.wizard_id,
+            func.sum(model.points),
+            func.count(case((model.points > 0, 1))),
+            func.count(case((model.points < 0, 1)))
+        ).filter(
+            model.school_id == school_id,
+            model.wizard_id.isnot(None),
+            model.timestamp > start,
+            model.timestamp <= end
+        ).group_by(model.wizard_id)
+        for wizard_id, points, awards, deductions in query:
+            row = totals.setdefault(wizard_id, [0, 0, 0])
+            row[0] += points
+            row[1] += awards
+            row[2] += deductions
+        progress((index + 1) / (len(models) + 1))
+
+    wizards = db.query(Wizard.id, Wizard.name, Wizard.house).filter(Wizard.school_id == school_id).all()
+    rows = [
+        (id, name, House(house).value, *totals.get(id, (0, 0, 0)))
+        for id, name, house in wizards
+    ]
+    rows.sort(key=lambda row: (-row[3], row[1]))
+    return [("wizard_id", "name", "house", "total_points", "awards", "deductions"), *rows]
+
+
+def _teacher_summary(db: Session, school_id: int, start: datetime, end: datetime, progress: Progress) -> List[Sequence]:
+    """Points given and taken by every teacher over the period, and the number of students concerned."""
+    totals: Dict[int, List[int]] = {}
+    students: Dict[int, set] = {}
+    models = transaction_models(db, school_id, start, end)
+    for index, model in enumerate(models):
+        in_period = (model.school_id == school_id, model.timestamp > start, model.timestamp <= end)
+        query = db.query(
+            model.teacher_id,
+            func.count(case((model.points > 0, 1))),
+            func.coalesce(func.sum(case((model.points > 0, model.points))), 0),
+            func.count(case((model.points < 0, 1))),
+            func.coalesce(func.sum(case((model.points < 0, -model.points))), 0)
+        ).filter(*in_period).group_by(model.teacher_id)
+        for teacher_id, *values in query:
+            row = totals.setdefault(teacher_id, [0, 0, 0, 0])
+            for position, value in enumerate(values):
+                row[position] += value
+        # Students may appear in both tables, so they are counted once across them
+        pairs = db.query(model.teacher_id, model.wizard_id).filter(
+            *in_period, model.wizard_id.isnot(None)
+        ).distinct()
+        for teacher_id, wizard_id in pairs:
+            students.setdefault(teacher_id, set()).add(wizard_id)
+        progress((index + 1) / (len(models) + 1))
+
+    teachers = db.query(Teacher.id, Teacher.name, Teacher.subject).filter(Teacher.school_id == school_id).all()
+    rows = [
+        (id, name, subject, *totals.get(id, (0, 0, 0, 0)), len(students.get(id, ())))
+        for id, name, subject in teachers
+    ]
+    rows.sort(key=lambda row: (-(row[4] + row[6]), row[1]))
+    return [
+        ("teacher_id", "name", "subject", "awards", "points_awarded", "deductions", "points_deducted", "students"),
+        *rows
+    ]
+
+
+def _weekly_series(db: Session, school_id: int, start: datetime, end: datetime, progress: Progress) -> List[Sequence]:
+    """Standing of every house at the start of each week of the period, with the change since the previous week."""
+    series = []
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(weeks=SERIES_CHUNK_WEEKS), end)
+        chunk = get_standings_series(db, school_id, chunk_start, chunk_end, "week")
+        # Consecutive chunks share their boundary instant
+        series.extend(chunk[1:] if series else chunk)
+        progress(min((chunk_end - start) / (end - start), 1.0) if end > start else 1.0)
+        if chunk_end >= end:
+            break
+        chunk_start = chunk_end
+
+    rows = []
+    previous: Dict[House, int] = {}
+    for at, standings in series:
+        for house in House:
+            points = standings.get(house, 0)
+            rows.append((at.date().isoformat(), house.value, points, points - previous.get(house, points)))
+        previous = standings
+    return [("week", "house", "standing", "change"), *rows]
+
+
+REPORT_GENERATORS = {
+    ReportKind.STUDENT_TOTALS.value: _student_totals,
+    ReportKind.TEACHER_SUMMARY.value: _teacher_summary,
+    ReportKind.WEEKLY_SERIES.value: _weekly_series,
+}
+
+
+def report_path(job_id: str) -> str:
+    return os.path.join(REPORTS_DIR, f"{job_id}.csv")
+
+
+def create_report_job(db: Session, school_id: int, kind: ReportKind, days: int) -> ReportJob:
+    """
+    Records a queued report job; submit it to `report_runner` after this returns.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School the report is about
+        kind: Report to generate
+        days: Number of days before now covered by the report
+
+    Returns:
+        The new ReportJob
+    """
+    if not 1 <= days <= REPORT_MAX_DAYS:
+        raise ValueError(f"days must be between 1 and {REPORT_MAX_DAYS}")
+    end = datetime.utcnow()
+    job = ReportJob(
+        id=uuid4().hex,
+        school_id=school_id,
+        kind=ReportKind(kind).value,
+        status=ReportStatus.QUEUED.value,
+        progress=0.0,
+        start_date=end - timedelta(days=days),
+        end_date=end
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_report_job(db: Session, school_id: int, job_id: str) -> Optional[ReportJob]:
+    """
+    Retrieves a report job of a school.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the job
+        job_id: Id of the job
+
+    Returns:
+        ReportJob if found in this school, None otherwise
+    """
+    return db.query(ReportJob).filter(ReportJob.school_id == school_id, ReportJob.id == job_id).first()
+
+
+def get_report_jobs(db: Session, school_id: int, limit: int = 20) -> List[ReportJob]:
+    """
+    Lists the latest report jobs of a school.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the jobs
+        limit: Maximum number of jobs to return
+
+    Returns:
+        List of ReportJob, newest first
+    """
+    return db.query(ReportJob).filter(ReportJob.school_id == school_id).order_by(
+        ReportJob.created_at.desc()
+    ).limit(limit).all()
+
+
+def fail_report_job(job_id: str, error: str) -> None:
+    """Marks a job that has not finished as failed."""
+    db = SessionLocal()
+    try:
+        db.query(ReportJob).filter(
+            ReportJob.id == job_id,
+            ReportJob.status.in_((ReportStatus.QUEUED.value, ReportStatus.RUNNING.value))
+        ).update({"status": ReportStatus.FAILED.value, "error": error, "finished_at": datetime.utcnow()})
+        db.commit()
+    finally:
+        db.close()
+
+
+def fail_stale_report_jobs(db: Session, stale_minutes: int, now: Optional[datetime] = None) -> int:
+    """
+    Fails the jobs queued or started too long ago, left behind by a worker that died.
+
+    Args:
+        db: SQLAlchemy database session
+        stale_minutes: Minutes after which an unfinished job is abandoned
+        now: Current time (default: utcnow)
+
+    Returns:
+        Number of jobs failed
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(minutes=stale_minutes)
+    failed = db.query(ReportJob).filter(
+        or_(
+            and_(ReportJob.status == ReportStatus.QUEUED.value, ReportJob.created_at < cutoff),
+            and_(ReportJob.status == ReportStatus.RUNNING.value, ReportJob.started_at < cutoff)
+        )
+    ).update({
+        "status": ReportStatus.FAILED.value,
+        "error": "Interrupted: the worker running the report stopped",
+        "finished_at": datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+    if failed:
+        logger.warning(f"Failed {failed} report jobs abandoned for more than {stale_minutes} minutes")
+    return failed
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune_report_jobs(db: Session, retention_days: int, now: Optional[datetime] = None) -> int:
+    """
+    Deletes the jobs finished before the retention window, their files, and
+    the temporary files left by report processes that died.
+
+    Args:
+        db: SQLAlchemy database session
+        retention_days: Number of days finished jobs are kept
+        now: Current time (default: utcnow)
+
+    Returns:
+        Number of jobs deleted
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    expired = db.query(ReportJob.id, ReportJob.path).filter(
+        ReportJob.status.in_((ReportStatus.SUCCEEDED.value, ReportStatus.FAILED.value)),
+        ReportJob.finished_at < cutoff
+    ).all()
+    for job_id, path in expired:
+        # Files first: a job row is never left pointing to nothing it could serve
+        _remove(path or report_path(job_id))
+    if expired:
+        db.query(ReportJob).filter(
+            ReportJob.id.in_([job_id for job_id, _ in expired])
+        ).delete(synchronize_session=False)
+        db.commit()
+        logger.info(f"Deleted {len(expired)} report jobs finished before {cutoff}")
+
+    if os.path.isdir(REPORTS_DIR):
+        for entry in os.scandir(REPORTS_DIR):
+            if entry.name.endswith(".part") and datetime.utcfromtimestamp(entry.stat().st_mtime) < cutoff:
+                _remove(entry.path)
+    return len(expired)
+
+
+def run_report_maintenance() -> None:
+    """Fails abandoned jobs and deletes the expired ones."""
+    db = SessionLocal()
+    try:
+        fail_stale_report_jobs(db, REPORT_STALE_MINUTES)
+        if REPORT_RETENTION_DAYS:
+            prune_report_jobs(db, REPORT_RETENTION_DAYS)
+    finally:
+        db.close()
+
+
+def start_report_maintenance(interval: int = REPORT_MAINTENANCE_INTERVAL) -> threading.Thread:
+    """
+    Runs report maintenance now, then periodically in a daemon thread.
+
+    Args:
+        interval: Seconds between maintenance runs
+
+    Returns:
+        The maintenance thread
+    """
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                run_report_maintenance()
+            except Exception as e:
+                logger.error(f"Error maintaining report jobs: {e}")
+            if stop.wait(interval):
+                return
+
+    thread = threading.Thread(target=run, name="report-maintenance", daemon=True)
+    thread.stop = stop
+    thread.start()
+    return thread
+
+
+class ReportAbandoned(Exception):
+    """Raised in a report process when its job was failed meanwhile (e.g. by the stale jobs sweep)."""
+
+
+def _update_job(db: Session, job_id: str, status: str, values: Dict) -> bool:
+    """
+    Updates a job only while it still has the given status.
+
+    Args:
+        db: SQLAlchemy database session
+        job_id: Id of the job
+        status: Status the job must have
+        values: Columns to update
+
+    Returns:
+        Whether the job was updated
+    """
+    updated = db.query(ReportJob).filter(
+        ReportJob.id == job_id, ReportJob.status == status
+    ).update(values, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def run_report(job_id: str) -> str:
+    """
+    Generates a report (runs in a report process).
+
+    Every update of the job is conditional on its status, so a job failed by
+    the stale jobs sweep while its report was running stays failed.
+
+    Args:
+        job_id: Id of the queued job
+
+    Returns:
+        The final status of the job
+    """
+    db = SessionLocal()
+    try:
+        job = db.get(ReportJob, job_id)
+        if job is None or job.status != ReportStatus.QUEUED.value:
+            return job.status if job else ReportStatus.FAILED.value
+        kind, school_id, start_date, end_date = job.kind, job.school_id, job.start_date, job.end_date
+        running = {"status": ReportStatus.RUNNING.value, "started_at": datetime.utcnow()}
+        if not _update_job(db, job_id, ReportStatus.QUEUED.value, running):
+            raise ReportAbandoned(job_id)
+
+        reported_at = time.monotonic()
+
+        def progress(fraction: float) -> None:
+            nonlocal reported_at
+            if time.monotonic() - reported_at >= REPORT_PROGRESS_INTERVAL:
+                # Leaves room for writing the file
+                if not _update_job(db, job_id, ReportStatus.RUNNING.value, {"progress": round(0.95 * fraction, 3)}):
+                    raise ReportAbandoned(job_id)
+                reported_at = time.monotonic()
+
+        rows = REPORT_GENERATORS[kind](db, school_id, start_date, end_date, progress)
+
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        path = report_path(job_id)
+        with open(f"{path}.part", "w", newline="") as output:
+            csv.writer(output).writerows(rows)
+        # Downloads never see a partial file
+        os.replace(f"{path}.part", path)
+
+        succeeded = {
+            "status": ReportStatus.SUCCEEDED.value,
+            "progress": 1.0,
+            "path": path,
+            "size": os.path.getsize(path),
+            "rows": len(rows) - 1,
+            "finished_at": datetime.utcnow(),
+        }
+        if not _update_job(db, job_id, ReportStatus.RUNNING.value, succeeded):
+            _remove(path)
+            raise ReportAbandoned(job_id)
+        return ReportStatus.SUCCEEDED.value
+    except ReportAbandoned:
+        logger.warning(f"Report {job_id} was failed while it ran, its result is dropped")
+        db.rollback()
+        return ReportStatus.FAILED.value
+    except Exception as e:
+        logger.exception(f"Report {job_id} failed")
+        db.rollback()
+        fail_report_job(job_id, str(e))
+        return ReportStatus.FAILED.value
+    finally:
+        db.close()
+
+
+class ReportRunner:
+    """
+    Process pool of this worker generating reports, created on first use.
+
+    Args:
+        processes: Number of report processes
+    """
+
+    def __init__(self, processes: int = REPORT_PROCESSES):
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, Future] = {}
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0}
+
+    def submit(self, job_id: str) -> None:
+        """Queues a recorded job."""
+        with self._lock:
+            if self._pool is None:
+                # Spawned, not forked: the worker holds threads and pooled connections
+                self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+            future = self._pool.submit(run_report, job_id)
+            self._futures[job_id] = future
+            self.stats["submitted"] += 1
+        future.add_done_callback(lambda done: self._finished(job_id, done))
+
+    def _finished(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            # Jobs already taken or finished elsewhere report their current status
+            status = future.result()
+            self.stats[status] = self.stats.get(status, 0) + 1
+            return
+        self.stats["failed"] += 1
+        if isinstance(error, BrokenProcessPool):
+            # A report process died; the next job gets a new pool
+            with self._lock:
+                self._pool = None
+        fail_report_job(job_id, f"Report process failed: {error}")
+
+    def shutdown(self) -> None:
+        """Fails the jobs not started yet; running ones finish before the process exits."""
+        with self._lock:
+            cancelled = [job_id for job_id, future in self._futures.items() if future.cancel()]
+            pool, self._pool = self._pool, None
+        for job_id in cancelled:
+            fail_report_job(job_id, "Interrupted: the server shut down before the report started")
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            pending = len(self._futures)
+        return {"processes": self.processes, "pending": pending, **self.stats}
+
+
+report_runner = ReportRunner()
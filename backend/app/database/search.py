@@ -0,0 +1,156 @@
+"""
+Indexed text search over house points reasons, teacher names and student names.
+
+On PostgreSQL, substring matches use pg_trgm GIN indexes and results are
+ranked by trigram similarity. On SQLite, an FTS5 table with the trigram
+tokenizer mirrors house_points through triggers and results are ranked by bm25.
+"""
+from typing import List
+import logging
+
+from sqlalchemy import column, desc, func, literal_column, or_, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Query, Session, aliased
+
+from app.models.models import HousePoints, Teacher, Wizard
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "house_points_fts"
+
+# The trigram tokenizer cannot match terms shorter than three characters
+MIN_TERM_LENGTH = 3
+
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_house_points_reason_trgm ON house_points USING gin (reason gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_teachers_name_trgm ON teachers USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_wizards_name_trgm ON wizards USING gin (name gin_trgm_ops)",
+]
+
+SQLITE_SEARCH_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    f"USING fts5(reason, teacher_name, wizard_name, tokenize='trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON house_points BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, reason, teacher_name, wizard_name) VALUES (
+            new.id,
+            new.reason,
+            (SELECT name FROM teachers WHERE id = new.teacher_id),
+            (SELECT name FROM wizards WHERE id = new.wizard_id)
+        );
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON house_points BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+]
+
+_fts = table(FTS_TABLE, column("rowid"), column("rank"))
+
+
+def setup_search(engine: Engine) -> None:
+    """
+    Creates the search indexes (PostgreSQL) or the FTS5 table and its sync triggers (SQLite).
+
+    A freshly created FTS5 table is populated from the existing transactions.
+
+    Args:
+        engine: SQLAlchemy engine
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            for statement in POSTGRES_SEARCH_DDL:
+                conn.execute(text(statement))
+        elif conn.dialect.name == "sqlite":
+            existed = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {"name": FTS_TABLE}).first()
+            for statement in SQLITE_SEARCH_DDL:
+                conn.execute(text(statement))
+            if not existed:
+                conn.execute(text(
+                    f"INSERT INTO {FTS_TABLE} (rowid, reason, teacher_name, wizard_name) "
+                    f"SELECT hp.id, hp.reason, t.name, w.name FROM house_points hp "
+                    f"LEFT JOIN teachers t ON t.id = hp.teacher_id "
+                    f"LEFT JOIN wizards w ON w.id = hp.wizard_id"
+                ))
+                logger.info(f"Built {FTS_TABLE} search index")
+
+
+def search_terms(search: str) -> List[str]:
+    """
+    Splits a search string into terms.
+
+    Args:
+        search: Raw search string
+
+    Returns:
+        List of non-empty terms
+    """
+    return [term for term in search.split() if term]
+
+
+def _apply_postgres_search(query: Query, search: str) -> Query:
+    teacher = aliased(Teacher)
+    wizard = aliased(Wizard)
+    query = query.outerjoin(teacher, teacher.id == HousePoints.teacher_id).outerjoin(
+        wizard, wizard.id == HousePoints.wizard_id
+    )
+
+    # Every filter is on a house_points column, so the planner can combine the
+    # trigram index on reason with the teacher_id / wizard_id indexes
+    for term in search_terms(search):
+        pattern = f"%{term}%"
+        query = query.filter(or_(
+            HousePoints.reason.ilike(pattern),
+            HousePoints.teacher_id.in_(select(Teacher.id).where(Teacher.name.ilike(pattern))),
+            HousePoints.wizard_id.in_(select(Wizard.id).where(Wizard.name.ilike(pattern))),
+        ))
+
+    rank = func.greatest(
+        func.similarity(func.coalesce(HousePoints.reason, ""), search),
+        func.similarity(func.coalesce(teacher.name, ""), search),
+        func.similarity(func.coalesce(wizard.name, ""), search),
+    )
+    return query.order_by(desc(rank))
+
+
+def _apply_sqlite_search(query: Query, search: str) -> Query:
+    terms = search_terms(search)
+    if any(len(term) < MIN_TERM_LENGTH for term in terms):
+        # Too short for the trigram index, fall back to a plain substring scan
+        teacher = aliased(Teacher)
+        wizard = aliased(Wizard)
+        query = query.outerjoin(teacher, teacher.id == HousePoints.teacher_id).outerjoin(
+            wizard, wizard.id == HousePoints.wizard_id
+        )
+        for term in terms:
+            pattern = f"%{term}%"
+            query = query.filter(or_(
+                HousePoints.reason.ilike(pattern), teacher.name.ilike(pattern), wizard.name.ilike(pattern)
+            ))
+        return query
+
+    match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+    return query.join(_fts, _fts.c.rowid == HousePoints.id).filter(
+        literal_column(FTS_TABLE).op("MATCH")(match)
+    ).order_by(_fts.c.rank)
+
+
+def apply_search(db: Session, query: Query, search: str) -> Query:
+    """
+    Restricts a HousePoints query to transactions matching every search term
+    in the reason, teacher name or student name, best matches first.
+
+    Args:
+        db: SQLAlchemy database session
+        query: Query selecting HousePoints
+        search: Search string (case-insensitive substring terms)
+
+    Returns:
+        The filtered query, ordered by relevance
+    """
+    if not search_terms(search):
+        return query
+    if db.get_bind().dialect.name == "postgresql":
+        return _apply_postgres_search(query, search)
+    return _apply_sqlite_search(query, search)
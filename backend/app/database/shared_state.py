@@ -0,0 +1,316 @@
+"""
+Standings and data versions shared by the worker processes of a host.
+
+When SHARED_STATE_ENABLED=true, the workers attach to one shared memory
+segment (`multiprocessing.shared_memory`) holding, per school, the balance of
+every house, the id of the latest change (transactions data version) and the
+directory version. Awards publish the new balance of their house right after
+committing, so every worker answers houseTotals, directory freshness checks
+and conditional GETs (ETag) from memory, without a database round trip.
+
+Writers are serialized across processes by a file lock (`fcntl.flock`, so
+the segment is only available on POSIX systems). Readers take no lock: each
+school slot is guarded by a sequence counter that writers make odd while
+updating it, and readers retry until they copy a slot with the same even
+counter before and after. Balances are stored as absolute values read from
+the database after commit along with the change id they include, and a value
+is only replaced by one with a higher change id, so the order in which
+workers publish does not matter.
+
+The segment outlives the workers (it is not unlinked on exit); stale content,
+e.g. after the database was reset, is detected and replaced at startup.
+"""
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import tempfile
+import threading
+
+from sqlalchemy.orm import Session
+
+from app.database.changes import get_last_change_id
+from app.database.checkpoints import calculate_balance
+from app.models.models import House
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Share standings and data versions between the worker processes of this host
+SHARED_STATE_ENABLED = os.getenv("SHARED_STATE_ENABLED", "false").lower() == "true"
+
+# Name of the shared memory segment (one per deployment sharing a host)
+SHARED_STATE_NAME = os.getenv("SHARED_STATE_NAME", "hogwarts_state")
+
+# Number of school slots in the segment; schools beyond it are served from the database
+SHARED_STATE_MAX_SCHOOLS = int(os.getenv("SHARED_STATE_MAX_SCHOOLS", "256"))
+
+# Reads of a slot being updated retried before falling back to the database
+READ_ATTEMPTS = 100
+
+HOUSES = list(House)
+
+# Segment layout, in signed 64-bit cells: a header (layout marker, number of
+# slots in use) followed by one slot per school
+MAGIC = 0x486F677761727401
+HEADER_CELLS = 2
+SEQUENCE, SCHOOL, CHANGES_VERSION, DIRECTORY_VERSION, FIRST_HOUSE = range(5)
+SLOT_CELLS = FIRST_HOUSE + 2 * len(HOUSES)  # (version, balance) per house
+
+# Version of a value that was never published
+UNKNOWN = -1
+
+
+def _house_cell(house: House) -> int:
+    return FIRST_HOUSE + 2 * HOUSES.index(House(house))
+
+
+class SharedState:
+    """
+    Attachment of this process to the shared segment.
+
+    Args:
+        enabled: Attach to the segment (False: every read falls back to the database)
+        name: Name of the segment
+        max_schools: Number of school slots
+    """
+
+    def __init__(self, enabled: bool = SHARED_STATE_ENABLED, name: str = SHARED_STATE_NAME,
+                 max_schools: int = SHARED_STATE_MAX_SCHOOLS):
+        self.enabled = enabled and fcntl is not None
+        self.name = name
+        self.max_schools = max_schools
+        self._memory: Optional[shared_memory.SharedMemory] = None
+        self._cells: Optional[memoryview] = None
+        self._lock_fd: Optional[int] = None
+        self._thread_lock = threading.Lock()
+        self._slots: Dict[int, int] = {}
+        self.stats = {"reads": 0, "fallbacks": 0, "writes": 0}
+        if enabled and fcntl is None:
+            logger.warning("SHARED_STATE_ENABLED is set but file locks are not available, shared state disabled")
+
+    def attach(self) -> None:
+        """Creates the segment, or attaches to the one created by another worker."""
+        if not self.enabled or self._cells is not None:
+            return
+        size = 8 * (HEADER_CELLS + SLOT_CELLS * self.max_schools)
+        try:
+            memory = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        except FileExistsError:
+            memory = shared_memory.SharedMemory(name=self.name)
+        # Every worker uses the segment until it exits: none of them may unlink it
+        resource_tracker.unregister(memory._name, "shared_memory")
+        self._lock_fd = os.open(os.path.join(tempfile.gettempdir(), f"{self.name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+
+        cells = memory.buf.cast("q")
+        with self._write_lock():
+            if memory.size < size or cells[0] not in (0, MAGIC):
+                logger.error(f"Shared memory segment {self.name} has another layout, shared state disabled")
+                self.enabled = False
+                cells.release()
+                memory.close()
+                return
+            if cells[0] == 0:
+                cells[1] = 0
+                cells[0] = MAGIC
+        self._memory, self._cells = memory, cells
+        logger.info(f"Attached to shared memory segment {self.name} ({size} bytes)")
+
+    @contextmanager
+    def _write_lock(self):
+        """Excludes the writers of every process (flock) and of this process (threads share the descriptor)."""
+        with self._thread_lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _find(self, school_id: int) -> Optional[int]:
+        """Returns the index of a school's slot (slots never move once allocated)."""
+        index = self._slots.get(school_id)
+        if index is None:
+            cells = self._cells
+            for candidate in range(cells[1]):
+                if cells[HEADER_CELLS + candidate * SLOT_CELLS + SCHOOL] == school_id:
+                    index = self._slots[school_id] = candidate
+                    break
+        return index
+
+    def _allocate(self, school_id: int) -> Optional[int]:
+        """Allocates a school's slot; call with the write lock held."""
+        cells = self._cells
+        index = cells[1]
+        if index >= self.max_schools:
+            logger.warning(f"No shared memory slot left for school {school_id} (SHARED_STATE_MAX_SCHOOLS)")
+            return None
+        base = HEADER_CELLS + index * SLOT_CELLS
+        cells[base + SEQUENCE] = 0
+        for offset in range(SCHOOL + 1, SLOT_CELLS):
+            cells[base + offset] = UNKNOWN
+        cells[base + SCHOOL] = school_id
+        # Published last: readers scanning the slots never see a half-initialized one
+        cells[1] = index + 1
+        self._slots[school_id] = index
+        return index
+
+    def _write(self, index: int, values: Dict[int, int]) -> None:
+        """Updates cells of a slot; call with the write lock held."""
+        cells = self._cells
+        base = HEADER_CELLS + index * SLOT_CELLS
+        if cells[base + SEQUENCE] & 1:
+            # A worker died while updating the slot
+            cells[base + SEQUENCE] += 1
+        cells[base + SEQUENCE] += 1
+        for offset, value in values.items():
+            cells[base + offset] = value
+        cells[base + SEQUENCE] += 1
+        self.stats["writes"] += 1
+
+    def _read(self, school_id: int) -> Optional[List[int]]:
+        """Copies a school's slot without locking, or returns None."""
+        if self._cells is None:
+            return None
+        index = self._find(school_id)
+        if index is None:
+            return None
+        cells = self._cells
+        base = HEADER_CELLS + index * SLOT_CELLS
+        for _ in range(READ_ATTEMPTS):
+            sequence = cells[base + SEQUENCE]
+            if sequence & 1:
+                continue
+            values = cells[base:base + SLOT_CELLS].tolist()
+            if cells[base + SEQUENCE] == sequence:
+                return values
+        return None
+
+    def sync_school(self, db: Session, school_id: int, directory_version: int) -> None:
+        """
+        Publishes a school's balances and versions read from the database.
+
+        Called at startup and when a school is created. Content left by a
+        previous run (a change id ahead of the database) is replaced.
+
+        Args:
+            db: SQLAlchemy database session
+            school_id: School to publish
+            directory_version: Directory version loaded by this worker
+        """
+        if self._cells is None:
+            return
+        # Balances are read after the change id, so they include at least that change
+        last_change_id = get_last_change_id(db, school_id)
+        balances = {house: calculate_balance(db, school_id, house) for house in HOUSES}
+        with self._write_lock():
+            index = self._find(school_id)
+            if index is None:
+                index = self._allocate(school_id)
+                if index is None:
+                    return
+            slot = self._cells[HEADER_CELLS + index * SLOT_CELLS:HEADER_CELLS + (index + 1) * SLOT_CELLS].tolist()
+            stale = slot[CHANGES_VERSION] > last_change_id
+            values = {
+                CHANGES_VERSION: last_change_id if stale else max(slot[CHANGES_VERSION], last_change_id),
+                DIRECTORY_VERSION: directory_version,
+            }
+            for house in HOUSES:
+                cell = _house_cell(house)
+                if stale or last_change_id >= slot[cell]:
+                    values[cell], values[cell + 1] = last_change_id, balances[house]
+            self._write(index, values)
+        if stale:
+            logger.warning(f"Replaced stale shared standings of school {school_id}")
+
+    def publish_balance(self, school_id: int, house: House, change_id: int, balance: int) -> None:
+        """
+        Publishes the balance of a house read after committing change `change_id`.
+
+        Args:
+            school_id: School of the house
+            house: House of the committed transaction
+            change_id: Id of the transaction's change
+            balance: Balance of the house read after the commit
+        """
+        if self._cells is None:
+            return
+        with self._write_lock():
+            index = self._find(school_id)
+            if index is None:
+                return
+            base = HEADER_CELLS + index * SLOT_CELLS
+            cell = _house_cell(house)
+            values = {}
+            # A balance read after a later change already includes this one
+            if change_id >= self._cells[base + cell]:
+                values[cell], values[cell + 1] = change_id, balance
+            if change_id > self._cells[base + CHANGES_VERSION]:
+                values[CHANGES_VERSION] = change_id
+            if values:
+                self._write(index, values)
+
+    def publish_directory_version(self, school_id: int, version: int) -> None:
+        """Publishes a school's directory version if it is newer than the shared one."""
+        if self._cells is None:
+            return
+        with self._write_lock():
+            index = self._find(school_id)
+            if index is not None and version > self._cells[HEADER_CELLS + index * SLOT_CELLS + DIRECTORY_VERSION]:
+                self._write(index, {DIRECTORY_VERSION: version})
+
+    def house_totals(self, school_id: int) -> Optional[Dict[House, int]]:
+        """
+        Reads a school's house balances.
+
+        Args:
+            school_id: School of the houses
+
+        Returns:
+            Dictionary mapping House to points, or None when not shared
+        """
+        if self._cells is None:
+            return None
+        slot = self._read(school_id)
+        if slot is None or any(slot[_house_cell(house)] == UNKNOWN for house in HOUSES):
+            self.stats["fallbacks"] += 1
+            return None
+        self.stats["reads"] += 1
+        return {house: slot[_house_cell(house) + 1] for house in HOUSES}
+
+    def versions(self, school_id: int) -> Optional[Tuple[int, int]]:
+        """
+        Reads a school's data versions.
+
+        Args:
+            school_id: School of the data
+
+        Returns:
+            Tuple of the latest change id and the directory version, or None when not shared
+        """
+        slot = self._read(school_id)
+        if slot is None or UNKNOWN in (slot[CHANGES_VERSION], slot[DIRECTORY_VERSION]):
+            return None
+        return slot[CHANGES_VERSION], slot[DIRECTORY_VERSION]
+
+    def directory_version(self, school_id: int) -> Optional[int]:
+        """Reads a school's directory version, or None when not shared."""
+        slot = self._read(school_id)
+        if slot is None or slot[DIRECTORY_VERSION] == UNKNOWN:
+            return None
+        return slot[DIRECTORY_VERSION]
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "enabled": self._cells is not None,
+            "segment": self.name,
+            "schools": self._cells[1] if self._cells is not None else 0,
+            **self.stats,
+        }
+
+
+shared_state = SharedState()
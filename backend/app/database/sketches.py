@@ -0,0 +1,578 @@
+"""
+Approximate analytics from mergeable streaming sketches.
+
+Questions such as "how many distinct students earned points per house this
+month" or "what is the p95 award size of a teacher" would need a scan of
+every transaction of the period. When SKETCHES_ENABLED=true, every worker
+keeps, per school and per UTC day and month:
+
+- a HyperLogLog of the wizards awarded points, per house
+- a KLL quantile sketch of the award sizes, per house and teacher
+
+Awards recorded by the worker are added as they are committed, and awards of
+other workers are picked up every SKETCH_REFRESH_SECONDS. A query merges the
+day sketches up to the first month boundary of its window and the month
+sketches after it, so a year is answered by merging about 40 sketches
+whatever the number of transactions. Only awards (positive points) are
+sketched; deductions are not.
+
+Error bounds (the KLL bound holds with 99% probability):
+- distinct wizards: relative standard error 1.04 / sqrt(2 ** HLL_PRECISION),
+  about 1.6% (about 95% of the counts are within 3.2%); the small counts of a
+  school use linear counting, whose error is no larger
+- quantiles: the rank of a returned value is within about KLL_RANK_ERROR
+  (1.7%) of the requested rank, e.g. p95 returns a value between p93.3 and
+  p96.7; values are always actual award sizes
+
+Without the sketches, or with `exact: true`, the same questions are answered
+exactly by SQL.
+"""
+from datetime import date, datetime, time as time_of_day, timedelta
+from hashlib import blake2b
+from math import ceil, log
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import logging
+import os
+import random
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from app.database.checkpoints import transaction_models
+from app.models.models import House, HousePoints, HousePointsArchive
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Keep per-day and per-month sketches of the awards and answer approximate analytics from them
+SKETCHES_ENABLED = os.getenv("SKETCHES_ENABLED", "false").lower() == "true"
+
+# Number of days of awards kept in the sketches (the longest window they answer)
+SKETCH_RETENTION_DAYS = int(os.getenv("SKETCH_RETENTION_DAYS", "400"))
+
+# Seconds after which the sketches pick up awards recorded by other worker processes
+SKETCH_REFRESH_SECONDS = float(os.getenv("SKETCH_REFRESH_SECONDS", "5"))
+
+# Ids below the highest sketched id that are read again when catching up, so
+# transactions committed out of id order are not missed
+SKETCH_CATCH_UP_OVERLAP = 1000
+
+# Rows fetched per round trip when loading the sketches
+LOAD_BATCH_SIZE = 100_000
+
+# HyperLogLog registers: 2 ** HLL_PRECISION (4 KiB per dense sketch)
+HLL_PRECISION = 12
+
+# Relative standard error of the distinct counts
+HLL_RELATIVE_ERROR = 1.04 / (2 ** HLL_PRECISION) ** 0.5
+
+# Capacity of the top KLL compactor; sketches hold at most about 3 * KLL_K values
+KLL_K = 200
+
+# Normalized rank error of the quantiles (99% confidence) for KLL_K
+KLL_RANK_ERROR = 0.017
+
+HOUSES = list(House)
+
+
+def _hash64(value: int) -> int:
+    return int.from_bytes(blake2b(value.to_bytes(8, "little", signed=True), digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch with 2 ** precision registers.
+
+    Small sketches keep their non-zero registers in a dict and become dense
+    (a bytearray) past 1/128 of the registers, so days with few awards stay
+    small. Merging takes the maximum of each register, so the merge of the
+    sketches of two periods is the sketch of their union.
+    """
+
+    __slots__ = ("precision", "_sparse", "_registers")
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self._sparse: Optional[Dict[int, int]] = {}
+        self._registers: Optional[bytearray] = None
+
+    def add(self, value: int) -> None:
+        hashed = _hash64(value)
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        self._set(index, rank)
+
+    def _set(self, index: int, rank: int) -> None:
+        if self._registers is not None:
+            if rank > self._registers[index]:
+                self._registers[index] = rank
+            return
+        if rank > self._sparse.get(index, 0):
+            self._sparse[index] = rank
+            if len(self._sparse) > (1 << self.precision) // 128:
+                self._densify()
+
+    def _densify(self) -> None:
+        self._registers = bytearray(1 << self.precision)
+        for index, rank in self._sparse.items():
+            self._registers[index] = rank
+        self._sparse = None
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Adds the values of another sketch of the same precision."""
+        if other._registers is None:
+            for index, rank in other._sparse.items():
+                self._set(index, rank)
+            return
+        if self._registers is None:
+            self._densify()
+        if np is not None:
+            registers = np.frombuffer(self._registers, dtype=np.uint8)
+            np.maximum(registers, np.frombuffer(other._registers, dtype=np.uint8), out=registers)
+        else:
+            self._registers = bytearray(map(max, self._registers, other._registers))
+
+    def count(self) -> int:
+        """Estimates the number of distinct values added."""
+        m = 1 << self.precision
+        if self._registers is None:
+            zeros = m - len(self._sparse)
+            inverse_sum = zeros + sum(2.0 ** -rank for rank in self._sparse.values())
+        else:
+            zeros = self._registers.count(0)
+            inverse_sum = sum(self._registers.count(rank) * 2.0 ** -rank for rank in range(66 - self.precision))
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / inverse_sum
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * log(m / zeros)
+        return round(estimate)
+
+
+_coins = random.Random()
+
+
+class KllSketch:
+    """
+    KLL quantile sketch (Karnin, Lang and Liberty) of integer values.
+
+    Values are kept in compactors; compactor h holds values standing for 2 ** h
+    values each. A full compactor is sorted and every other value (odd or even
+    positions, at random) is promoted to the next one. Capacities shrink
+    geometrically (by 2/3) below the top compactor, so the sketch holds
+    O(k) values whatever the stream length. Merging concatenates compactors of
+    the same level and compacts again.
+    """
+
+    __slots__ = ("k", "count", "_compactors", "_size", "_max_size")
+
+    def __init__(self, k: int = KLL_K):
+        self.k = k
+        self.count = 0
+        self._compactors: List[List[int]] = []
+        self._size = 0
+        self._max_size = 0
+        self._grow()
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._compactors) - level - 1
+        return int(ceil((2 / 3) ** depth * self.k)) + 1
+
+    def _grow(self) -> None:
+        self._compactors.append([])
+        self._max_size = sum(self._capacity(level) for level in range(len(self._compactors)))
+
+    def _compress(self) -> None:
+        for level, compactor in enumerate(self._compactors):
+            if len(compactor) >= self._capacity(level):
+                if level + 1 == len(self._compactors):
+                    self._grow()
+                compactor.sort()
+                # An odd value out stays at this level
+                kept = [compactor.pop()] if len(compactor) % 2 else []
+                self._compactors[level + 1].extend(compactor[_coins.getrandbits(1)::2])
+                self._compactors[level] = kept
+                self._size = sum(len(values) for values in self._compactors)
+                return
+
+    def add(self, value: int) -> None:
+        self._compactors[0].append(value)
+        self.count += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other: "KllSketch") -> None:
+        """Adds the values of another sketch."""
+        while len(self._compactors) < len(other._compactors):
+            self._grow()
+        for level, values in enumerate(other._compactors):
+            self._compactors[level].extend(values)
+        self.count += other.count
+        self._size = sum(len(values) for values in self._compactors)
+        while self._size >= self._max_size:
+            self._compress()
+
+    def quantiles(self, fractions: Sequence[float]) -> List[Optional[int]]:
+        """
+        Estimates quantiles of the values added (nearest rank).
+
+        Args:
+            fractions: Quantiles to estimate, between 0 and 1
+
+        Returns:
+            The value estimated at each quantile, None when the sketch is empty
+        """
+        weighted = sorted(
+            (value, 1 << level) for level, values in enumerate(self._compactors) for value in values
+        )
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for fraction in fractions:
+            if not weighted:
+                results.append(None)
+                continue
+            rank, seen = max(ceil(fraction * total), 1), 0
+            for value, weight in weighted:
+                seen += weight
+                if seen >= rank:
+                    break
+            results.append(value)
+        return results
+
+
+class PeriodSketches:
+    """Sketches of the awards of one school over one day or one month."""
+
+    __slots__ = ("wizards", "points")
+
+    def __init__(self):
+        self.wizards: Dict[House, HyperLogLog] = {}
+        self.points: Dict[Tuple[House, int], KllSketch] = {}
+
+    def add(self, house: House, teacher_id: int, wizard_id: Optional[int], points: int) -> None:
+        if wizard_id is not None:
+            sketch = self.wizards.get(house)
+            if sketch is None:
+                sketch = self.wizards[house] = HyperLogLog()
+            sketch.add(wizard_id)
+        sketch = self.points.get((house, teacher_id))
+        if sketch is None:
+            sketch = self.points[(house, teacher_id)] = KllSketch()
+        sketch.add(points)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def window_start(days_ago: int) -> date:
+    """First UTC day of a window ending today (the day of now - days_ago)."""
+    return (datetime.utcnow() - timedelta(days=days_ago)).date()
+
+
+class SketchStore:
+    """
+    Per-day and per-month sketches of the awards of every school served by this process.
+
+    Args:
+        enabled: Maintain the sketches (False: every query is answered exactly)
+        retention_days: Number of days of awards kept
+        refresh_seconds: Seconds between two catch-ups with the database
+    """
+
+    def __init__(self, enabled: bool = SKETCHES_ENABLED, retention_days: int = SKETCH_RETENTION_DAYS,
+                 refresh_seconds: float = SKETCH_REFRESH_SECONDS):
+        self.enabled = enabled
+        self.retention_days = retention_days
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._loaded_at: Optional[float] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._days: Dict[int, Dict[date, PeriodSketches]] = {}
+        self._months: Dict[int, Dict[date, PeriodSketches]] = {}
+        self._last_id = 0
+        self._recent_ids: Set[int] = set()
+        self._awards = 0
+
+    def _first_day(self) -> date:
+        return window_start(self.retention_days)
+
+    def _add(self, id: int, school_id: int, house, points: int, teacher_id: int, wizard_id: Optional[int],
+             timestamp: datetime) -> None:
+        if id in self._recent_ids:
+            return
+        self._recent_ids.add(id)
+        self._last_id = max(self._last_id, id)
+        day = timestamp.date()
+        if points <= 0 or day < self._first_day():
+            return
+        house = House(house)
+        for periods, key in ((self._days, day), (self._months, month_start(day))):
+            sketches = periods.setdefault(school_id, {}).get(key)
+            if sketches is None:
+                sketches = periods[school_id][key] = PeriodSketches()
+            sketches.add(house, teacher_id, wizard_id, points)
+        self._awards += 1
+
+    def _add_rows(self, rows: Iterable[tuple]) -> None:
+        """Adds (id, school_id, house, points, teacher_id, wizard_id, timestamp) tuples."""
+        for row in rows:
+            self._add(*row)
+        # Only ids within the overlap can be read again by a catch-up
+        if len(self._recent_ids) > 2 * SKETCH_CATCH_UP_OVERLAP:
+            threshold = self._last_id - SKETCH_CATCH_UP_OVERLAP
+            self._recent_ids = {id for id in self._recent_ids if id > threshold}
+
+    @staticmethod
+    def _select(db: Session, model):
+        return db.query(
+            model.id, model.school_id, model.house, model.points, model.teacher_id, model.wizard_id, model.timestamp
+        )
+
+    def load(self, db: Session) -> None:
+        """Builds the sketches from the awards of every school within the retention period."""
+        with self._lock:
+            self._reset()
+            since = datetime.combine(self._first_day(), time_of_day())
+            for model in (HousePointsArchive, HousePoints):
+                rows = self._select(db, model).filter(model.timestamp >= since).yield_per(LOAD_BATCH_SIZE)
+                self._add_rows(tuple(row) for row in rows)
+            # Ids of older transactions are not read again either
+            last_id = db.query(HousePoints.id).order_by(HousePoints.id.desc()).limit(1).scalar()
+            self._last_id = max(self._last_id, last_id or 0)
+            self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {self._awards} awards into the analytics sketches")
+
+    def catch_up(self, db: Session) -> None:
+        """Adds the awards recorded since the last load or catch-up and drops expired periods."""
+        with self._lock:
+            threshold = self._last_id - SKETCH_CATCH_UP_OVERLAP
+            self._add_rows(tuple(row) for row in self._select(db, HousePoints).filter(HousePoints.id > threshold))
+            first_day = self._first_day()
+            for days in self._days.values():
+                for day in [day for day in days if day < first_day]:
+                    del days[day]
+            for months in self._months.values():
+                for month in [month for month in months if month < month_start(first_day)]:
+                    del months[month]
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session) -> None:
+        """Loads the sketches on first use and catches up once per refresh interval."""
+        if self._loaded_at is None:
+            self.load(db)
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.catch_up(db)
+
+    def append(self, points: HousePoints) -> None:
+        """Adds a transaction committed by this worker."""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._add_rows([(
+                points.id, points.school_id, points.house, points.points, points.teacher_id, points.wizard_id, points.timestamp
+            )])
+
+    def _periods(self, school_id: int, since: date) -> List[PeriodSketches]:
+        """Returns the day sketches up to the first month boundary after `since` and the month sketches after it."""
+        days, months = self._days.get(school_id, {}), self._months.get(school_id, {})
+        periods, day, today = [], since, datetime.utcnow().date()
+        while day <= today:
+            if day.day == 1:
+                sketches, day = months.get(day), next_month(day)
+            else:
+                sketches, day = days.get(day), day + timedelta(days=1)
+            if sketches is not None:
+                periods.append(sketches)
+        return periods
+
+    def distinct_wizards(self, school_id: int, since: date) -> Dict[Optional[House], int]:
+        """
+        Estimates the number of distinct wizards awarded points since a day.
+
+        Args:
+            school_id: School of the wizards
+            since: First UTC day of the window (within the retention period)
+
+        Returns:
+            Dictionary mapping each house, and None for the whole school, to the number of wizards
+        """
+        with self._lock:
+            merged = {house: HyperLogLog() for house in HOUSES}
+            for sketches in self._periods(school_id, since):
+                for house, sketch in sketches.wizards.items():
+                    merged[house].merge(sketch)
+            school = HyperLogLog()
+            for sketch in merged.values():
+                school.merge(sketch)
+        counts: Dict[Optional[House], int] = {house: sketch.count() for house, sketch in merged.items()}
+        counts[None] = school.count()
+        return counts
+
+    def point_quantiles(
+        self,
+        school_id: int,
+        since: date,
+        fractions: Sequence[float],
+        house: Optional[House] = None,
+        teacher_id: Optional[int] = None
+    ) -> Tuple[int, List[Optional[int]]]:
+        """
+        Estimates quantiles of the award sizes since a day.
+
+        Args:
+            school_id: School of the awards
+            since: First UTC day of the window (within the retention period)
+            fractions: Quantiles to estimate, between 0 and 1
+            house: Optional house to restrict the awards to
+            teacher_id: Optional teacher to restrict the awards to
+
+        Returns:
+            Tuple of the number of awards and the value at each quantile
+        """
+        merged = KllSketch()
+        with self._lock:
+            for sketches in self._periods(school_id, since):
+                for (sketch_house, sketch_teacher), sketch in sketches.points.items():
+                    if house is not None and sketch_house != house:
+                        continue
+                    if teacher_id is None or sketch_teacher == teacher_id:
+                        merged.merge(sketch)
+        return merged.count, merged.quantiles(fractions)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "loaded": self._loaded_at is not None,
+                "awards": self._awards,
+                "days": sum(len(days) for days in self._days.values()),
+                "months": sum(len(months) for months in self._months.values()),
+            }
+
+
+sketch_store = SketchStore()
+
+
+def _window_models(db: Session, school_id: int, since: date) -> Tuple[datetime, list]:
+    start = datetime.combine(since, time_of_day())
+    return start, transaction_models(db, school_id, start, None)
+
+
+def exact_distinct_wizards(db: Session, school_id: int, since: date) -> Dict[Optional[House], int]:
+    """Counts the distinct wizards awarded points since a day with SQL (see SketchStore.distinct_wizards)."""
+    start, models = _window_models(db, school_id, since)
+    wizards: Dict[House, Set[int]] = {house: set() for house in HOUSES}
+    for model in models:
+        # Wizards may appear in both tables, so they are counted once across them
+        pairs = db.query(model.house, model.wizard_id).filter(
+            model.school_id == school_id, model.timestamp >= start, model.points > 0, model.wizard_id.isnot(None)
+        ).distinct()
+        for house, wizard_id in pairs:
+            wizards[House(house)].add(wizard_id)
+    counts: Dict[Optional[House], int] = {house: len(ids) for house, ids in wizards.items()}
+    counts[None] = len(set().union(*wizards.values()))
+    return counts
+
+
+def exact_point_quantiles(
+    db: Session,
+    school_id: int,
+    since: date,
+    fractions: Sequence[float],
+    house: Optional[House] = None,
+    teacher_id: Optional[int] = None
+) -> Tuple[int, List[Optional[int]]]:
+    """Computes quantiles of the award sizes since a day with SQL (see SketchStore.point_quantiles)."""
+    start, models = _window_models(db, school_id, since)
+    values: List[int] = []
+    for model in models:
+        query = db.query(model.points).filter(
+            model.school_id == school_id, model.timestamp >= start, model.points > 0
+        )
+        if house:
+            query = query.filter(model.house == house)
+        if teacher_id is not None:
+            query = query.filter(model.teacher_id == teacher_id)
+        values.extend(points for points, in query)
+    values.sort()
+    return len(values), [
+        values[max(ceil(fraction * len(values)), 1) - 1] if values else None for fraction in fractions
+    ]
+
+
+def _check_window(days_ago: int, exact: bool) -> None:
+    if days_ago < 0 or (not exact and sketch_store.enabled and days_ago > sketch_store.retention_days):
+        raise ValueError(f"days_ago must be between 0 and {sketch_store.retention_days} (or use exact)")
+
+
+def get_distinct_wizards(
+    db: Session,
+    school_id: int,
+    days_ago: int,
+    exact: bool = False
+) -> Tuple[Dict[Optional[House], int], bool]:
+    """
+    Counts the distinct wizards awarded points per house over a window.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the wizards
+        days_ago: The window starts on the UTC day of now - days_ago and ends now
+        exact: Count with SQL even when the sketches are enabled
+
+    Returns:
+        Tuple of the counts per house (None: whole school) and whether they are approximate
+    """
+    _check_window(days_ago, exact)
+    since = window_start(days_ago)
+    if sketch_store.enabled and not exact:
+        sketch_store.ensure_fresh(db)
+        return sketch_store.distinct_wizards(school_id, since), True
+    return exact_distinct_wizards(db, school_id, since), False
+
+
+def get_point_quantiles(
+    db: Session,
+    school_id: int,
+    days_ago: int,
+    fractions: Sequence[float],
+    house: Optional[House] = None,
+    teacher_id: Optional[int] = None,
+    exact: bool = False
+) -> Tuple[int, List[Optional[int]], bool]:
+    """
+    Computes quantiles of the award sizes over a window.
+
+    Args:
+        db: SQLAlchemy database session
+        school_id: School of the awards
+        days_ago: The window starts on the UTC day of now - days_ago and ends now
+        fractions: Quantiles to compute, between 0 and 1
+        house: Optional house to restrict the awards to
+        teacher_id: Optional teacher to restrict the awards to
+        exact: Compute with SQL even when the sketches are enabled
+
+    Returns:
+        Tuple of the number of awards, the value at each quantile and whether they are approximate
+    """
+    _check_window(days_ago, exact)
+    if any(not 0 <= fraction <= 1 for fraction in fractions):
+        raise ValueError("Quantiles must be between 0 and 1")
+    since = window_start(days_ago)
+    if sketch_store.enabled and not exact:
+        sketch_store.ensure_fresh(db)
+        return (*sketch_store.point_quantiles(school_id, since, fractions, house, teacher_id), True)
+    return (*exact_point_quantiles(db, school_id, since, fractions, house, teacher_id), False)
@@ -0,0 +1,309 @@
+"""
+Slow query log.
+
+Every statement run through the engine is timed. Statements slower than
+SLOW_QUERY_MS are logged with their normalized SQL (literals and bound
+parameters replaced by `?`), the shape of their parameters and the resolver,
+route or background job that ran them, and are aggregated per fingerprint
+(hash of the normalized SQL). A sample of them is explained: `EXPLAIN` on
+PostgreSQL, `EXPLAIN QUERY PLAN` on SQLite; the latest plan is kept with the
+fingerprint. Neither runs the statement again, so explaining costs the
+request only the planning time.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+import hashlib
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Statements running longer than this many milliseconds are logged (negative: disabled)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# Fraction of slow statements whose plan is captured
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+
+# Number of fingerprints kept in memory (least recently seen ones are dropped)
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "500"))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    Replaces literals and bound parameters by `?` and collapses lists and whitespace.
+
+    Args:
+        statement: SQL statement as sent to the database
+
+    Returns:
+        Normalized SQL
+    """
+    sql = _STRING.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _LIST.sub("(?, ...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def _type_name(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def parameter_shape(parameters: Any, executemany: bool = False) -> str:
+    """
+    Describes bound parameters by their names and types, without their values.
+
+    Args:
+        parameters: Parameters passed to the DBAPI cursor
+        executemany: Whether `parameters` holds one set per execution
+
+    Returns:
+        Shape such as `{house: str, limit: int}` or `3 x (str, int)`
+    """
+    if executemany:
+        if not parameters:
+            return "0 x ()"
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {_type_name(value)}" for name, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(_type_name(value) for value in parameters) + ")"
+    return "()" if parameters is None else _type_name(parameters)
+
+
+def _is_origin(module: str) -> bool:
+    return module == "app.api.schema" or module.startswith("app.routes.")
+
+
+def statement_origin(frame=None) -> str:
+    """
+    Names the code that ran a statement.
+
+    This is the outermost GraphQL resolver or REST route on the stack, or the
+    outermost application function for background jobs and startup code.
+
+    Args:
+        frame: Frame to start from (default: the caller's)
+
+    Returns:
+        Dotted name such as `app.api.schema.house_totals`
+    """
+    frame = frame or sys._getframe(1)
+    origin = None
+    outermost = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        name = frame.f_code.co_name
+        # Decorator wrappers share the module of the resolvers they wrap
+        if module.startswith("app.") and module != __name__ and name != "wrapper":
+            outermost = f"{module}.{name}"
+            if _is_origin(module):
+                origin = outermost
+        frame = frame.f_back
+    return origin or outermost or "unknown"
+
+
+def explain(connection, statement: str, parameters: Any) -> Optional[str]:
+    """
+    Captures the plan of a statement on the connection that ran it.
+
+    The statement is planned but not run again (no ANALYZE), so the plan
+    shows estimated costs and rows only. On PostgreSQL it runs inside a
+    savepoint that is rolled back, so a failing EXPLAIN does not abort the
+    request's transaction.
+
+    Args:
+        connection: SQLAlchemy connection
+        statement: SQL statement as sent to the database
+        parameters: Its bound parameters
+
+    Returns:
+        The plan as text, or None when the statement cannot be explained
+    """
+    dialect = connection.dialect.name
+    keyword = statement.lstrip()[:6].upper()
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        if dialect == "postgresql":
+            if keyword not in ("SELECT", "INSERT", "UPDATE", "DELETE") and not keyword.startswith("WITH"):
+                return None
+            cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute("EXPLAIN " + statement, parameters)
+                return "\n".join(row[0] for row in cursor.fetchall())
+            finally:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        if dialect == "sqlite":
+            if keyword not in ("SELECT", "INSERT", "UPDATE", "DELETE") and not keyword.startswith("WITH"):
+                return None
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            depths = {0: -1}
+            lines = []
+            for node_id, parent, _, detail in cursor.fetchall():
+                depths[node_id] = depths.get(parent, -1) + 1
+                lines.append("  " * depths[node_id] + detail)
+            return "\n".join(lines)
+        return None
+    except Exception as e:
+        logger.debug(f"Could not explain statement: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog:
+    """
+    Slow statement statistics aggregated per fingerprint.
+
+    Args:
+        threshold_ms: Duration above which a statement is slow (negative: disabled)
+        explain_rate: Fraction of slow statements whose plan is captured
+        max_fingerprints: Number of fingerprints kept
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_QUERY_MS,
+        explain_rate: float = SLOW_QUERY_EXPLAIN_RATE,
+        max_fingerprints: int = SLOW_QUERY_MAX_FINGERPRINTS
+    ):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.statements = 0
+        self.slow_statements = 0
+
+    def record(self, connection, statement: str, parameters: Any, executemany: bool, elapsed_ms: float) -> None:
+        """Counts a statement, and logs and aggregates it when it is slow."""
+        with self._lock:
+            self.statements += 1
+        if self.threshold_ms < 0 or elapsed_ms < self.threshold_ms:
+            return
+
+        normalized = normalize_sql(statement)
+        key = fingerprint(normalized)
+        shape = parameter_shape(parameters, executemany)
+        origin = statement_origin()
+        plan = None
+        if not executemany and self.explain_rate > 0 and random.random() < self.explain_rate:
+            plan = explain(connection, statement, parameters)
+
+        logger.warning(f"Slow query {elapsed_ms:.1f} ms [{key}] from {origin}: {normalized} params={shape}")
+        if plan:
+            logger.info(f"Plan of slow query [{key}]:\n{plan}")
+
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            self.slow_statements += 1
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = {
+                    "fingerprint": key,
+                    "sql": normalized,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "first_seen": now,
+                    "origins": {},
+                    "parameters": shape,
+                    "plan": None,
+                    "plan_at": None,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["last_ms"] = elapsed_ms
+            entry["last_seen"] = now
+            entry["parameters"] = shape
+            entry["origins"][origin] = entry["origins"].get(origin, 0) + 1
+            if plan:
+                entry["plan"] = plan
+                entry["plan_at"] = now
+            self._entries[key] = entry
+            while len(self._entries) > self.max_fingerprints:
+                self._entries.popitem(last=False)
+
+    def snapshot(self, limit: int = 50, order_by: str = "total_ms") -> Dict[str, Any]:
+        """
+        Returns the aggregated slow statements.
+
+        Args:
+            limit: Number of fingerprints to return
+            order_by: "total_ms", "max_ms", "count" or "last_seen"
+
+        Returns:
+            dict: Counters and the top fingerprints, slowest first
+        """
+        with self._lock:
+            entries = [dict(entry, origins=dict(entry["origins"])) for entry in self._entries.values()]
+            statements, slow_statements = self.statements, self.slow_statements
+        entries.sort(key=lambda entry: entry[order_by], reverse=True)
+        for entry in entries:
+            entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 3)
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+            entry["last_ms"] = round(entry["last_ms"], 3)
+        return {
+            "threshold_ms": self.threshold_ms,
+            "statements": statements,
+            "slow_statements": slow_statements,
+            "fingerprints": len(entries),
+            "queries": entries[:limit],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.statements = 0
+            self.slow_statements = 0
+
+
+slow_query_log = SlowQueryLog()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._slow_query_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "_slow_query_started_at", None)
+    if started_at is not None:
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        slow_query_log.record(conn, statement, parameters, executemany, elapsed_ms)
+
+
+def install_slow_query_log(engine: Engine) -> None:
+    """
+    Registers the engine event listeners timing every statement.
+
+    Args:
+        engine: SQLAlchemy engine
+    """
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,143 @@
+"""
+School tenancy.
+
+One deployment serves many schools. Every school-owned row carries a
+school_id, and queries, caches and ledgers are scoped by it, so schools
+share the worker processes and the connection pool but never see each
+other's data. The school of a request is resolved by TenancyMiddleware
+(X-School-Id header or /schools/{id}/ path prefix) and held in
+`current_school_id` for the rest of the request.
+"""
+from contextvars import ContextVar
+from typing import FrozenSet, List
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.database.db import SessionLocal
+from app.models.models import DEFAULT_SCHOOL_ID, School
+
+logger = logging.getLogger(__name__)
+
+# Name of the school created for existing single-school data
+DEFAULT_SCHOOL_NAME = os.getenv("DEFAULT_SCHOOL_NAME", "Hogwarts")
+
+# Seconds the set of known schools is trusted before being reloaded
+SCHOOL_REFRESH_SECONDS = float(os.getenv("SCHOOL_REFRESH_SECONDS", "30"))
+
+# Minimum number of seconds between two reloads triggered by an unknown school id
+SCHOOL_MISS_REFRESH_SECONDS = 1.0
+
+# School of the request being served (set by TenancyMiddleware)
+current_school_id: ContextVar[int] = ContextVar("current_school_id", default=DEFAULT_SCHOOL_ID)
+
+
+def ensure_default_school(db: Session) -> None:
+    """
+    Creates the default school if it does not exist yet.
+
+    Args:
+        db: SQLAlchemy database session
+    """
+    if db.query(School.id).filter(School.id == DEFAULT_SCHOOL_ID).first() is None:
+        db.add(School(id=DEFAULT_SCHOOL_ID, name=DEFAULT_SCHOOL_NAME))
+        db.commit()
+        logger.info(f"Created default school {DEFAULT_SCHOOL_ID} ({DEFAULT_SCHOOL_NAME})")
+
+
+def get_school_ids(db: Session) -> List[int]:
+    """
+    Lists the ids of every school.
+
+    Args:
+        db: SQLAlchemy database session
+
+    Returns:
+        Sorted list of school ids
+    """
+    return [school_id for (school_id,) in db.query(School.id).order_by(School.id)]
+
+
+def create_school(db: Session, name: str) -> School:
+    """
+    Creates a school.
+
+    Ids are assigned explicitly: the default school is inserted with id 1
+    without advancing PostgreSQL's serial sequence.
+
+    Args:
+        db: SQLAlchemy database session
+        name: Unique name of the school
+
+    Returns:
+        The new School
+    """
+    school_id = (db.query(func.max(School.id)).scalar() or 0) + 1
+    school = School(id=school_id, name=name)
+    db.add(school)
+    db.commit()
+    db.refresh(school)
+    school_registry.load()
+    logger.info(f"Created school {school_id} ({name})")
+    return school
+
+
+class SchoolRegistry:
+    """
+    Process-local set of known school ids, used to reject unknown tenants
+    without a database round trip per request.
+    """
+
+    def __init__(self, refresh_seconds: float = SCHOOL_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._ids: FrozenSet[int] = frozenset()
+        self._loaded_at = float("-inf")
+
+    def load(self) -> None:
+        """Reloads the school ids from the database."""
+        db = SessionLocal()
+        try:
+            ids = frozenset(get_school_ids(db))
+        finally:
+            db.close()
+        with self._lock:
+            self._ids = ids
+            self._loaded_at = time.monotonic()
+
+    def cached(self, school_id: int) -> bool:
+        """Whether the school is known and the set is fresh (no database access)."""
+        return school_id in self._ids and time.monotonic() - self._loaded_at < self.refresh_seconds
+
+    def exists(self, school_id: int) -> bool:
+        """
+        Checks whether a school exists, reloading the set when stale or on a miss.
+
+        Misses reload at most once per SCHOOL_MISS_REFRESH_SECONDS, so a client
+        probing unknown ids cannot turn every request into a query.
+
+        Args:
+            school_id: Id of the school
+
+        Returns:
+            True if the school exists
+        """
+        if self.cached(school_id):
+            return True
+        age = time.monotonic() - self._loaded_at
+        if age >= self.refresh_seconds or (school_id not in self._ids and age >= SCHOOL_MISS_REFRESH_SECONDS):
+            self.load()
+        return school_id in self._ids
+
+    def ids(self) -> List[int]:
+        """Returns the known school ids, loading them on first use."""
+        if self._loaded_at == float("-inf"):
+            self.load()
+        return sorted(self._ids)
+
+
+school_registry = SchoolRegistry()
@@ -1,9 +1,14 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from strawberry.fastapi import GraphQLRouter
+from app.api.router import ORJSONGraphQLRouter
+from app.api.context import get_context
+from app.api.executor import resolver_executor
 from app.api.schema import schema
 from app.database.db import engine, Base
 from app.routes.house_points import router as house_points_router
+from app.routes.admin import router as admin_router
+from app.routes.reports import router as reports_router
 import app.models.models
 import platform
 import time
@@ -12,6 +17,26 @@ from datetime import datetime
 import logging
 from app.database.init_db import init_test_data
 from app.database.db import get_db
+from app.database.partitioning import start_partition_maintenance
+from app.database.checkpoints import start_checkpoint_maintenance
+from app.database.leaderboards import init_totals
+from app.database.directory import directory
+from app.database.analytics import analytics_store
+from app.database.sketches import sketch_store
+from app.database.search import setup_search
+from app.database.deadlines import install_statement_deadlines
+from app.database.slow_queries import install_slow_query_log
+from app.database.health import ReadinessCheck
+from app.database.reports import report_runner, start_report_maintenance
+from app.database.shared_state import shared_state
+from app.database.tenancy import ensure_default_school, get_school_ids, school_registry
+from app.middleware.cancellation import CancelOnDisconnectMiddleware
+from app.middleware.admission import AdmissionMiddleware, admission_controller
+from app.middleware.coalescing import CoalescingMiddleware, request_coalescer
+from app.middleware.compression import CompressionMiddleware, compression_metrics
+from app.middleware.conditional import ConditionalGetMiddleware, conditional_metrics
+from app.middleware.profiling import ProfilingMiddleware
+from app.middleware.tenancy import TenancyMiddleware
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,15 +45,59 @@ logger = logging.getLogger(__name__)
 # Create tables
 Base.metadata.create_all(bind=engine)
 
+# Bound expensive resolvers by their statement deadlines
+install_statement_deadlines(engine)
+
+# Time every statement and log the slow ones (see GET /admin/slow-queries)
+install_slow_query_log(engine)
+
+# Create house_points partitions ahead of time (no-op unless partitioning is enabled)
+try:
+    start_partition_maintenance(engine)
+except Exception as e:
+    logger.error(f"Error setting up house_points partitions: {e}")
+
+# Create the text search indexes (pg_trgm on PostgreSQL, FTS5 on SQLite)
+try:
+    setup_search(engine)
+except Exception as e:
+    logger.error(f"Error setting up text search: {e}")
+
+# Attach to the standings shared by the workers of this host (no-op unless SHARED_STATE_ENABLED=true)
+try:
+    shared_state.attach()
+except Exception as e:
+    logger.error(f"Error attaching to the shared state segment: {e}")
+
 # Initialize database with test data
 try:
     db = next(get_db())
+    # Existing single-school data belongs to the default school
+    ensure_default_school(db)
     init_test_data(db)
+    init_totals(db)
+    # Preload the teacher and wizard directory cache of every school
+    for school_id in get_school_ids(db):
+        directory.school(school_id).load(db)
+        shared_state.sync_school(db, school_id, directory.school(school_id).version)
+    school_registry.load()
+    # Load the columnar analytics store (no-op unless COLUMNAR_ANALYTICS=true)
+    if analytics_store.enabled:
+        analytics_store.load(db)
+    # Build the approximate analytics sketches (no-op unless SKETCHES_ENABLED=true)
+    if sketch_store.enabled:
+        sketch_store.load(db)
     db.close()
     logger.info("Database initialization completed during startup")
 except Exception as e:
     logger.error(f"Error initializing database: {e}")
 
+# Write balance checkpoints at term boundaries and compact old transactions
+start_checkpoint_maintenance()
+
+# Fail the report jobs abandoned by dead workers and delete the expired ones, now and periodically
+start_report_maintenance()
+
 # API metadata
 API_VERSION = "1.0.0"
 API_TITLE = "Hogwarts House Points API"
@@ -48,6 +117,13 @@ This API provides access to the Hogwarts House Points System, allowing users to:
 - **/docs**: Swagger UI documentation (this page)
 - **/redoc**: ReDoc alternative documentation
 - **/health**: Health check endpoint
+- **/metrics**: Runtime metrics of this worker
+
+## Schools
+
+Every request is served for one school: send an `X-School-Id` header or prefix
+the path with `/schools/{id}` (e.g. `/schools/2/graphql`). Requests naming no
+school are served for the default school (id 1).
 
 ## Authentication
 
@@ -92,7 +168,26 @@ app = FastAPI(
     }
 )
 
-# Setup CORS
+# Cancel running statements of requests whose client disconnected
+app.add_middleware(CancelOnDisconnectMiddleware)
+
+# Limit concurrent reads, writes and analytics, shedding load with 429 when queues are full
+# (added first so shed responses still get CORS headers)
+app.add_middleware(AdmissionMiddleware)
+
+# Share one execution among identical concurrent reads (outside admission control,
+# so waiting duplicates take no admission slot)
+app.add_middleware(CoalescingMiddleware)
+
+# Answer If-None-Match from the shared data versions, before coalescing and admission
+app.add_middleware(ConditionalGetMiddleware)
+
+# Resolve the school of each request from X-School-Id or a /schools/{id} path prefix
+# (outside admission control, so /schools/{id}/graphql is classified like /graphql,
+# and inside CORS, so its 400 and 404 responses get CORS headers)
+app.add_middleware(TenancyMiddleware)
+
+# Setup CORS (answers preflight requests before the school is resolved)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, limit this to your frontend URL
@@ -101,13 +196,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Setup GraphQL endpoint
-graphql_app = GraphQLRouter(schema)
+# Compress large JSON responses (brotli/zstd when installed, gzip otherwise)
+app.add_middleware(CompressionMiddleware)
+
+# Profile requests carrying X-Profile: <PROFILING_TOKEN> or sampled by PROFILING_SAMPLE_RATE
+# (outermost, so the profile covers the whole middleware stack)
+app.add_middleware(ProfilingMiddleware, engine=engine)
+
+# Setup GraphQL endpoint (orjson-encoded responses, batched operations, request-scoped sessions)
+graphql_app = ORJSONGraphQLRouter(schema, context_getter=get_context)
 app.include_router(graphql_app, prefix="/graphql")
 
 # Include the house points router
 app.include_router(house_points_router)
 
+# Include the administration router
+app.include_router(admin_router)
+
+# Include the report jobs router
+app.include_router(reports_router)
+
+@app.on_event("shutdown")
+def stop_report_runner():
+    # Jobs not started yet are failed; running ones finish in their own processes
+    report_runner.shutdown()
+
 @app.get("/", tags=["General"], summary="API Root", 
          description="Returns basic information about the API")
 def read_root():
@@ -136,9 +249,15 @@ def read_root():
         "endpoints": [
             {"path": "/graphql", "description": "GraphQL API for complex queries and mutations"},
             {"path": "/api/house-points", "description": "REST API for house points"},
+            {"path": "/api/reports", "description": "Status and files of background report jobs"},
             {"path": "/docs", "description": "Swagger UI documentation"},
             {"path": "/redoc", "description": "ReDoc alternative documentation"},
-            {"path": "/health", "description": "Health check endpoint"}
+            {"path": "/health", "description": "Health check endpoint"},
+            {"path": "/health/live", "description": "Liveness probe (process only)"},
+            {"path": "/health/ready", "description": "Readiness probe (database, pool, migrations)"},
+            {"path": "/metrics", "description": "Runtime metrics of this worker"},
+            {"path": "/admin/slow-queries", "description": "Slow query fingerprints of this worker"},
+            {"path": "/admin/schools", "description": "Schools (tenants) served by this deployment"}
         ]
     }
 
@@ -169,4 +288,57 @@ def health_check():
             "platform": platform.platform(),
             "in_docker": in_docker,
         },
-    } 
\ No newline at end of file
+    } 
+
+@app.get("/health/live", tags=["Monitoring"], summary="Liveness Probe",
+         description="Check that the process is running (does not touch the database)")
+def liveness_probe():
+    """
+    Liveness probe: answers as long as the worker can serve requests
+    
+    Returns:
+        dict: Liveness status and uptime
+    """
+    return {
+        "status": "alive",
+        "timestamp": datetime.utcnow().isoformat(),
+        "uptime_seconds": time.time() - START_TIME,
+    }
+
+# Database check shared by the readiness probes of this worker
+readiness_check = ReadinessCheck(engine)
+
+@app.get("/health/ready", tags=["Monitoring"], summary="Readiness Probe",
+         description="Check that the worker can serve traffic (database, connection pool, migrations)",
+         responses={503: {"description": "Worker not ready"}})
+def readiness_probe():
+    """
+    Readiness probe: database ping (cached and bounded), pool saturation and migration head
+    
+    Returns:
+        JSONResponse: Check results, with status 200 when ready and 503 otherwise
+    """
+    result = readiness_check.check()
+    return JSONResponse(result, status_code=200 if result["ready"] else 503)
+
+@app.get("/metrics", tags=["Monitoring"], summary="Metrics",
+         description="Runtime metrics of this worker process")
+def metrics():
+    """
+    Metrics endpoint reporting runtime statistics of this worker process
+    
+    Returns:
+        dict: Metrics grouped by subsystem
+    """
+    return {
+        "admission": admission_controller.snapshot(),
+        "analytics": analytics_store.snapshot(),
+        "coalescing": request_coalescer.snapshot(),
+        "compression": compression_metrics.snapshot(),
+        "etags": conditional_metrics.snapshot(),
+        "pool": engine.pool.snapshot(),
+        "reports": report_runner.snapshot(),
+        "resolvers": resolver_executor.snapshot(),
+        "shared_state": shared_state.snapshot(),
+        "sketches": sketch_store.snapshot(),
+    }
@@ -0,0 +1,3 @@
+"""
+ASGI middleware for the Hogwarts house points system.
+"""
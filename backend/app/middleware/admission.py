@@ -0,0 +1,344 @@
+"""
+Admission control and load shedding.
+
+Requests are classified as reads, writes or analytics, and each class has its
+own concurrency limit and bounded wait queue. When a class's queue is full, or
+a request waits longer than the queue timeout, it is rejected immediately with
+429 and a Retry-After header instead of piling up. A burst of analytics
+queries therefore cannot starve award mutations.
+
+GraphQL POST bodies are read before classification, so their size is capped:
+larger bodies are rejected with 413 before they are buffered.
+"""
+from collections import OrderedDict, deque
+from hashlib import sha256
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import json
+import os
+import threading
+
+from graphql import GraphQLError, OperationType, parse
+from graphql.language import FieldNode, OperationDefinitionNode
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+READS = "reads"
+WRITES = "writes"
+ANALYTICS = "analytics"
+
+# Top-level GraphQL fields that aggregate over many transactions
+ANALYTICS_FIELDS = {"pointsHistoryGrouped", "standingsAt", "standingsSeries", "distinctWizards", "pointQuantiles"}
+
+# Paths that are never queued (monitoring, documentation, the change feed, whose
+# long-polls and streams hold no connection while they wait, and report files,
+# which are streamed from disk)
+EXEMPT_PATHS = (
+    "/health", "/metrics", "/docs", "/redoc", "/api/openapi.json", "/api/house-points/changes", "/api/reports"
+)
+
+# Seconds clients are asked to wait before retrying a shed request
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Maximum number of seconds a request may wait in a queue
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+
+# Maximum size in bytes of a GraphQL POST body
+GRAPHQL_MAX_BODY_BYTES = int(os.getenv("GRAPHQL_MAX_BODY_BYTES", str(1024 * 1024)))
+
+# Defaults stay within SQLAlchemy's default pool (5 connections + 10 overflow)
+ADMISSION_LIMITS = {
+    READS: (
+        int(os.getenv("ADMISSION_READS_CONCURRENCY", "8")),
+        int(os.getenv("ADMISSION_READS_QUEUE", "64")),
+    ),
+    WRITES: (
+        int(os.getenv("ADMISSION_WRITES_CONCURRENCY", "4")),
+        int(os.getenv("ADMISSION_WRITES_QUEUE", "32")),
+    ),
+    ANALYTICS: (
+        int(os.getenv("ADMISSION_ANALYTICS_CONCURRENCY", "2")),
+        int(os.getenv("ADMISSION_ANALYTICS_QUEUE", "8")),
+    ),
+}
+
+
+class AdmissionGate:
+    """
+    Concurrency limit with a bounded FIFO wait queue for one class of requests.
+
+    Only used from the event loop, so the counters need no locking.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self) -> bool:
+        """
+        Waits for a slot.
+
+        Returns:
+            True if the request was admitted, False if it was shed
+        """
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            return True
+
+        if self.queued >= self.queue_size:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.shed += 1
+            return False
+
+        # The releasing request handed its slot over, so active is unchanged
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        """Hands the slot to the oldest waiter, or frees it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionController:
+    """Gates for every request class."""
+
+    def __init__(self, limits: Dict[str, tuple] = ADMISSION_LIMITS, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.gates = {
+            name: AdmissionGate(name, concurrency, queue_size, queue_timeout)
+            for name, (concurrency, queue_size) in limits.items()
+        }
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {name: gate.snapshot() for name, gate in self.gates.items()}
+
+
+admission_controller = AdmissionController()
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds the maximum size."""
+
+
+# Number of classified GraphQL documents remembered per worker
+GRAPHQL_CLASSIFICATION_CACHE_SIZE = 1024
+
+# Classes by digest of the document and operation name: documents can be as large
+# as GRAPHQL_MAX_BODY_BYTES, so the cache does not keep them
+_classifications: "OrderedDict[Tuple[bytes, Optional[str]], str]" = OrderedDict()
+_classifications_lock = threading.Lock()
+
+
+def classify_graphql_query(query: str, operation_name: Optional[str] = None) -> str:
+    """
+    Classifies a GraphQL document by its operation type and top-level fields.
+
+    Results are cached by a digest of the document, so repeated queries are
+    parsed once.
+
+    Args:
+        query: GraphQL document
+        operation_name: Name of the operation to run, if the document has several
+
+    Returns:
+        READS, WRITES or ANALYTICS
+    """
+    key = (sha256(query.encode()).digest(), operation_name)
+    with _classifications_lock:
+        request_class = _classifications.get(key)
+        if request_class is not None:
+            _classifications.move_to_end(key)
+            return request_class
+    request_class = _parse_and_classify(query, operation_name)
+    with _classifications_lock:
+        _classifications[key] = request_class
+        if len(_classifications) > GRAPHQL_CLASSIFICATION_CACHE_SIZE:
+            _classifications.popitem(last=False)
+    return request_class
+
+
+def _parse_and_classify(query: str, operation_name: Optional[str]) -> str:
+    try:
+        document = parse(query)
+    except GraphQLError:
+        # Let Strawberry report the syntax error
+        return READS
+
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        if operation_name and (definition.name is None or definition.name.value != operation_name):
+            continue
+        if definition.operation == OperationType.MUTATION:
+            return WRITES
+        fields = {
+            selection.name.value
+            for selection in definition.selection_set.selections
+            if isinstance(selection, FieldNode)
+        }
+        if fields & ANALYTICS_FIELDS:
+            return ANALYTICS
+    return READS
+
+
+def classify_graphql_payload(payload) -> str:
+    """Classifies a GraphQL request payload, taking the heaviest class of a batch."""
+    operations = payload if isinstance(payload, list) else [payload]
+    classes = set()
+    for operation in operations:
+        if isinstance(operation, dict) and isinstance(operation.get("query"), str):
+            classes.add(classify_graphql_query(operation["query"], operation.get("operationName")))
+    for request_class in (WRITES, ANALYTICS):
+        if request_class in classes:
+            return request_class
+    return READS
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying the admission controller to /graphql and /api routes.
+
+    Args:
+        app: The ASGI application to wrap
+        controller: Admission controller holding the per-class gates
+        retry_after: Seconds sent in the Retry-After header of shed responses
+        max_body_bytes: Maximum size of a GraphQL POST body
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: AdmissionController = admission_controller,
+        retry_after: int = ADMISSION_RETRY_AFTER,
+        max_body_bytes: int = GRAPHQL_MAX_BODY_BYTES
+    ):
+        self.app = app
+        self.controller = controller
+        self.retry_after = retry_after
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path.startswith(EXEMPT_PATHS) or not (
+            path.startswith("/graphql") or path.startswith("/api/")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            request_class, receive = await self.classify(scope, receive)
+        except BodyTooLarge:
+            response = JSONResponse(
+                {"detail": f"Request body too large: at most {self.max_body_bytes} bytes are allowed"},
+                status_code=413,
+            )
+            await response(scope, receive, send)
+            return
+        if request_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        gate = self.controller.gates[request_class]
+        if not await gate.acquire():
+            response = JSONResponse(
+                {"detail": f"Server overloaded ({request_class}), retry later"},
+                status_code=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+    async def classify(self, scope: Scope, receive: Receive):
+        """
+        Determines the request class, buffering the body of GraphQL POSTs.
+
+        Returns:
+            Tuple of the request class (None for requests that are not gated)
+            and the receive callable to pass downstream
+
+        Raises:
+            BodyTooLarge: If a GraphQL POST body is larger than max_body_bytes
+        """
+        method = scope["method"]
+        if not scope["path"].startswith("/graphql"):
+            return (READS if method in ("GET", "HEAD") else WRITES), receive
+
+        if method == "GET":
+            params = parse_qs(scope.get("query_string", b"").decode())
+            if "query" not in params:
+                # GraphiQL page
+                return None, receive
+            return classify_graphql_query(params["query"][0], params.get("operationName", [None])[0]), receive
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            raise BodyTooLarge()
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            # Chunked bodies carry no Content-Length, so the size is also checked while reading
+            if len(body) > self.max_body_bytes:
+                raise BodyTooLarge()
+            more_body = message.get("more_body", False)
+
+        replayed = False
+
+        async def replay() -> Message:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return READS, replay
+        return classify_graphql_payload(payload), replay
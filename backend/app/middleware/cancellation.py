@@ -0,0 +1,53 @@
+"""
+Query cancellation on client disconnect.
+
+Each HTTP request gets a cancel scope. Statement deadlines opened while the
+request is served register with it, and when the client disconnects before
+the response is complete the running statements are cancelled on the
+database server instead of running to completion for nobody.
+"""
+import asyncio
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.database.deadlines import CancelScope, current_cancel_scope
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    ASGI middleware cancelling a request's database statements when its client disconnects.
+
+    Args:
+        app: The ASGI application to wrap
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        cancel_scope = CancelScope()
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def listen() -> None:
+            # Reads ahead of the application so a disconnect is noticed while it is still working
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    cancel_scope.cancel()
+                    return
+
+        async def receive_message() -> Message:
+            return await messages.get()
+
+        listener = asyncio.create_task(listen())
+        token = current_cancel_scope.set(cancel_scope)
+        try:
+            await self.app(scope, receive_message, send)
+        finally:
+            current_cancel_scope.reset(token)
+            listener.cancel()
@@ -0,0 +1,333 @@
+"""
+Single-flight coalescing of identical concurrent reads.
+
+Right after an award invalidates the caches, every open dashboard refreshes
+with the same query at the same time. Identical read requests arriving while
+one of them is being served wait for it and get a copy of its response
+instead of running the same statements again. Requests are identical when
+they are for the same school and carry the same GraphQL operations (query
+hash, operation name and variables) or the same REST route and query
+parameters, and arrive while the school's data version is the same: a read
+arriving after a write never receives a response computed before it.
+Mutations and other writes are never coalesced.
+"""
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+import asyncio
+import json
+import os
+
+import orjson
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.database.changes import change_notifier
+from app.database.shared_state import SharedState, shared_state
+from app.database.tenancy import current_school_id
+from app.middleware.admission import WRITES, classify_graphql_payload, classify_graphql_query
+
+GRAPHQL = "graphql"
+REST = "rest"
+
+# Share the response of an in-flight read with identical concurrent reads
+COALESCING_ENABLED = os.getenv("COALESCING_ENABLED", "true").lower() == "true"
+
+# Largest response body shared with waiting requests (larger ones are served separately)
+COALESCING_MAX_BYTES = int(os.getenv("COALESCING_MAX_BYTES", str(1 << 20)))
+
+# Number of request keys remembered as answered with bodies larger than COALESCING_MAX_BYTES
+COALESCING_OVERSIZED_KEYS = int(os.getenv("COALESCING_OVERSIZED_KEYS", "1024"))
+
+# Long-polls and streams: their responses depend on when each consumer arrives;
+# report downloads: their responses depend on the Range header
+EXCLUDED_PATHS = ("/api/house-points/changes", "/api/reports")
+
+# Request headers that change the response, so they are part of the key
+VARYING_HEADERS = (b"accept",)
+
+# Requests carrying these headers always run on their own (a profile must observe its own execution)
+UNSHARED_HEADERS = (b"x-profile",)
+
+SharedResponse = Tuple[Message, bytes]
+
+
+def graphql_operations_key(payload: Any) -> Optional[str]:
+    """
+    Hashes the operations of a GraphQL payload (single operation or batch).
+
+    Args:
+        payload: Decoded JSON body
+
+    Returns:
+        Hex digest, or None when the payload cannot be keyed
+    """
+    operations = payload if isinstance(payload, list) else [payload]
+    parts = []
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get("query"), str):
+            return None
+        parts.append([
+            sha256(operation["query"].encode()).hexdigest(),
+            operation.get("operationName"),
+            operation.get("variables") or {},
+        ])
+    try:
+        canonical = orjson.dumps(parts, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        return None
+    return sha256(canonical).hexdigest()
+
+
+def data_version(school_id: Optional[int], state: SharedState = shared_state) -> Tuple:
+    """
+    Returns the data version of a school, as seen by this worker.
+
+    With the shared state, this is the school's latest change id and directory
+    version across the workers of the host; otherwise the latest change id
+    recorded by this worker.
+
+    Args:
+        school_id: School of the request
+        state: Shared data versions
+
+    Returns:
+        Hashable version, part of the coalescing key
+    """
+    versions = state.versions(school_id) if state.enabled else None
+    if versions is not None:
+        return versions
+    return (change_notifier.latest_ids.get(school_id, 0),)
+
+
+class RequestCoalescer:
+    """
+    In-flight read requests of this worker by key, and coalescing counters per kind.
+
+    Only used from the event loop, so the counters need no locking.
+
+    Args:
+        oversized_keys: Number of request keys remembered as too large to share
+    """
+
+    def __init__(self, oversized_keys: int = COALESCING_OVERSIZED_KEYS):
+        self._flights: Dict[Tuple, asyncio.Future] = {}
+        self._oversized: "OrderedDict[Tuple, None]" = OrderedDict()
+        self.oversized_keys = oversized_keys
+        self.stats = {
+            kind: {"executed": 0, "coalesced": 0, "fallbacks": 0, "oversized": 0} for kind in (GRAPHQL, REST)
+        }
+
+    def join(self, key: Tuple) -> Optional[asyncio.Future]:
+        """Returns the flight of an identical request in progress, if any."""
+        return self._flights.get(key)
+
+    def is_oversized(self, request_key: Tuple) -> bool:
+        """Tells whether a request's latest response was too large to share."""
+        if request_key in self._oversized:
+            self._oversized.move_to_end(request_key)
+            return True
+        return False
+
+    def mark_oversized(self, request_key: Tuple) -> None:
+        """Remembers a request whose response is too large to share, so it runs on its own from now on."""
+        self._oversized[request_key] = None
+        self._oversized.move_to_end(request_key)
+        while len(self._oversized) > self.oversized_keys:
+            self._oversized.popitem(last=False)
+
+    def start(self, key: Tuple) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = future
+        return future
+
+    def finish(self, key: Tuple, future: asyncio.Future, response: Optional[SharedResponse]) -> None:
+        # Requests arriving from now on start a new flight instead of reusing this response
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        if not future.done():
+            future.set_result(response)
+
+    def snapshot(self) -> Dict[str, Any]:
+        executed = sum(stats["executed"] for stats in self.stats.values())
+        coalesced = sum(stats["coalesced"] for stats in self.stats.values())
+        return {
+            "enabled": COALESCING_ENABLED,
+            "in_flight": len(self._flights),
+            "oversized_keys": len(self._oversized),
+            "hit_ratio": round(coalesced / (executed + coalesced), 3) if executed + coalesced else 0.0,
+            **{kind: dict(stats) for kind, stats in self.stats.items()},
+        }
+
+
+request_coalescer = RequestCoalescer()
+
+
+class CoalescingMiddleware:
+    """
+    ASGI middleware sharing one execution among identical concurrent read requests.
+
+    Waiting requests fall back to their own execution when the shared one
+    fails (5xx), is abandoned by its client or returns a body larger than
+    COALESCING_MAX_BYTES. Oversized responses are released as soon as they
+    are detected, and the request is not coalesced again: its responses are
+    streamed to each client without being buffered.
+
+    Args:
+        app: The ASGI application to wrap
+        coalescer: Registry of in-flight requests
+        enabled: Coalesce requests (False: pass every request through)
+    """
+
+    def __init__(self, app: ASGIApp, coalescer: RequestCoalescer = request_coalescer, enabled: bool = COALESCING_ENABLED):
+        self.app = app
+        self.coalescer = coalescer
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.enabled or scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PATHS) or any(
+            name in UNSHARED_HEADERS for name, _ in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        kind, request_key, receive = await self.request_key(scope, receive)
+        if request_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        stats = self.coalescer.stats[kind]
+        if self.coalescer.is_oversized(request_key):
+            stats["oversized"] += 1
+            await self.app(scope, receive, send)
+            return
+
+        # Reads arriving after a write start their own flight
+        key = request_key + (data_version(current_school_id.get()),)
+        flight = self.coalescer.join(key)
+        if flight is not None:
+            stats["coalesced"] += 1
+            shared = await asyncio.shield(flight)
+            if shared is not None:
+                start, body = shared
+                await send({**start, "headers": list(start["headers"])})
+                await send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+            stats["fallbacks"] += 1
+            await self.app(scope, receive, send)
+            return
+
+        stats["executed"] += 1
+        await self.lead(key, request_key, scope, receive, send)
+
+    async def lead(self, key: Tuple, request_key: Tuple, scope: Scope, receive: Receive, send: Send) -> None:
+        """Serves a request while recording its response for the identical requests that join it."""
+        future = self.coalescer.start(key)
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+        size = 0
+        shareable = True
+
+        async def watch_receive() -> Message:
+            nonlocal shareable
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                # Its statements may be cancelled, so the response is not shared
+                shareable = False
+            return message
+
+        def release_oversized() -> None:
+            nonlocal shareable
+            # Waiters run on their own right away instead of after this response
+            shareable = False
+            chunks.clear()
+            self.coalescer.mark_oversized(request_key)
+            self.coalescer.finish(key, future, None)
+
+        async def record_send(message: Message) -> None:
+            nonlocal start, size, shareable
+            if message["type"] == "http.response.start":
+                # Copied before outer middleware (CORS) edits the headers in place
+                start = {**message, "headers": list(message.get("headers", []))}
+                shareable = shareable and message["status"] < 500
+                content_length = dict(start["headers"]).get(b"content-length", b"")
+                if shareable and content_length.isdigit() and int(content_length) > COALESCING_MAX_BYTES:
+                    release_oversized()
+            elif message["type"] == "http.response.body" and shareable:
+                size += len(message.get("body", b""))
+                if size > COALESCING_MAX_BYTES:
+                    release_oversized()
+                else:
+                    chunks.append(message.get("body", b""))
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, watch_receive, record_send)
+            if shareable and start is not None:
+                response = (start, b"".join(chunks))
+        finally:
+            self.coalescer.finish(key, future, response)
+
+    async def request_key(self, scope: Scope, receive: Receive) -> Tuple[Optional[str], Optional[Tuple], Receive]:
+        """
+        Computes the coalescing key of a request, buffering the body of GraphQL POSTs.
+
+        Returns:
+            Tuple of the kind (graphql or rest), the key without the data version
+            (None for requests that are not coalesced) and the receive callable
+            to pass downstream
+        """
+        path = scope["path"]
+        method = scope["method"]
+        headers = tuple(value for name, value in scope["headers"] if name in VARYING_HEADERS)
+        school_id = current_school_id.get()
+        query_string = scope.get("query_string", b"").decode()
+
+        if not path.startswith("/graphql"):
+            if method != "GET" or not path.startswith("/api/"):
+                return REST, None, receive
+            params = tuple(sorted(parse_qsl(query_string, keep_blank_values=True)))
+            return REST, (REST, school_id, path, params, headers), receive
+
+        if method == "GET":
+            params = dict(parse_qsl(query_string))
+            if "query" not in params or classify_graphql_query(params["query"], params.get("operationName")) == WRITES:
+                return GRAPHQL, None, receive
+            operations_key = graphql_operations_key({
+                "query": params["query"],
+                "operationName": params.get("operationName"),
+                "variables": params.get("variables"),
+            })
+            return GRAPHQL, (GRAPHQL, school_id, operations_key, headers), receive
+        if method != "POST":
+            return GRAPHQL, None, receive
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        replayed = False
+
+        async def replay() -> Message:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            return GRAPHQL, None, replay
+        if payload is None or classify_graphql_payload(payload) == WRITES:
+            return GRAPHQL, None, replay
+        operations_key = graphql_operations_key(payload)
+        if operations_key is None:
+            return GRAPHQL, None, replay
+        return GRAPHQL, (GRAPHQL, school_id, operations_key, headers), replay
@@ -0,0 +1,230 @@
+"""
+Response compression middleware.
+
+Compresses JSON and text responses with the best encoding accepted by the
+client: brotli or zstd when their optional packages are installed, gzip
+otherwise. Streamed responses are compressed chunk by chunk and flushed,
+so each chunk reaches the client without waiting for the end of the stream.
+"""
+from typing import Dict, Optional
+import os
+import threading
+import time
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+
+# Compression levels, trading CPU time against bandwidth
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/graphql-response+json",
+    "application/javascript",
+    "text/",
+)
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        flush_mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(flush_mode)
+
+
+class BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        output = self._compressor.process(data)
+        return output + (self._compressor.finish() if final else self._compressor.flush())
+
+
+class ZstdCompressor:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self._compressor.compress(data) + self._compressor.flush(flush_mode)
+
+
+class CompressionMetrics:
+    """Thread-safe counters of compressed bytes and compression time per encoding."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int, seconds: float, finished: bool) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(
+                encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+            )
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+            stats["seconds"] += seconds
+            if finished:
+                stats["responses"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Returns the counters with the overall compression ratio and mean time per response."""
+        with self._lock:
+            result = {}
+            for encoding, stats in self._stats.items():
+                result[encoding] = dict(stats)
+                result[encoding]["ratio"] = stats["bytes_in"] / stats["bytes_out"] if stats["bytes_out"] else None
+                result[encoding]["mean_seconds"] = (
+                    stats["seconds"] / stats["responses"] if stats["responses"] else None
+                )
+            return result
+
+
+compression_metrics = CompressionMetrics()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware negotiating brotli, zstd or gzip compression from Accept-Encoding.
+
+    Args:
+        app: The ASGI application to wrap
+        minimum_size: Responses sent in one chunk smaller than this are not compressed
+        gzip_level: zlib compression level (1-9)
+        brotli_quality: brotli quality (0-11)
+        zstd_level: zstd compression level (1-22)
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        gzip_level: int = COMPRESSION_GZIP_LEVEL,
+        brotli_quality: int = COMPRESSION_BROTLI_QUALITY,
+        zstd_level: int = COMPRESSION_ZSTD_LEVEL
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.factories = {}
+        # Server preference when the client gives several encodings the same weight
+        if brotli is not None:
+            self.factories["br"] = lambda: BrotliCompressor(brotli_quality)
+        if zstandard is not None:
+            self.factories["zstd"] = lambda: ZstdCompressor(zstd_level)
+        self.factories["gzip"] = lambda: GzipCompressor(gzip_level)
+
+    def select_encoding(self, accept_encoding: str) -> Optional[str]:
+        """
+        Picks the supported encoding with the highest q-value in an Accept-Encoding header.
+
+        Args:
+            accept_encoding: Raw Accept-Encoding header value
+
+        Returns:
+            The encoding to use, or None to send the response uncompressed
+        """
+        weights = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            name = name.strip().lower()
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                weights[name] = quality
+
+        best, best_quality = None, 0.0
+        for encoding in self.factories:
+            quality = weights.get(encoding, weights.get("*", 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self.select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """Holds back the response start until the first body chunk decides whether to compress."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start_message: Optional[Message] = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                "content-encoding" in headers
+                # Byte ranges refer to the uncompressed file
+                or "accept-ranges" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+                or (not more_body and len(body) < self.middleware.minimum_size)
+            ):
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+
+            self.compressor = self.middleware.factories[self.encoding]()
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            await self._send(self.start_message)
+
+        started = time.perf_counter()
+        compressed = self.compressor.compress(body, final=not more_body)
+        compression_metrics.record(
+            self.encoding, len(body), len(compressed), time.perf_counter() - started, finished=not more_body
+        )
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
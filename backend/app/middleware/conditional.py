@@ -0,0 +1,147 @@
+"""
+Conditional GET requests answered from the shared data versions.
+
+When the shared state is enabled (see app.database.shared_state), successful
+GET responses of GraphQL queries and REST routes carry a weak ETag derived
+from the request and the school's data versions (latest change id and
+directory version). A request whose If-None-Match holds the current tag is
+answered with 304 Not Modified before any resolver, session or statement
+runs. Tags also change every ETAG_MAX_AGE_SECONDS, so results that depend on
+the clock (windows such as daysAgo) are not revalidated for longer than that.
+"""
+from functools import lru_cache
+from hashlib import sha256
+from typing import Dict, Optional
+from urllib.parse import parse_qsl
+import os
+import time
+
+from graphql import GraphQLError, parse
+from graphql.language import FieldNode, OperationDefinitionNode
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.database.shared_state import SharedState, shared_state
+from app.database.tenancy import current_school_id
+from app.middleware.admission import WRITES, classify_graphql_query
+
+# Seconds a tag stays valid while the data does not change (0: until the data changes)
+ETAG_MAX_AGE_SECONDS = float(os.getenv("ETAG_MAX_AGE_SECONDS", "60"))
+
+# Long-polls, streams and report jobs (whose status is not versioned) are never answered with 304
+EXCLUDED_PATHS = ("/api/house-points/changes", "/api/reports")
+
+# Top-level GraphQL fields whose results change without a data version change
+UNVERSIONED_FIELDS = {"reportJob", "reportJobs"}
+
+# Request headers that change the response, so they are part of the tag
+VARYING_HEADERS = (b"accept",)
+
+
+class ConditionalGetMetrics:
+    """Tagged responses and 304 answers of this worker."""
+
+    def __init__(self):
+        self.tagged = 0
+        self.not_modified = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"tagged": self.tagged, "not_modified": self.not_modified}
+
+
+conditional_metrics = ConditionalGetMetrics()
+
+
+@lru_cache(maxsize=1024)
+def selects_unversioned_fields(query: str, operation_name: Optional[str] = None) -> bool:
+    """
+    Tells whether a GraphQL query selects fields that are not covered by the data versions.
+
+    Args:
+        query: GraphQL document
+        operation_name: Name of the operation to run, if the document has several
+
+    Returns:
+        True if the operation selects one of UNVERSIONED_FIELDS (or cannot be parsed)
+    """
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return True
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        if operation_name and (definition.name is None or definition.name.value != operation_name):
+            continue
+        if any(
+            isinstance(selection, FieldNode) and selection.name.value in UNVERSIONED_FIELDS
+            for selection in definition.selection_set.selections
+        ):
+            return True
+    return False
+
+
+class ConditionalGetMiddleware:
+    """
+    ASGI middleware adding ETags to GET responses and answering If-None-Match.
+
+    Args:
+        app: The ASGI application to wrap
+        state: Shared data versions (requests pass through while they are not available)
+        max_age: Seconds a tag stays valid while the data does not change
+    """
+
+    def __init__(self, app: ASGIApp, state: SharedState = shared_state, max_age: float = ETAG_MAX_AGE_SECONDS):
+        self.app = app
+        self.state = state
+        self.max_age = max_age
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        etag = self.request_etag(scope) if scope["type"] == "http" and scope["method"] == "GET" else None
+        if etag is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"if-none-match" and etag in (tag.strip() for tag in value.split(b",")):
+                conditional_metrics.not_modified += 1
+                await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", etag)]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        async def tag_response(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = {**message, "headers": [*message.get("headers", []), (b"etag", etag)]}
+                conditional_metrics.tagged += 1
+            await send(message)
+
+        await self.app(scope, receive, tag_response)
+
+    def request_etag(self, scope: Scope) -> Optional[bytes]:
+        """
+        Computes the current tag of a GET request.
+
+        Returns:
+            Weak ETag, or None for requests that are not tagged
+        """
+        path = scope["path"]
+        if path.startswith(EXCLUDED_PATHS) or not (path.startswith("/graphql") or path.startswith("/api/")):
+            return None
+        query_string = scope.get("query_string", b"").decode()
+        params = sorted(parse_qsl(query_string, keep_blank_values=True))
+        if path.startswith("/graphql"):
+            query, operation_name = dict(params).get("query"), dict(params).get("operationName")
+            if (
+                query is None
+                or classify_graphql_query(query, operation_name) == WRITES
+                or selects_unversioned_fields(query, operation_name)
+            ):
+                return None
+
+        school_id = current_school_id.get()
+        versions = self.state.versions(school_id)
+        if versions is None:
+            return None
+        headers = [value for name, value in scope["headers"] if name in VARYING_HEADERS]
+        bucket = int(time.time() // self.max_age) if self.max_age > 0 else 0
+        digest = sha256(repr((path, params, headers, school_id, versions, bucket)).encode()).hexdigest()
+        return f'W/"{digest[:32]}"'.encode()
@@ -0,0 +1,115 @@
+"""
+Per-request profiling.
+
+A request is profiled when it carries the `X-Profile` header set to
+PROFILING_TOKEN, or when it is picked by PROFILING_SAMPLE_RATE. A sampling
+profiler then records the stacks of the threads working on that request (the
+event loop and the resolver threads serving it) and the timing of every SQL
+statement it runs. Two files are written to PROFILING_DIR:
+
+- `<id>.folded`: collapsed stacks, one `frame;frame;frame count` line per
+  stack, readable by flamegraph.pl, speedscope or inferno
+- `<id>.json`: request metadata and SQL statement timings
+
+Requests that are not profiled only pay for the header check.
+"""
+from typing import Optional
+import asyncio
+import logging
+import os
+import random
+import threading
+
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.profiling import RequestProfile, current_profile, install_sql_profiling
+
+logger = logging.getLogger(__name__)
+
+# Secret enabling profiling of a request through the X-Profile header (unset: header ignored)
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+
+# Fraction of requests profiled without the header (0 to 1)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+
+# Directory the profiles are written to
+PROFILING_DIR = os.getenv("PROFILING_DIR", "./profiles")
+
+PROFILE_HEADER = b"x-profile"
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests selected by header or sampling.
+
+    Args:
+        app: The ASGI application to wrap
+        engine: Engine whose statements are timed (listeners are added on the first profiled request)
+        token: Value of the X-Profile header enabling profiling (None: header ignored)
+        sample_rate: Fraction of requests profiled without the header
+        directory: Directory the profiles are written to
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        engine: Optional[Engine] = None,
+        token: Optional[str] = PROFILING_TOKEN,
+        sample_rate: float = PROFILING_SAMPLE_RATE,
+        directory: str = PROFILING_DIR
+    ):
+        self.app = app
+        self.engine = engine
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.directory = directory
+
+    def should_profile(self, scope: Scope) -> bool:
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    return value == self.token
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if self.engine is not None:
+            install_sql_profiling(self.engine)
+
+        profile = RequestProfile()
+        status = None
+
+        async def send_with_profile_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        loop_thread = threading.get_ident()
+        token = current_profile.set(profile)
+        profile.add_thread(loop_thread)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            profile.remove_thread(loop_thread)
+            current_profile.reset(token)
+            metadata = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_string": scope.get("query_string", b"").decode(),
+                "status": status,
+            }
+            try:
+                path = await asyncio.get_running_loop().run_in_executor(
+                    None, profile.write, self.directory, metadata
+                )
+                logger.info(f"Profile of {scope['method']} {scope['path']} written to {path}")
+            except OSError as e:
+                logger.error(f"Could not write profile {profile.id}: {e}")
@@ -0,0 +1,108 @@
+"""
+Tenant resolution.
+
+The school of a request comes from the X-School-Id header or from a
+/schools/{id}/ path prefix, which is stripped so the same routes serve every
+school (/schools/2/graphql is /graphql for school 2). Requests naming
+neither are served for the default school unless TENANCY_REQUIRED is set.
+Unknown schools are rejected with 404 before any other work is done.
+OPTIONS requests naming no school are passed through, since browsers send
+CORS preflights without custom headers.
+"""
+from typing import Optional, Tuple
+import os
+import re
+
+import anyio
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.database.tenancy import SchoolRegistry, current_school_id, school_registry
+from app.models.models import DEFAULT_SCHOOL_ID
+
+# Header naming the school of a request
+SCHOOL_HEADER = b"x-school-id"
+
+# Reject requests naming no school instead of serving the default one
+TENANCY_REQUIRED = os.getenv("TENANCY_REQUIRED", "false").lower() == "true"
+
+# Paths served without a school (monitoring, documentation and administration)
+UNSCOPED_PATHS = ("/health", "/metrics", "/docs", "/redoc", "/api/openapi.json", "/admin")
+
+SCHOOL_PATH = re.compile(r"^/schools/([^/]+)(/.*)?$")
+
+
+def resolve_school(scope: Scope) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Reads the school named by a request.
+
+    Args:
+        scope: ASGI HTTP scope
+
+    Returns:
+        Tuple of the raw school id (None when not named) and the path without
+        the /schools/{id} prefix (None when there is no prefix)
+    """
+    match = SCHOOL_PATH.match(scope["path"])
+    if match:
+        return match.group(1), match.group(2) or "/"
+    for name, value in scope["headers"]:
+        if name == SCHOOL_HEADER:
+            return value.decode("latin-1").strip(), None
+    return None, None
+
+
+class TenancyMiddleware:
+    """
+    ASGI middleware setting `current_school_id` for the request.
+
+    Args:
+        app: The ASGI application to wrap
+        registry: Known schools
+        required: Reject requests naming no school
+    """
+
+    def __init__(self, app: ASGIApp, registry: SchoolRegistry = school_registry, required: bool = TENANCY_REQUIRED):
+        self.app = app
+        self.registry = registry
+        self.required = required
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        raw_id, path = resolve_school(scope)
+        if path is not None:
+            scope = dict(scope, path=path, raw_path=path.encode())
+        if scope["path"].startswith(UNSCOPED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        if raw_id is None:
+            if scope["method"] == "OPTIONS":
+                await self.app(scope, receive, send)
+                return
+            if self.required:
+                await JSONResponse(
+                    {"detail": "Missing X-School-Id header or /schools/{id} path prefix"}, status_code=400
+                )(scope, receive, send)
+                return
+            school_id = DEFAULT_SCHOOL_ID
+        else:
+            try:
+                school_id = int(raw_id)
+            except ValueError:
+                school_id = None
+            # The registry only queries the database when stale or on a miss
+            if school_id is None or not (
+                self.registry.cached(school_id) or await anyio.to_thread.run_sync(self.registry.exists, school_id)
+            ):
+                await JSONResponse({"detail": f"Unknown school: {raw_id}"}, status_code=404)(scope, receive, send)
+                return
+
+        token = current_school_id.set(school_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_school_id.reset(token)
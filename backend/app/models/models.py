@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey, DateTime
-from app.database.db import Base
+from sqlalchemy import Column, Integer, String, Enum, Float, ForeignKey, DateTime, Boolean, Index, PrimaryKeyConstraint, text
+from app.database.db import Base, PARTITIONING_ENABLED
 import enum
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -10,10 +10,33 @@ class House(str, enum.Enum):
     RAVENCLAW = "Ravenclaw"
     SLYTHERIN = "Slytherin"
 
+# School served when a request names none (existing single-school deployments)
+DEFAULT_SCHOOL_ID = 1
+
+def school_id_column(**kwargs):
+    """Tenant column of a school-owned table; existing rows belong to the default school."""
+    return Column(
+        Integer,
+        ForeignKey("schools.id"),
+        nullable=False,
+        default=DEFAULT_SCHOOL_ID,
+        server_default=str(DEFAULT_SCHOOL_ID),
+        **kwargs
+    )
+
+class School(Base):
+    __tablename__ = "schools"
+    
+    # Tenant owning wizards, teachers and house points; every query is scoped to one school
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Wizard(Base):
     __tablename__ = "wizards"
 
     id = Column(Integer, primary_key=True, index=True)
+    school_id = school_id_column()
     name = Column(String, index=True)
     house = Column(Enum(House))
     wand = Column(String)
@@ -21,31 +44,190 @@ class Wizard(Base):
     
     # Relationship to house points earned by this wizard
     points_earned = relationship("HousePoints", back_populates="wizard")
+    
+    __table_args__ = (
+        Index("ix_wizards_school_name", "school_id", "name"),
+    )
 
 class Teacher(Base):
     __tablename__ = "teachers"
     
     id = Column(Integer, primary_key=True, index=True)
+    school_id = school_id_column()
     name = Column(String, index=True)
     subject = Column(String)
     house = Column(Enum(House), nullable=True)  # Head of house (can be null if not a head)
     
     # Relationship to house points awarded by this teacher
     points_awarded = relationship("HousePoints", back_populates="teacher")
+    
+    __table_args__ = (
+        Index("ix_teachers_school_name", "school_id", "name"),
+    )
 
 class HousePoints(Base):
     __tablename__ = "house_points"
     
-    id = Column(Integer, primary_key=True, index=True)
+    # A partitioned table's primary key must include the partition key,
+    # so timestamp joins the key when range partitioning is enabled.
+    # Tenant-leading indexes serve the per-school balance, history and window scans
+    __table_args__ = (
+        Index("ix_house_points_school_timestamp", "school_id", "timestamp"),
+        Index("ix_house_points_school_house_timestamp", "school_id", "house", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"} if PARTITIONING_ENABLED else {},
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    school_id = school_id_column()
     house = Column(Enum(House), nullable=False)
     points = Column(Integer, nullable=False)
     reason = Column(String, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True, primary_key=PARTITIONING_ENABLED)
     
     # Teacher who awarded the points
-    teacher_id = Column(Integer, ForeignKey("teachers.id"), nullable=False)
+    teacher_id = Column(Integer, ForeignKey("teachers.id"), nullable=False, index=True)
     teacher = relationship("Teacher", back_populates="points_awarded")
     
     # Student who earned the points (optional - can be null for house-wide awards)
+    wizard_id = Column(Integer, ForeignKey("wizards.id"), nullable=True, index=True)
+    wizard = relationship("Wizard", back_populates="points_earned") 
+
+class HousePointsCheckpoint(Base):
+    __tablename__ = "house_points_checkpoints"
+    
+    # Balance of a house (wizard_id NULL) or of a wizard within a house,
+    # including every transaction with timestamp <= checkpoint_at
+    id = Column(Integer, primary_key=True, index=True)
+    school_id = school_id_column()
+    house = Column(Enum(House), nullable=False)
+    wizard_id = Column(Integer, ForeignKey("wizards.id"), nullable=True)
+    checkpoint_at = Column(DateTime, nullable=False, index=True)
+    total_points = Column(Integer, nullable=False)
+    
+    # Whether the transactions covered by this checkpoint were moved to the archive
+    compacted = Column(Boolean, nullable=False, default=False)
+    
+    __table_args__ = (
+        Index("ix_house_points_checkpoints_lookup", "school_id", "house", "wizard_id", "checkpoint_at"),
+        Index("ix_house_points_checkpoints_school_at", "school_id", "checkpoint_at"),
+        # One checkpoint row per balance and instant, even when several workers write the
+        # same checkpoint (NULLs are distinct in unique indexes, hence the partial index)
+        Index(
+            "uq_house_points_checkpoints_house", "school_id", "checkpoint_at", "house", unique=True,
+            postgresql_where=text("wizard_id IS NULL"), sqlite_where=text("wizard_id IS NULL")
+        ),
+        Index("uq_house_points_checkpoints_wizard", "school_id", "checkpoint_at", "house", "wizard_id", unique=True),
+    )
+
+class HousePointsArchive(Base):
+    __tablename__ = "house_points_archive"
+    
+    # Compacted transactions, same shape as house_points
+    id = Column(Integer, primary_key=True)
+    school_id = school_id_column()
+    house = Column(Enum(House), nullable=False)
+    points = Column(Integer, nullable=False)
+    reason = Column(String, nullable=True)
+    timestamp = Column(DateTime, nullable=False)
+    teacher_id = Column(Integer, ForeignKey("teachers.id"), nullable=False)
     wizard_id = Column(Integer, ForeignKey("wizards.id"), nullable=True)
-    wizard = relationship("Wizard", back_populates="points_earned") 
\ No newline at end of file
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_house_points_archive_school_house_timestamp", "school_id", "house", "timestamp"),
+        Index("ix_house_points_archive_school_timestamp", "school_id", "timestamp"),
+    )
+
+class WizardPointsTotal(Base):
+    __tablename__ = "wizard_points_totals"
+    
+    # Running total of points earned by a wizard, updated on every award
+    wizard_id = Column(Integer, ForeignKey("wizards.id"), primary_key=True)
+    school_id = school_id_column()
+    house = Column(Enum(House), nullable=False, index=True)
+    total_points = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_wizard_points_totals_school_house", "school_id", "house"),
+    )
+
+class TeacherPointsTotal(Base):
+    __tablename__ = "teacher_points_totals"
+    
+    # Running total of points given by a teacher, updated on every award
+    teacher_id = Column(Integer, ForeignKey("teachers.id"), primary_key=True)
+    school_id = school_id_column(index=True)
+    total_points = Column(Integer, nullable=False, default=0)
+
+class DirectoryVersion(Base):
+    __tablename__ = "directory_versions"
+    
+    # One row per school (id = school id) bumped whenever one of its teachers or
+    # wizards is created, so every worker can tell cheaply whether its directory
+    # cache of that school is stale
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class HousePointsChange(Base):
+    __tablename__ = "house_points_changes"
+    
+    # Outbox of recorded transactions, written in the same database transaction.
+    # Ids come from the school's house_points_change_sequence row, so they are
+    # committed in increasing order per school and consumers can tail the feed
+    # of their school with id > since_id
+    school_id = school_id_column()
+    id = Column(Integer, autoincrement=False)
+    transaction_id = Column(Integer, nullable=False)
+    house = Column(Enum(House), nullable=False)
+    points = Column(Integer, nullable=False)
+    reason = Column(String, nullable=True)
+    teacher_id = Column(Integer, nullable=False)
+    wizard_id = Column(Integer, nullable=True)
+    timestamp = Column(DateTime, nullable=False)
+    recorded_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint("school_id", "id"),
+    )
+
+class HousePointsChangeSequence(Base):
+    __tablename__ = "house_points_change_sequence"
+    
+    # One row per school (id = school id) holding the last change id handed out
+    # (its row lock orders concurrent writers of that school only) and the last
+    # id removed by retention
+    id = Column(Integer, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    pruned_through = Column(Integer, nullable=False, default=0)
+
+class ReportKind(str, enum.Enum):
+    STUDENT_TOTALS = "student_totals"
+    TEACHER_SUMMARY = "teacher_summary"
+    WEEKLY_SERIES = "weekly_series"
+
+class ReportStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class ReportJob(Base):
+    __tablename__ = "report_jobs"
+    
+    # Report generated off the request path by a process pool; the row is the
+    # job's status and progress, readable from every worker. Ids are random
+    # (uuid4 hex) so download links cannot be guessed
+    id = Column(String(32), primary_key=True)
+    school_id = school_id_column(index=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default=ReportStatus.QUEUED.value)
+    progress = Column(Float, nullable=False, default=0.0)
+    start_date = Column(DateTime, nullable=False)
+    end_date = Column(DateTime, nullable=False)
+    error = Column(String, nullable=True)
+    path = Column(String, nullable=True)
+    size = Column(Integer, nullable=True)
+    rows = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,150 @@
+"""
+Request profiles shared by the profiling middleware and the code working for a request.
+
+The profile of the request being served is held in the current_profile
+context variable. The resolver thread pool registers its threads with it, so
+they are sampled while they work for a profiled request, and the SQL listeners
+installed by install_sql_profiling time the statements it runs.
+"""
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Milliseconds between two stack samples
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+
+current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfile:
+    """
+    Sampling profile of one request.
+
+    Args:
+        interval: Seconds between two stack samples
+    """
+
+    def __init__(self, interval: float = PROFILING_INTERVAL_MS / 1000):
+        self.id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.statements: List[Dict[str, object]] = []
+        self._threads: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self.started_at = time.perf_counter()
+        self.duration = 0.0
+
+    def add_thread(self, ident: int) -> None:
+        with self._lock:
+            self._threads[ident] += 1
+
+    def remove_thread(self, ident: int) -> None:
+        with self._lock:
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def record_statement(self, statement: str, seconds: float) -> None:
+        with self._lock:
+            self.statements.append({"statement": statement, "ms": round(seconds * 1000, 3)})
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self.duration = time.perf_counter() - self.started_at
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _sample(self) -> None:
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                idents = list(self._threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                if ident not in names:
+                    names[ident] = next(
+                        (thread.name for thread in threading.enumerate() if thread.ident == ident), str(ident)
+                    )
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names[ident])
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, directory: str, metadata: Dict[str, object]) -> str:
+        """
+        Writes the collapsed stacks and the metadata with SQL timings.
+
+        Args:
+            directory: Output directory (created if needed)
+            metadata: Request details stored in the JSON file
+
+        Returns:
+            Path of the collapsed stacks file
+        """
+        os.makedirs(directory, exist_ok=True)
+        folded_path = os.path.join(directory, f"{self.id}.folded")
+        with open(folded_path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, f"{self.id}.json"), "w") as f:
+            json.dump({
+                **metadata,
+                "id": self.id,
+                "duration_ms": round(self.duration * 1000, 3),
+                "samples": sum(self.stacks.values()),
+                "interval_ms": self.interval * 1000,
+                "sql_ms": round(sum(s["ms"] for s in self.statements), 3),
+                "statements": self.statements,
+            }, f, indent=2)
+        return folded_path
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        context._profile_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is not None and hasattr(context, "_profile_started_at"):
+        profile.record_statement(statement, time.perf_counter() - context._profile_started_at)
+
+
+def install_sql_profiling(engine: Engine) -> None:
+    """
+    Registers the engine event listeners timing the statements of profiled requests.
+
+    Args:
+        engine: SQLAlchemy engine
+    """
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,121 @@
+"""
+Administration endpoints (diagnostics of this worker process, schools).
+"""
+from datetime import datetime
+from typing import List, Optional
+import hmac
+import os
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database.db import get_db
+from app.database.directory import get_directory_version
+from app.database.shared_state import shared_state
+from app.database.slow_queries import slow_query_log
+from app.database.tenancy import create_school
+from app.models.models import School
+
+# Token required in the X-Admin-Token header (unset: admin endpoints are closed)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None, description="Value of ADMIN_TOKEN")):
+    """Rejects the request unless it carries the admin token; every request is rejected while none is configured."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled: ADMIN_TOKEN is not set")
+    # Constant-time comparison, so response times do not reveal how much of the token matched
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Token header")
+
+
+class SchoolCreate(BaseModel):
+    """Request model for creating a school"""
+    name: str = Field(..., min_length=1, description="Unique name of the school")
+
+
+class SchoolResponse(BaseModel):
+    """Response model for a school"""
+    id: int = Field(..., description="Id used in the X-School-Id header or the /schools/{id} path prefix")
+    name: str
+    created_at: Optional[datetime] = None
+
+
+# Router for administration endpoints (responses are serialized with orjson)
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin)],
+    responses={403: {"description": "Invalid or missing admin token"}},
+    default_response_class=ORJSONResponse,
+)
+
+
+@router.get(
+    "/slow-queries",
+    summary="Slow Queries",
+    description="Statements slower than SLOW_QUERY_MS in this worker, aggregated by fingerprint"
+)
+def get_slow_queries(
+    limit: int = Query(50, ge=1, le=500, description="Number of fingerprints to return"),
+    order_by: str = Query("total_ms", pattern="^(total_ms|max_ms|count|last_seen)$", description="Sort key")
+):
+    """
+    Get the slow query fingerprints of this worker.
+
+    - **limit**: Number of fingerprints to return
+    - **order_by**: total_ms, max_ms, count or last_seen (descending)
+    """
+    return slow_query_log.snapshot(limit=limit, order_by=order_by)
+
+
+@router.delete(
+    "/slow-queries",
+    status_code=204,
+    summary="Reset Slow Queries",
+    description="Clear the slow query statistics of this worker"
+)
+def reset_slow_queries():
+    """Clear the slow query statistics of this worker."""
+    slow_query_log.reset()
+
+
+@router.get(
+    "/schools",
+    response_model=List[SchoolResponse],
+    summary="List Schools",
+    description="Every school (tenant) served by this deployment"
+)
+def list_schools(db: Session = Depends(get_db)):
+    """List every school with its id."""
+    return [
+        {"id": school.id, "name": school.name, "created_at": school.created_at}
+        for school in db.query(School).order_by(School.id)
+    ]
+
+
+@router.post(
+    "/schools",
+    response_model=SchoolResponse,
+    status_code=201,
+    summary="Create School",
+    description="Add a school (tenant); its data is isolated from every other school",
+    responses={409: {"description": "A school with this name already exists"}}
+)
+def add_school(school: SchoolCreate = Body(...), db: Session = Depends(get_db)):
+    """
+    Create a school.
+
+    - **name**: Unique name of the school
+    """
+    try:
+        created = create_school(db, school.name)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"School {school.name!r} already exists")
+    # Lets every worker serve the new school's standings from shared memory
+    shared_state.sync_school(db, created.id, get_directory_version(db, created.id))
+    return {"id": created.id, "name": created.name, "created_at": created.created_at}
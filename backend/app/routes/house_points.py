@@ -4,14 +4,30 @@ REST API endpoints for managing house points.
 from typing import List, Optional
 from enum import Enum
 from fastapi import APIRouter, HTTPException, Path, Query, Body, Depends
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from datetime import datetime
+import orjson
+import os
+import time
 
-# Router for house points
+from app.database.changes import CHANGE_FEED_POLL_SECONDS, ChangesPage, change_notifier, get_changes, serialize_change
+from app.database.db import SessionLocal
+from app.database.tenancy import current_school_id
+
+# Maximum number of seconds a long-polling consumer may wait for changes
+CHANGE_FEED_MAX_WAIT = float(os.getenv("CHANGE_FEED_MAX_WAIT", "30"))
+
+# Seconds between two heartbeat lines of an idle NDJSON stream
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+
+# Router for house points (responses are serialized with orjson)
 router = APIRouter(
     prefix="/api/house-points",
     tags=["House Points"],
     responses={404: {"description": "Not found"}},
+    default_response_class=ORJSONResponse,
 )
 
 # Pydantic models for request/response validation and Swagger documentation
@@ -73,6 +89,22 @@ class HouseStanding(BaseModel):
         }
     }
 
+class PointChange(BaseModel):
+    id: int = Field(..., description="Position in the change feed (pass it as since_id to resume after it)")
+    transaction_id: int = Field(..., description="Id of the recorded transaction")
+    house: HouseEnum = Field(..., description="House name")
+    points: int = Field(..., description="Points awarded (negative for deductions)")
+    reason: Optional[str] = Field(None, description="Reason for the points")
+    teacher_id: int = Field(..., description="Teacher who recorded the points")
+    wizard_id: Optional[int] = Field(None, description="Student who earned the points, if any")
+    timestamp: datetime = Field(..., description="When the points were awarded")
+    recorded_at: datetime = Field(..., description="When the change was written to the feed")
+
+class ChangesResponse(BaseModel):
+    changes: List[PointChange] = Field(..., description="Changes after since_id, in feed order")
+    last_id: int = Field(..., description="Id to pass as since_id in the next request")
+    has_more: bool = Field(..., description="Whether more changes are immediately available")
+
 # Mock data for demonstration
 mock_transactions = [
     PointTransactionResponse(
@@ -113,6 +145,27 @@ mock_transactions = [
     )
 ]
 
+def rank_by_search(transactions: List[PointTransactionResponse], search: str) -> List[PointTransactionResponse]:
+    """
+    Keeps the transactions matching every search term and orders them by relevance.
+    
+    Args:
+        transactions: Transactions to search
+        search: Search string (case-insensitive substring terms)
+        
+    Returns:
+        Matching transactions, those matching terms in more fields first
+    """
+    terms = [term.lower() for term in search.split()]
+    scored = []
+    for t in transactions:
+        fields = [(value or "").lower() for value in (t.reason, t.awarded_by, t.student_name)]
+        if all(any(term in field for field in fields) for term in terms):
+            score = sum(term in field for term in terms for field in fields)
+            scored.append((score, t))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [t for _, t in scored]
+
 # Routes with detailed Swagger documentation
 @router.get(
     "/",
@@ -125,7 +178,8 @@ async def get_all_points_transactions(
     house: Optional[str] = Query(None, description="Filter by house name"),
     min_points: Optional[int] = Query(None, description="Minimum points value"),
     awarded_by: Optional[str] = Query(None, description="Filter by who awarded the points"),
-    student: Optional[str] = Query(None, description="Filter by student who earned the points")
+    student: Optional[str] = Query(None, description="Filter by student who earned the points"),
+    search: Optional[str] = Query(None, description="Search reasons, staff and student names (best matches first)")
 ):
     """
     Get all house point transactions with optional filtering.
@@ -134,6 +188,8 @@ async def get_all_points_transactions(
     - **min_points**: Filter by minimum points value
     - **awarded_by**: Filter by who awarded the points
     - **student**: Filter by student who earned the points
+    - **search**: Every term must appear in the reason, staff or student name;
+      results are ranked by how many fields match
     """
     # In a real application, this would query the database
     filtered = mock_transactions
@@ -146,9 +202,119 @@ async def get_all_points_transactions(
         filtered = [t for t in filtered if awarded_by.lower() in t.awarded_by.lower()]
     if student:
         filtered = [t for t in filtered if t.student_name and student.lower() in t.student_name.lower()]
+    if search:
+        # In a real application, this would use the search index (see app.database.search)
+        filtered = rank_by_search(filtered, search)
         
     return filtered
 
+def read_changes(school_id: int, since_id: int, limit: int) -> ChangesPage:
+    """
+    Reads a page of a school's change feed with a short-lived session.
+    
+    Args:
+        school_id: School of the feed
+        since_id: Id of the last change the consumer processed
+        limit: Maximum number of changes to return
+        
+    Returns:
+        ChangesPage (raises 410 when changes after since_id were pruned)
+    """
+    with SessionLocal() as db:
+        page = get_changes(db, school_id, since_id, limit)
+    if since_id < page.pruned_through:
+        raise HTTPException(
+            status_code=410,
+            detail=f"Changes up to id {page.pruned_through} were pruned; resynchronize, then resume from that id"
+        )
+    return page
+
+async def stream_changes(school_id: int, since_id: int, limit: int, first_page: Optional[ChangesPage] = None):
+    """
+    Yields the changes after since_id as NDJSON lines, then new ones as they are recorded.
+    
+    Idle streams get a heartbeat line every CHANGE_FEED_HEARTBEAT_SECONDS. A
+    consumer that falls behind the pruned range while streaming gets a final
+    error line, since the status code has already been sent.
+    
+    Args:
+        school_id: School of the feed
+        since_id: Id of the last change the consumer processed
+        limit: Maximum number of changes per chunk
+        first_page: Page after since_id, already read by the caller
+    """
+    cursor = since_id
+    last_write = time.monotonic()
+    page = first_page
+    while True:
+        if page is None:
+            try:
+                page = await run_in_threadpool(read_changes, school_id, cursor, limit)
+            except HTTPException as e:
+                yield orjson.dumps({"error": e.detail, "status": e.status_code}) + b"\n"
+                return
+        if page.changes:
+            cursor = page.changes[-1].id
+            last_write = time.monotonic()
+            yield b"".join(orjson.dumps(serialize_change(change)) + b"\n" for change in page.changes)
+            if len(page.changes) == limit:
+                page = None
+                continue
+        elif time.monotonic() - last_write >= CHANGE_FEED_HEARTBEAT_SECONDS:
+            last_write = time.monotonic()
+            yield orjson.dumps({"heartbeat": True, "last_id": cursor}) + b"\n"
+        page = None
+        await change_notifier.wait(school_id, cursor, CHANGE_FEED_POLL_SECONDS)
+
+@router.get(
+    "/changes",
+    response_model=ChangesResponse,
+    summary="Get Point Changes",
+    description="Tail the feed of recorded point transactions after a given change id",
+    responses={
+        200: {
+            "description": "Changes after since_id (application/x-ndjson lines when stream=true)",
+            "content": {"application/x-ndjson": {}},
+        },
+        410: {"description": "Changes after since_id were pruned"}
+    }
+)
+async def get_point_changes(
+    since_id: int = Query(0, ge=0, description="Id of the last change already processed (0: from the start)"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of changes per response or stream chunk"),
+    wait: float = Query(0, ge=0, le=CHANGE_FEED_MAX_WAIT, description="Seconds to wait for changes when there are none (long-poll)"),
+    stream: bool = Query(False, description="Stream changes as NDJSON lines instead of returning one page")
+):
+    """
+    Get the point transactions of the request's school recorded after since_id, oldest first.
+    
+    - **since_id**: Resume after this change id; store the last processed id to resume after a restart
+    - **limit**: Maximum number of changes to return
+    - **wait**: Long-poll: hold the request until a change arrives or the wait expires
+    - **stream**: Keep the response open and write every new change as an NDJSON line
+    """
+    school_id = current_school_id.get()
+    if stream:
+        # Read the first page before the response starts, so a pruned since_id still gets a 410
+        first_page = await run_in_threadpool(read_changes, school_id, since_id, limit)
+        return StreamingResponse(
+            stream_changes(school_id, since_id, limit, first_page), media_type="application/x-ndjson"
+        )
+    
+    deadline = time.monotonic() + wait
+    while True:
+        page = await run_in_threadpool(read_changes, school_id, since_id, limit)
+        remaining = deadline - time.monotonic()
+        if page.changes or remaining <= 0:
+            break
+        await change_notifier.wait(school_id, since_id, min(remaining, CHANGE_FEED_POLL_SECONDS))
+    
+    return {
+        "changes": [serialize_change(change) for change in page.changes],
+        "last_id": page.changes[-1].id if page.changes else since_id,
+        "has_more": len(page.changes) == limit,
+    }
+
 @router.get(
     "/{transaction_id}",
     response_model=PointTransactionResponse,
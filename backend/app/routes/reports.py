@@ -0,0 +1,164 @@
+"""
+REST API endpoints for background report jobs.
+
+Reports are requested with the `requestReport` GraphQL mutation; these
+endpoints report their status and serve the finished files. Downloads
+support single byte ranges (`Range: bytes=start-end`), so large reports can
+be fetched in parts and interrupted downloads resumed.
+"""
+from typing import Iterator, Optional, Tuple
+from datetime import datetime
+import os
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Path
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+
+from app.database.db import get_db
+from app.database.reports import get_report_job
+from app.database.tenancy import current_school_id
+from app.models.models import ReportJob, ReportStatus
+
+# Bytes read from the report file per response chunk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+router = APIRouter(
+    prefix="/api/reports",
+    tags=["Reports"],
+    responses={404: {"description": "Report job not found"}},
+    default_response_class=ORJSONResponse,
+)
+
+
+class ReportJobResponse(BaseModel):
+    id: str = Field(..., description="Id of the job")
+    kind: str = Field(..., description="student_totals, teacher_summary or weekly_series")
+    status: str = Field(..., description="queued, running, succeeded or failed")
+    progress: float = Field(..., description="Completed fraction, from 0 to 1")
+    start_date: datetime = Field(..., description="Start of the period covered by the report")
+    end_date: datetime = Field(..., description="End of the period covered by the report")
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = Field(None, description="Reason of the failure")
+    rows: Optional[int] = Field(None, description="Number of rows of the report")
+    size: Optional[int] = Field(None, description="Size of the CSV file in bytes")
+
+
+def find_job(db: Session, job_id: str) -> ReportJob:
+    job = get_report_job(db, current_school_id.get(), job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a Range header holding a single byte range.
+
+    Args:
+        header: Value of the Range header
+        size: Size of the file in bytes
+
+    Returns:
+        Inclusive (first, last) byte positions, or None to send the whole file
+        (multiple ranges, other units or invalid ranges such as bytes=5-3)
+
+    Raises:
+        HTTPException: 416 when the range lies outside the file
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if first and last and start > end:
+        # Syntactically invalid ranges are ignored, not unsatisfiable (RFC 9110 14.2)
+        return None
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def read_file(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as report:
+        report.seek(start)
+        while length > 0:
+            chunk = report.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@router.get(
+    "/{job_id}",
+    response_model=ReportJobResponse,
+    summary="Get Report Job",
+    description="Status and progress of a report job of the request's school"
+)
+def get_report_status(job_id: str = Path(..., description="Id returned by the requestReport mutation"),
+                      db: Session = Depends(get_db)):
+    """
+    Get the status of a report job.
+
+    - **job_id**: Id of the job
+    """
+    return find_job(db, job_id)
+
+
+@router.get(
+    "/{job_id}/download",
+    summary="Download Report",
+    description="CSV file of a finished report; supports Range requests",
+    response_class=Response,
+    responses={
+        200: {"content": {"text/csv": {}}},
+        206: {"description": "Requested byte range of the file"},
+        409: {"description": "The report is not finished"},
+        416: {"description": "Range not satisfiable"},
+    }
+)
+def download_report(
+    job_id: str = Path(..., description="Id returned by the requestReport mutation"),
+    range_header: Optional[str] = Header(None, alias="Range", description="Single byte range, e.g. bytes=0-1023"),
+    if_range: Optional[str] = Header(None, alias="If-Range", description="Only honor Range if the ETag still matches"),
+    db: Session = Depends(get_db)
+):
+    """
+    Download the CSV file of a finished report.
+
+    - **job_id**: Id of the job
+    """
+    job = find_job(db, job_id)
+    if job.status != ReportStatus.SUCCEEDED.value:
+        raise HTTPException(status_code=409, detail=f"Report is {job.status}")
+    if not job.path or not os.path.exists(job.path):
+        raise HTTPException(status_code=404, detail="Report file not found")
+
+    size = os.path.getsize(job.path)
+    # Report files never change once written, so the job id identifies their content
+    etag = f'"{job.id}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{job.kind}-{job.id}.csv"',
+    }
+    byte_range = parse_range(range_header, size) if range_header and (if_range is None or if_range == etag) else None
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        read_file(job.path, start, end - start + 1), status_code=status_code, media_type="text/csv", headers=headers
+    )
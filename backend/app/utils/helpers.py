@@ -13,6 +13,20 @@ def get_current_utc_time() -> datetime:
     """
     return datetime.now(timezone.utc)
 
+def to_naive_utc(dt: datetime) -> datetime:
+    """
+    Converts a datetime to a naive UTC datetime, as stored in the database.
+    
+    Args:
+        dt: The datetime to convert (naive values are assumed to be UTC)
+        
+    Returns:
+        datetime: The naive UTC datetime
+    """
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
 def format_date(dt: datetime, format_str: str = "%Y-%m-%d %H:%M:%S") -> str:
     """
     Formats a datetime object to a string.
@@ -0,0 +1,64 @@
+"""
+Columnar analytics benchmark: grouped analytics and cumulative balances from
+the NumPy columnar store against SQL.
+
+Checks that both paths return the same groups and balances before timing them.
+
+Usage:
+    python -m benchmarks.columnar --rows 10000000
+"""
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.common import measure, parse_args, prepare, report
+
+GROUP_BYS = ["house", "teacher", "day", "week", "month"]
+
+
+def main() -> None:
+    args = parse_args(__doc__.strip().splitlines()[0], rows=1_000_000, lookups=(int, 1000, "Balance lookups per run"))
+    app_main = prepare(args.rows, args.wizards, env={"COLUMNAR_ANALYTICS": "true", "COLUMNAR_REFRESH_SECONDS": "3600"})
+    from app.api.schema import get_points_grouped
+    from app.database.analytics import analytics_store
+    from app.database.checkpoints import calculate_balance
+    from app.database.db import SessionLocal
+    from app.models.models import House
+
+    if not analytics_store.enabled:
+        raise SystemExit("The columnar store needs numpy")
+    print(f"# store: {analytics_store.snapshot()}")
+
+    def grouped(db, group_by, columnar, **filters):
+        # get_points_grouped serves from the store only while it is enabled
+        analytics_store.enabled = columnar
+        try:
+            return get_points_grouped(db, 1, group_by, **filters)
+        finally:
+            analytics_store.enabled = True
+
+    db = SessionLocal()
+    try:
+        since = datetime.utcnow() - timedelta(days=90)
+        for group_by in GROUP_BYS:
+            for label, filters in (("", {}), (", Slytherin, 90 days", {"house": House.SLYTHERIN, "start_date": since})):
+                if grouped(db, group_by, True, **filters) != grouped(db, group_by, False, **filters):
+                    raise AssertionError(f"{group_by}{label}: the store and SQL disagree")
+                report(f"{group_by}{label} store", measure(lambda: grouped(db, group_by, True, **filters), args.repeat))
+                report(f"{group_by}{label} SQL", measure(lambda: grouped(db, group_by, False, **filters), args.repeat))
+
+        rnd = random.Random(1)
+        now = datetime.utcnow()
+        instants = [(rnd.choice(list(House)), now - timedelta(seconds=rnd.randrange(365 * 86400))) for _ in range(args.lookups)]
+        for house, at in instants[:20]:
+            if analytics_store.balance(1, house, at) != calculate_balance(db, 1, house, at):
+                raise AssertionError(f"Balance of {house} at {at}: the store and SQL disagree")
+        timings = measure(lambda: [analytics_store.balance(1, house, at) for house, at in instants], args.repeat)
+        report(f"{args.lookups} balances store", timings, f"{timings['p50'] * 1000 / args.lookups:.1f} us per lookup")
+        timings = measure(lambda: [calculate_balance(db, 1, house, at) for house, at in instants[:20]], args.repeat)
+        report("20 balances SQL", timings, f"{timings['p50'] * 1000 / 20:.1f} us per lookup")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
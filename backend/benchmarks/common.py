@@ -0,0 +1,265 @@
+"""
+Shared helpers of the benchmark harnesses.
+
+Every harness runs the application in-process against a local SQLite
+database seeded with synthetic transactions. Databases are kept under
+benchmarks/.work/<rows>/ and reused by later runs of the same size. The
+application reads its database from ./hogwarts_local.db, so prepare()
+switches to that directory before importing it.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = os.path.join(BACKEND_DIR, "benchmarks", ".work")
+
+FIRST_NAMES = [
+    "Hannah", "Ernie", "Justin", "Susan", "Zacharias", "Terry", "Anthony", "Lisa", "Marcus", "Millicent",
+    "Theodore", "Daphne", "Dean", "Seamus", "Lavender", "Parvati", "Colin", "Dennis", "Romilda", "Cormac",
+]
+LAST_NAMES = [
+    "Abbott", "Macmillan", "Finch-Fletchley", "Bones", "Smith", "Boot", "Goldstein", "Turpin", "Flint", "Bulstrode",
+    "Nott", "Greengrass", "Thomas", "Finnigan", "Brown", "Patil", "Creevey", "Vane", "McLaggen", "Jordan",
+]
+REASONS = [
+    "Excellent answer in class", "Helping a classmate with homework", "Brewing a perfect Draught of Peace",
+    "Outstanding Quidditch performance", "Being out of bed after curfew", "Talking during the exam",
+    "Disrespecting a prefect", "Mastering the Levitation Charm", "Caring for a hippogriff",
+    "Late to Potions class", "Duelling in the corridor", "Finding a lost Remembrall",
+    "Perfect transfiguration of a teacup", "Sneaking into the Restricted Section", "Tidying the Herbology greenhouse",
+]
+POINT_SIZES = [1, 2, 3, 5, 5, 10, 10, 10, 15, 20, 20, 25, 30, 50, 100]
+
+# Rows inserted per bulk insert while seeding
+SEED_CHUNK = 50_000
+
+
+def parse_args(description: str, rows: int, repeat: int = 10, **extra: Tuple[type, Any, str]) -> argparse.Namespace:
+    """
+    Parses the common --rows, --wizards and --repeat options plus harness-specific ones.
+
+    Args:
+        description: Description of the harness
+        rows: Default number of seeded transactions
+        repeat: Default number of timed runs
+        extra: Additional options, as name=(type, default, help); bool options are flags
+
+    Returns:
+        Parsed arguments
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--rows", type=int, default=rows, help="Transactions in the benchmark database")
+    parser.add_argument("--wizards", type=int, default=3000, help="Students in the benchmark database")
+    parser.add_argument("--repeat", type=int, default=repeat, help="Timed runs of every case")
+    for name, (kind, default, help_text) in extra.items():
+        if kind is bool:
+            parser.add_argument(f"--{name.replace('_', '-')}", action="store_true", help=help_text)
+        else:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=kind, default=default, help=help_text)
+    return parser.parse_args()
+
+
+def prepare(rows: int, wizards: int = 3000, env: Optional[Dict[str, str]] = None):
+    """
+    Imports the application against a database of the given size, seeding it on first use.
+
+    Args:
+        rows: Number of transactions of the database
+        wizards: Number of students of the database
+        env: Environment variables to set before the application is imported
+
+    Returns:
+        The app.main module
+    """
+    workdir = os.path.join(WORK_DIR, str(rows))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ.update(env or {})
+
+    started = time.perf_counter()
+    import app.main as main
+    from app.database.db import SessionLocal
+    from app.models.models import HousePoints
+
+    db = SessionLocal()
+    try:
+        seeded = db.query(HousePoints.id).filter(HousePoints.reason.like("bench:%")).count()
+        if seeded < rows:
+            seed(db, rows - seeded, wizards)
+            reload_caches(main, db)
+    finally:
+        db.close()
+    print(f"# {rows} transactions in {workdir} ready in {time.perf_counter() - started:.1f}s")
+    return main
+
+
+def seed(db, rows: int, wizards: int, seed_value: int = 7) -> None:
+    """
+    Inserts synthetic students and transactions spread over the last year.
+
+    Reasons start with "bench:" so seeded rows can be told from the test data.
+
+    Args:
+        db: SQLAlchemy database session
+        rows: Number of transactions to insert
+        wizards: Number of students the database should have
+        seed_value: Seed of the random generator
+    """
+    from app.models.models import House, HousePoints, Teacher, Wizard
+
+    rnd = random.Random(seed_value)
+    houses = list(House)
+    missing = wizards - db.query(Wizard.id).count()
+    if missing > 0:
+        db.bulk_insert_mappings(Wizard, [
+            {"name": f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {i}", "house": houses[i % 4],
+             "wand": "Oak", "school_id": 1}
+            for i in range(missing)
+        ])
+        db.commit()
+    wizard_houses = db.query(Wizard.id, Wizard.house).filter(Wizard.school_id == 1).all()
+    teacher_ids = [teacher_id for teacher_id, in db.query(Teacher.id).filter(Teacher.school_id == 1)]
+
+    now = datetime.utcnow()
+    for start in range(0, rows, SEED_CHUNK):
+        batch = []
+        for _ in range(min(SEED_CHUNK, rows - start)):
+            wizard_id, house = rnd.choice(wizard_houses)
+            batch.append({
+                "school_id": 1,
+                "house": house,
+                "points": rnd.choice(POINT_SIZES) * (1 if rnd.random() > 0.15 else -1),
+                "reason": f"bench: {rnd.choice(REASONS)}",
+                "teacher_id": rnd.choice(teacher_ids),
+                "wizard_id": wizard_id if rnd.random() > 0.05 else None,
+                "timestamp": now - timedelta(seconds=rnd.randrange(365 * 86400)),
+            })
+        db.bulk_insert_mappings(HousePoints, batch)
+        db.commit()
+
+
+def reload_caches(main, db) -> None:
+    """Rebuilds the totals and reloads the in-memory stores after seeding."""
+    from app.database.leaderboards import rebuild_totals
+
+    rebuild_totals(db, 1)
+    db.commit()
+    main.directory.school(1).load(db)
+    if main.analytics_store.enabled:
+        main.analytics_store.load(db)
+    if main.sketch_store.enabled:
+        main.sketch_store.load(db)
+
+
+async def call(
+    app,
+    method: str,
+    path: str,
+    body: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    query: bytes = b""
+) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Sends one HTTP request to an ASGI application.
+
+    Args:
+        app: ASGI application
+        method: HTTP method
+        path: Request path
+        body: Request body; anything but bytes or str is sent as JSON
+        headers: Request headers
+        query: Raw query string
+
+    Returns:
+        Status code, response headers and response body
+    """
+    raw_headers = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    if body is not None:
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+            raw_headers.append((b"content-type", b"application/json"))
+        if isinstance(body, str):
+            body = body.encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": method, "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query,
+        "headers": raw_headers, "server": ("bench", 80), "client": ("bench", 1),
+    }
+    sent = False
+    messages = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body or b"", "more_body": False}
+        # The client never disconnects
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = next(message for message in messages if message["type"] == "http.response.start")
+    data = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+    return start["status"], {name.decode(): value.decode() for name, value in start["headers"]}, data
+
+
+def request(app, *args, **kwargs) -> Tuple[int, Dict[str, str], bytes]:
+    """Sends one HTTP request to an ASGI application from synchronous code."""
+    return asyncio.run(call(app, *args, **kwargs))
+
+
+def graphql(app, query: str) -> Dict[str, Any]:
+    """Runs a GraphQL operation and returns the decoded response, failing on errors."""
+    status, _, data = request(app, "POST", "/graphql", {"query": query})
+    response = json.loads(data)
+    if status != 200 or response.get("errors"):
+        raise RuntimeError(f"GraphQL request failed ({status}): {data[:300]!r}")
+    return response["data"]
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """
+    Times repeated calls of a function.
+
+    Args:
+        func: Function to call
+        repeat: Number of timed calls
+        warmup: Number of untimed calls made first
+
+    Returns:
+        Median, 95th percentile and maximum duration in milliseconds
+    """
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+    return summarize(durations)
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    """Returns the median, 95th percentile and maximum of durations in milliseconds."""
+    ordered = sorted(durations)
+    return {
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def report(label: str, timings: Dict[str, float], extra: str = "") -> None:
+    """Prints one result line."""
+    print(f"{label:<48} p50 {timings['p50']:9.2f} ms  p95 {timings['p95']:9.2f} ms  max {timings['max']:9.2f} ms  {extra}")
@@ -0,0 +1,69 @@
+"""
+Resolver thread pool benchmark: latency of cheap reads while slow analytics
+queries run in the same worker.
+
+Sends --reads houseTotals queries at the same time as --slow
+pointsHistoryGrouped queries and reports the latency of the reads, then times
+one query asking for two slow fields at once. With --inline the resolvers run
+on the event loop instead of the pool, as they did before the pool existed.
+
+Usage:
+    python -m benchmarks.resolver_pool --rows 300000 --threads 10
+    python -m benchmarks.resolver_pool --rows 300000 --inline
+"""
+import asyncio
+import os
+import time
+
+from benchmarks.common import call, measure, parse_args, prepare, report, request, summarize
+
+SLOW_QUERY = "{ %s: pointsHistoryGrouped(groupBy: DAY) { groupKey totalPoints } }"
+
+
+async def timed_call(app, query: str) -> float:
+    started = time.perf_counter()
+    status, _, body = await call(app, "POST", "/graphql", {"query": query})
+    if status != 200:
+        raise RuntimeError(f"GraphQL request failed ({status}): {body[:300]!r}")
+    return (time.perf_counter() - started) * 1000
+
+
+async def mixed(app, reads: int, slow: int) -> list:
+    # Every read differs by its alias so that concurrent reads are not coalesced
+    slow_calls = [timed_call(app, SLOW_QUERY % f"slow{i}") for i in range(slow)]
+    read_calls = [timed_call(app, "{ read%d: houseTotals { house totalPoints } }" % i) for i in range(reads)]
+    durations = await asyncio.gather(*slow_calls, *read_calls)
+    return durations[slow:]
+
+
+def main() -> None:
+    args = parse_args(
+        __doc__.strip().splitlines()[0], rows=300_000,
+        reads=(int, 20, "Concurrent houseTotals reads"),
+        slow=(int, 1, "Concurrent pointsHistoryGrouped queries"),
+        threads=(int, 10, "RESOLVER_THREADS"),
+        inline=(bool, False, "Run resolvers on the event loop"),
+    )
+    app_main = prepare(args.rows, args.wizards, env={"RESOLVER_THREADS": str(args.threads)})
+    from app.api.executor import resolver_executor
+
+    if args.inline:
+        async def run_inline(func, *func_args, **func_kwargs):
+            return func(*func_args, **func_kwargs)
+        resolver_executor.run = run_inline
+    print(f"# resolvers {'on the event loop' if args.inline else f'in {resolver_executor.max_workers} threads'}")
+
+    app = app_main.app
+    report("pointsHistoryGrouped alone", measure(lambda: request(app, "POST", "/graphql", {"query": SLOW_QUERY % "slow"}), 3))
+    report("houseTotals alone", summarize(asyncio.run(mixed(app, args.reads, 0))))
+    asyncio.run(mixed(app, args.reads, args.slow))
+    durations = []
+    for _ in range(args.repeat):
+        durations.extend(asyncio.run(mixed(app, args.reads, args.slow)))
+    report(f"houseTotals beside {args.slow} pointsHistoryGrouped", summarize(durations), f"{len(durations)} reads")
+    two_fields = "{ %s %s }" % (SLOW_QUERY[2:-2] % "a", SLOW_QUERY[2:-2] % "b")
+    report("one query with two slow fields", measure(lambda: request(app, "POST", "/graphql", {"query": two_fields}), 3))
+
+
+if __name__ == "__main__":
+    main()
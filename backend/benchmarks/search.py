@@ -0,0 +1,54 @@
+"""
+Text search benchmark: indexed search (FTS5 trigram on SQLite) against a plain
+ILIKE scan over reasons, teacher names and student names.
+
+Usage:
+    python -m benchmarks.search --rows 1000000
+"""
+from sqlalchemy import desc, or_
+from sqlalchemy.orm import aliased
+
+from benchmarks.common import measure, parse_args, prepare, report
+
+TERMS = ["potions", "quidditch performance", "Finnigan", "greenhouse tidying", "hippogriff Abbott"]
+
+
+def main() -> None:
+    args = parse_args(__doc__.strip().splitlines()[0], rows=200_000, limit=(int, 50, "Results per search"))
+    app_main = prepare(args.rows, args.wizards)
+    from app.api.schema import get_points_history
+    from app.database.db import SessionLocal
+    from app.database.search import apply_search, search_terms
+    from app.models.models import HousePoints, Teacher, Wizard
+
+    def scan(db, search, limit=None):
+        teacher, wizard = aliased(Teacher), aliased(Wizard)
+        query = db.query(HousePoints.id).filter(HousePoints.school_id == 1).outerjoin(
+            teacher, teacher.id == HousePoints.teacher_id
+        ).outerjoin(wizard, wizard.id == HousePoints.wizard_id)
+        for term in search_terms(search):
+            pattern = f"%{term}%"
+            query = query.filter(or_(
+                HousePoints.reason.ilike(pattern), teacher.name.ilike(pattern), wizard.name.ilike(pattern)
+            ))
+        return query.order_by(desc(HousePoints.timestamp)).limit(limit).all()
+
+    db = SessionLocal()
+    try:
+        print(f"# dialect {db.get_bind().dialect.name}, limit {args.limit}")
+        for term in TERMS:
+            # Both paths must match the same transactions
+            indexed = {row.id for row in apply_search(db, db.query(HousePoints.id).filter(HousePoints.school_id == 1), term)}
+            scanned = {row.id for row in scan(db, term)}
+            if indexed != scanned:
+                raise AssertionError(f"{term!r}: indexed search matched {len(indexed)} rows, the scan {len(scanned)}")
+            report(f"indexed {term!r}", measure(
+                lambda: get_points_history(db, 1, search=term, limit=args.limit), args.repeat
+            ), f"{len(indexed)} matches")
+            report(f"ILIKE   {term!r}", measure(lambda: scan(db, term, args.limit), args.repeat))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
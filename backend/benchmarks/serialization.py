@@ -0,0 +1,52 @@
+"""
+Serialization benchmark: stdlib json against orjson for GraphQL and REST payloads.
+
+Encodes a pointsHistory response, and the same entries as a REST list, with the
+encoder each endpoint used before (json.dumps, JSONResponse) and the one it
+uses now (orjson, ORJSONResponse), and reports the throughput of each.
+
+Usage:
+    python -m benchmarks.serialization --entries 1000
+"""
+import json
+
+import orjson
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from benchmarks.common import graphql, measure, parse_args, prepare, report, request
+
+
+def throughput(label: str, encode, size: int, repeat: int) -> None:
+    timings = measure(encode, repeat)
+    report(label, timings, f"{len(encode()) / 1e6:.2f} MB, {size / timings['p50'] / 1e3:.0f} MB/s")
+
+
+def main() -> None:
+    args = parse_args(
+        __doc__.strip().splitlines()[0], rows=20_000, entries=(int, 1000, "Entries per payload")
+    )
+    app_main = prepare(args.rows, args.wizards)
+
+    # Payload Strawberry hands to the encoder: scalars are already JSON types
+    history = {"data": graphql(app_main.app, (
+        "{ pointsHistory(limit: %d) { timestamp house points cumulativePoints isDeduction reason teacher { id name subject } } }"
+    ) % args.entries)}
+    size = len(orjson.dumps(history))
+    print(f"# pointsHistory: {len(history['data']['pointsHistory'])} entries, {size} bytes")
+    throughput("GraphQL json.dumps", lambda: json.dumps(history).encode(), size, args.repeat)
+    throughput("GraphQL orjson.dumps", lambda: orjson.dumps(history), size, args.repeat)
+
+    # REST routes return lists of flat objects, rendered by the response class
+    rows = [dict(entry, teacher=entry["teacher"]["name"]) for entry in history["data"]["pointsHistory"]]
+    size = len(orjson.dumps(rows))
+    throughput("REST JSONResponse", lambda: JSONResponse(rows).body, size, args.repeat)
+    throughput("REST ORJSONResponse", lambda: ORJSONResponse(rows).body, size, args.repeat)
+
+    # Whole request through the middleware stack, for scale
+    report("GraphQL request (orjson)", measure(lambda: request(app_main.app, "POST", "/graphql", {"query": (
+        "{ pointsHistory(limit: %d) { timestamp house points cumulativePoints isDeduction reason teacher { id name subject } } }"
+    ) % args.entries}), args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Sketch benchmark: distinctWizards and pointQuantiles from the sketches against
+exact SQL, plus the accuracy of the sketches on synthetic data.
+
+Usage:
+    python -m benchmarks.sketches --rows 300000
+"""
+import bisect
+import random
+import statistics
+
+from benchmarks.common import graphql, measure, parse_args, prepare, report
+
+PERIODS = [7, 30, 90, 365]
+QUANTILES = [0.5, 0.9, 0.95, 0.99]
+
+
+def accuracy(trials: int) -> None:
+    from app.database.sketches import HyperLogLog, KllSketch
+
+    rnd = random.Random(1)
+    # KLL: 365 daily sketches of 700 lognormal values, merged like a year window
+    values, days = [], []
+    for _ in range(365):
+        sketch = KllSketch()
+        for _ in range(700):
+            value = int(rnd.lognormvariate(3, 1)) + 1
+            sketch.add(value)
+            values.append(value)
+        days.append(sketch)
+    values.sort()
+    worst = dict.fromkeys(QUANTILES, 0.0)
+    for _ in range(trials):
+        merged = KllSketch()
+        for sketch in days:
+            merged.merge(sketch)
+        for quantile, value in zip(QUANTILES, merged.quantiles(QUANTILES)):
+            low, high = bisect.bisect_left(values, value) / len(values), bisect.bisect_right(values, value) / len(values)
+            error = 0 if low <= quantile <= high else min(abs(quantile - low), abs(quantile - high))
+            worst[quantile] = max(worst[quantile], error)
+    print(f"KLL {len(values)} values, worst rank error over {trials} merges: "
+          + ", ".join(f"p{round(q * 100)} {error:.4f}" for q, error in worst.items()))
+
+    for cardinality in (100, 1000, 5000, 20000, 100000):
+        errors = []
+        for trial in range(trials):
+            sketch = HyperLogLog()
+            for value in range(trial * 10_000_000, trial * 10_000_000 + cardinality):
+                sketch.add(value)
+            errors.append(abs(sketch.count() - cardinality) / cardinality)
+        print(f"HLL {cardinality:6} distinct values: mean relative error {statistics.mean(errors):.4f}, max {max(errors):.4f}")
+
+
+def main() -> None:
+    args = parse_args(
+        __doc__.strip().splitlines()[0], rows=300_000, repeat=5,
+        trials=(int, 20, "Synthetic trials of the accuracy check"),
+    )
+    app_main = prepare(args.rows, args.wizards, env={"SKETCHES_ENABLED": "true", "SKETCH_REFRESH_SECONDS": "3600"})
+    print(f"# sketches: {app_main.sketch_store.snapshot()}")
+    app = app_main.app
+
+    for days in PERIODS:
+        query = "{ distinctWizards(daysAgo: %d%s) { house wizards } }"
+        approximate = {e["house"]: e["wizards"] for e in graphql(app, query % (days, ""))["distinctWizards"]}
+        exact = {e["house"]: e["wizards"] for e in graphql(app, query % (days, ", exact: true"))["distinctWizards"]}
+        error = max(abs(approximate[house] - exact[house]) / exact[house] for house in exact if exact[house])
+        report(f"distinctWizards {days}d sketch", measure(lambda: graphql(app, query % (days, "")), args.repeat),
+               f"max relative error {error:.4f}")
+        report(f"distinctWizards {days}d exact", measure(lambda: graphql(app, query % (days, ", exact: true")), args.repeat))
+
+    for days in PERIODS:
+        for label, filters in (("", ""), (" Slytherin", ", house: SLYTHERIN"), (" teacher 3", ", teacherId: 3")):
+            query = "{ pointQuantiles(daysAgo: %d%s, quantiles: [0.5, 0.9, 0.95, 0.99]) { awards quantiles { points } } }"
+            approximate = graphql(app, query % (days, filters))["pointQuantiles"]
+            exact = graphql(app, query % (days, filters + ", exact: true"))["pointQuantiles"]
+            values = f"{[q['points'] for q in approximate['quantiles']]} vs {[q['points'] for q in exact['quantiles']]}"
+            report(f"pointQuantiles {days}d{label} sketch", measure(lambda: graphql(app, query % (days, filters)), args.repeat), values)
+            report(f"pointQuantiles {days}d{label} exact",
+                   measure(lambda: graphql(app, query % (days, filters + ", exact: true")), args.repeat))
+
+    accuracy(args.trials)
+
+
+if __name__ == "__main__":
+    main()
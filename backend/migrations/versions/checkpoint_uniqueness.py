@@ -0,0 +1,38 @@
+"""Make balance checkpoints unique per school, instant, house and wizard
+
+Revision ID: checkpoint_uniqueness
+Revises: report_jobs
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'checkpoint_uniqueness'
+down_revision = 'report_jobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Drop the duplicates written by concurrent maintenance runs, keeping the first row of each balance
+    op.execute(
+        "DELETE FROM house_points_checkpoints WHERE id NOT IN ("
+        "SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM house_points_checkpoints "
+        "GROUP BY school_id, checkpoint_at, house, wizard_id) AS first_rows)"
+    )
+    # NULLs are distinct in unique indexes, so house balances get their own partial index
+    op.create_index(
+        'uq_house_points_checkpoints_house', 'house_points_checkpoints',
+        ['school_id', 'checkpoint_at', 'house'], unique=True,
+        postgresql_where=sa.text('wizard_id IS NULL'), sqlite_where=sa.text('wizard_id IS NULL')
+    )
+    op.create_index(
+        'uq_house_points_checkpoints_wizard', 'house_points_checkpoints',
+        ['school_id', 'checkpoint_at', 'house', 'wizard_id'], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_house_points_checkpoints_wizard', table_name='house_points_checkpoints')
+    op.drop_index('uq_house_points_checkpoints_house', table_name='house_points_checkpoints')
@@ -0,0 +1,29 @@
+"""Add directory version counter
+
+Revision ID: directory_versions
+Revises: house_points_search
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'directory_versions'
+down_revision = 'house_points_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Single-row counter bumped whenever a teacher or wizard is created
+    op.create_table(
+        'directory_versions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO directory_versions (id, version) VALUES (1, 0)")
+
+
+def downgrade() -> None:
+    op.drop_table('directory_versions')
@@ -0,0 +1,55 @@
+"""Add house points change feed outbox
+
+Revision ID: house_points_changes
+Revises: directory_versions
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = 'house_points_changes'
+down_revision = 'directory_versions'
+branch_labels = None
+depends_on = None
+
+
+def _house_enum():
+    if op.get_bind().dialect.name == 'postgresql':
+        return postgresql.ENUM(name='house', create_type=False)
+    return sa.Enum('Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin', name='house')
+
+
+def upgrade() -> None:
+    # Outbox of recorded transactions, tailed by id
+    op.create_table(
+        'house_points_changes',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('house', _house_enum(), nullable=False),
+        sa.Column('points', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(), nullable=True),
+        sa.Column('teacher_id', sa.Integer(), nullable=False),
+        sa.Column('wizard_id', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_house_points_changes_recorded_at'), 'house_points_changes', ['recorded_at'], unique=False)
+
+    # Single-row sequence ordering the change ids by commit
+    op.create_table(
+        'house_points_change_sequence',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.Column('pruned_through', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO house_points_change_sequence (id, last_id, pruned_through) VALUES (1, 0, 0)")
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_house_points_changes_recorded_at'), table_name='house_points_changes')
+    op.drop_table('house_points_change_sequence')
+    op.drop_table('house_points_changes')
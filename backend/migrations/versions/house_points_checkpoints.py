@@ -0,0 +1,68 @@
+"""Add balance checkpoints and house points archive
+
+Revision ID: house_points_checkpoints
+Revises: house_points_partitioning
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = 'house_points_checkpoints'
+down_revision = 'house_points_partitioning'
+branch_labels = None
+depends_on = None
+
+
+def _house_enum():
+    if op.get_bind().dialect.name == 'postgresql':
+        return postgresql.ENUM(name='house', create_type=False)
+    return sa.Enum('Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin', name='house')
+
+
+def upgrade() -> None:
+    # Create balance checkpoints table
+    op.create_table(
+        'house_points_checkpoints',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('house', _house_enum(), nullable=False),
+        sa.Column('wizard_id', sa.Integer(), nullable=True),
+        sa.Column('checkpoint_at', sa.DateTime(), nullable=False),
+        sa.Column('total_points', sa.Integer(), nullable=False),
+        sa.Column('compacted', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.ForeignKeyConstraint(['wizard_id'], ['wizards.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_house_points_checkpoints_id'), 'house_points_checkpoints', ['id'], unique=False)
+    op.create_index(op.f('ix_house_points_checkpoints_checkpoint_at'), 'house_points_checkpoints', ['checkpoint_at'], unique=False)
+    op.create_index('ix_house_points_checkpoints_lookup', 'house_points_checkpoints',
+                    ['house', 'wizard_id', 'checkpoint_at'], unique=False)
+
+    # Create archive table for compacted transactions
+    op.create_table(
+        'house_points_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('house', _house_enum(), nullable=False),
+        sa.Column('points', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('teacher_id', sa.Integer(), nullable=False),
+        sa.Column('wizard_id', sa.Integer(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True, server_default=sa.func.now()),
+        sa.ForeignKeyConstraint(['teacher_id'], ['teachers.id'], ),
+        sa.ForeignKeyConstraint(['wizard_id'], ['wizards.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_house_points_archive_house_timestamp', 'house_points_archive',
+                    ['house', 'timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_house_points_archive_house_timestamp', table_name='house_points_archive')
+    op.drop_table('house_points_archive')
+
+    op.drop_index('ix_house_points_checkpoints_lookup', table_name='house_points_checkpoints')
+    op.drop_index(op.f('ix_house_points_checkpoints_checkpoint_at'), table_name='house_points_checkpoints')
+    op.drop_index(op.f('ix_house_points_checkpoints_id'), table_name='house_points_checkpoints')
+    op.drop_table('house_points_checkpoints')
@@ -0,0 +1,105 @@
+"""Range partition house_points by timestamp
+
+Revision ID: house_points_partitioning
+Revises: initial_migration
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from app.database.db import HOUSE_POINTS_PARTITIONING
+from app.database.partitioning import create_partitions
+
+revision = 'house_points_partitioning'
+down_revision = 'initial_migration'
+branch_labels = None
+depends_on = None
+
+LEGACY_TABLE = 'house_points_unpartitioned'
+
+
+def _partitioning_applies() -> bool:
+    return op.get_bind().dialect.name == 'postgresql' and HOUSE_POINTS_PARTITIONING != 'none'
+
+
+def _now(bind):
+    return bind.execute(sa.text("SELECT now()::timestamp")).scalar()
+
+
+def _house_points_columns():
+    return [
+        sa.Column('id', sa.Integer(), nullable=False,
+                  server_default=sa.text("nextval('house_points_id_seq'::regclass)")),
+        sa.Column('house', postgresql.ENUM(name='house', create_type=False), nullable=False),
+        sa.Column('points', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column('teacher_id', sa.Integer(), nullable=False),
+        sa.Column('wizard_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['teacher_id'], ['teachers.id'], ),
+        sa.ForeignKeyConstraint(['wizard_id'], ['wizards.id'], ),
+    ]
+
+
+def _rename_existing_table() -> None:
+    op.rename_table('house_points', LEGACY_TABLE)
+    op.execute(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT house_points_pkey TO {LEGACY_TABLE}_pkey")
+    op.execute(f"ALTER INDEX ix_house_points_id RENAME TO ix_{LEGACY_TABLE}_id")
+    op.execute(f"ALTER INDEX IF EXISTS ix_house_points_timestamp RENAME TO ix_{LEGACY_TABLE}_timestamp")
+
+
+def _copy_rows_and_drop_legacy_table() -> None:
+    op.execute(
+        f"INSERT INTO house_points (id, house, points, reason, timestamp, teacher_id, wizard_id) "
+        f"SELECT id, house, points, reason, COALESCE(timestamp, now()), teacher_id, wizard_id "
+        f"FROM {LEGACY_TABLE}"
+    )
+    op.execute(f"ALTER SEQUENCE house_points_id_seq OWNED BY house_points.id")
+    op.drop_table(LEGACY_TABLE)
+
+
+def upgrade() -> None:
+    if not _partitioning_applies():
+        # Single-table deployments still benefit from range scans on timestamp
+        op.create_index(op.f('ix_house_points_timestamp'), 'house_points', ['timestamp'], unique=False)
+        return
+
+    _rename_existing_table()
+    # Keep the id sequence alive while the old table is dropped
+    op.execute("ALTER SEQUENCE house_points_id_seq OWNED BY NONE")
+
+    op.create_table(
+        'house_points',
+        *_house_points_columns(),
+        sa.PrimaryKeyConstraint('id', 'timestamp'),
+        postgresql_partition_by='RANGE (timestamp)'
+    )
+    op.create_index(op.f('ix_house_points_id'), 'house_points', ['id'], unique=False)
+    op.create_index(op.f('ix_house_points_timestamp'), 'house_points', ['timestamp'], unique=False)
+
+    # Cover the whole existing history with partitions before copying it over
+    bind = op.get_bind()
+    oldest = bind.execute(sa.text(f"SELECT min(timestamp) FROM {LEGACY_TABLE}")).scalar()
+    create_partitions(bind, oldest or _now(bind))
+
+    _copy_rows_and_drop_legacy_table()
+
+
+def downgrade() -> None:
+    if not _partitioning_applies():
+        op.drop_index(op.f('ix_house_points_timestamp'), table_name='house_points')
+        return
+
+    _rename_existing_table()
+    op.execute("ALTER SEQUENCE house_points_id_seq OWNED BY NONE")
+
+    op.create_table(
+        'house_points',
+        *_house_points_columns(),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_house_points_id'), 'house_points', ['id'], unique=False)
+
+    # Dropping the partitioned parent drops every attached partition with it
+    _copy_rows_and_drop_legacy_table()
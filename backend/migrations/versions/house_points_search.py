@@ -0,0 +1,50 @@
+"""Add text search indexes for house points
+
+Revision ID: house_points_search
+Revises: leaderboard_totals
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.database.search import FTS_TABLE, POSTGRES_SEARCH_DDL, SQLITE_SEARCH_DDL
+
+revision = 'house_points_search'
+down_revision = 'leaderboard_totals'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Foreign key indexes used by the search filters on teacher and student names
+    op.create_index(op.f('ix_house_points_teacher_id'), 'house_points', ['teacher_id'], unique=False)
+    op.create_index(op.f('ix_house_points_wizard_id'), 'house_points', ['wizard_id'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in POSTGRES_SEARCH_DDL:
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in SQLITE_SEARCH_DDL:
+            op.execute(statement)
+        op.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, reason, teacher_name, wizard_name) "
+            f"SELECT hp.id, hp.reason, t.name, w.name FROM house_points hp "
+            f"LEFT JOIN teachers t ON t.id = hp.teacher_id "
+            f"LEFT JOIN wizards w ON w.id = hp.wizard_id"
+        )
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_wizards_name_trgm")
+        op.execute("DROP INDEX IF EXISTS ix_teachers_name_trgm")
+        op.execute("DROP INDEX IF EXISTS ix_house_points_reason_trgm")
+    elif dialect == 'sqlite':
+        op.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete")
+        op.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert")
+        op.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+    op.drop_index(op.f('ix_house_points_wizard_id'), table_name='house_points')
+    op.drop_index(op.f('ix_house_points_teacher_id'), table_name='house_points')
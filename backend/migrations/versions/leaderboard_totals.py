@@ -0,0 +1,64 @@
+"""Add wizard and teacher running point totals
+
+Revision ID: leaderboard_totals
+Revises: house_points_checkpoints
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = 'leaderboard_totals'
+down_revision = 'house_points_checkpoints'
+branch_labels = None
+depends_on = None
+
+
+def _house_enum():
+    if op.get_bind().dialect.name == 'postgresql':
+        return postgresql.ENUM(name='house', create_type=False)
+    return sa.Enum('Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin', name='house')
+
+
+def upgrade() -> None:
+    # Create running totals tables
+    op.create_table(
+        'wizard_points_totals',
+        sa.Column('wizard_id', sa.Integer(), nullable=False),
+        sa.Column('house', _house_enum(), nullable=False),
+        sa.Column('total_points', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['wizard_id'], ['wizards.id'], ),
+        sa.PrimaryKeyConstraint('wizard_id')
+    )
+    op.create_index(op.f('ix_wizard_points_totals_house'), 'wizard_points_totals', ['house'], unique=False)
+
+    op.create_table(
+        'teacher_points_totals',
+        sa.Column('teacher_id', sa.Integer(), nullable=False),
+        sa.Column('total_points', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['teacher_id'], ['teachers.id'], ),
+        sa.PrimaryKeyConstraint('teacher_id')
+    )
+
+    # Backfill the totals from the existing transactions (including archived ones)
+    op.execute(
+        "INSERT INTO wizard_points_totals (wizard_id, house, total_points) "
+        "SELECT w.id, w.house, SUM(t.points) FROM ("
+        "SELECT wizard_id, points FROM house_points UNION ALL "
+        "SELECT wizard_id, points FROM house_points_archive"
+        ") t JOIN wizards w ON w.id = t.wizard_id GROUP BY w.id, w.house"
+    )
+    op.execute(
+        "INSERT INTO teacher_points_totals (teacher_id, total_points) "
+        "SELECT teacher_id, SUM(points) FROM ("
+        "SELECT teacher_id, points FROM house_points UNION ALL "
+        "SELECT teacher_id, points FROM house_points_archive"
+        ") t GROUP BY teacher_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('teacher_points_totals')
+    op.drop_index(op.f('ix_wizard_points_totals_house'), table_name='wizard_points_totals')
+    op.drop_table('wizard_points_totals')
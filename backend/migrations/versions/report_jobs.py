@@ -0,0 +1,43 @@
+"""Add report jobs
+
+Revision ID: report_jobs
+Revises: school_tenancy
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'report_jobs'
+down_revision = 'school_tenancy'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Status and progress of reports generated by the background process pools
+    op.create_table(
+        'report_jobs',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('school_id', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('progress', sa.Float(), nullable=False),
+        sa.Column('start_date', sa.DateTime(), nullable=False),
+        sa.Column('end_date', sa.DateTime(), nullable=False),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('path', sa.String(), nullable=True),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('rows', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['school_id'], ['schools.id'], name='fk_report_jobs_school_id'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_report_jobs_school_id'), 'report_jobs', ['school_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_report_jobs_school_id'), table_name='report_jobs')
+    op.drop_table('report_jobs')
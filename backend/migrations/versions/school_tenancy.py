@@ -0,0 +1,92 @@
+"""Add schools and scope school-owned tables by school_id
+
+Revision ID: school_tenancy
+Revises: house_points_changes
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'school_tenancy'
+down_revision = 'house_points_changes'
+branch_labels = None
+depends_on = None
+
+# Tables gaining a school_id column; existing rows belong to school 1
+SCHOOL_OWNED_TABLES = [
+    'wizards',
+    'teachers',
+    'house_points',
+    'house_points_checkpoints',
+    'house_points_archive',
+    'wizard_points_totals',
+    'teacher_points_totals',
+    'house_points_changes',
+]
+
+# Tenant-leading indexes: (name, table, columns)
+SCHOOL_INDEXES = [
+    ('ix_wizards_school_name', 'wizards', ['school_id', 'name']),
+    ('ix_teachers_school_name', 'teachers', ['school_id', 'name']),
+    ('ix_house_points_school_timestamp', 'house_points', ['school_id', 'timestamp']),
+    ('ix_house_points_school_house_timestamp', 'house_points', ['school_id', 'house', 'timestamp']),
+    ('ix_house_points_checkpoints_school_at', 'house_points_checkpoints', ['school_id', 'checkpoint_at']),
+    ('ix_house_points_archive_school_house_timestamp', 'house_points_archive', ['school_id', 'house', 'timestamp']),
+    ('ix_house_points_archive_school_timestamp', 'house_points_archive', ['school_id', 'timestamp']),
+    ('ix_wizard_points_totals_school_house', 'wizard_points_totals', ['school_id', 'house']),
+    ('ix_teacher_points_totals_school_id', 'teacher_points_totals', ['school_id']),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'schools',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.execute("INSERT INTO schools (id, name, created_at) VALUES (1, 'Hogwarts', CURRENT_TIMESTAMP)")
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("SELECT setval(pg_get_serial_sequence('schools', 'id'), (SELECT max(id) FROM schools))")
+
+    for table in SCHOOL_OWNED_TABLES:
+        op.add_column(table, sa.Column('school_id', sa.Integer(), nullable=False, server_default='1'))
+        op.create_foreign_key(f'fk_{table}_school_id', table, 'schools', ['school_id'], ['id'])
+
+    # Checkpoint lookups and the archive's house scans now lead with the school
+    op.drop_index('ix_house_points_checkpoints_lookup', table_name='house_points_checkpoints')
+    op.create_index(
+        'ix_house_points_checkpoints_lookup', 'house_points_checkpoints',
+        ['school_id', 'house', 'wizard_id', 'checkpoint_at'], unique=False
+    )
+    op.drop_index('ix_house_points_archive_house_timestamp', table_name='house_points_archive')
+    for name, table, columns in SCHOOL_INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+    # Change ids are numbered per school (the sequence row of school 1 keeps id 1)
+    op.drop_constraint('house_points_changes_pkey', 'house_points_changes', type_='primary')
+    op.create_primary_key('house_points_changes_pkey', 'house_points_changes', ['school_id', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('house_points_changes_pkey', 'house_points_changes', type_='primary')
+    op.create_primary_key('house_points_changes_pkey', 'house_points_changes', ['id'])
+
+    for name, table, columns in SCHOOL_INDEXES:
+        op.drop_index(name, table_name=table)
+    op.create_index(
+        'ix_house_points_archive_house_timestamp', 'house_points_archive', ['house', 'timestamp'], unique=False
+    )
+    op.drop_index('ix_house_points_checkpoints_lookup', table_name='house_points_checkpoints')
+    op.create_index(
+        'ix_house_points_checkpoints_lookup', 'house_points_checkpoints',
+        ['house', 'wizard_id', 'checkpoint_at'], unique=False
+    )
+
+    for table in reversed(SCHOOL_OWNED_TABLES):
+        op.drop_constraint(f'fk_{table}_school_id', table, type_='foreignkey')
+        op.drop_column(table, 'school_id')
+    op.drop_table('schools')
@@ -17,11 +17,34 @@ if __name__ == "__main__":
     parser.add_argument("--env", type=str, default="dev", choices=["dev", "test", "prod"], 
                         help="Environment to run the application in")
     
+    # Connection pool settings (default: per-environment values, see app/database/pool.py)
+    parser.add_argument("--pool-size", type=int, help="Connections kept open in the pool")
+    parser.add_argument("--max-overflow", type=int, help="Connections opened beyond the pool size under load")
+    parser.add_argument("--pool-timeout", type=float, help="Seconds to wait for a connection before failing")
+    parser.add_argument("--pool-recycle", type=int, help="Seconds after which a connection is replaced (-1: never)")
+    parser.add_argument("--pool-pre-ping", action=argparse.BooleanOptionalAction, default=None,
+                        help="Test connections before handing them out")
+    parser.add_argument("--pool-use-lifo", action=argparse.BooleanOptionalAction, default=None,
+                        help="Hand out the most recently returned connection first")
+    
     args = parser.parse_args()
     
     # Set environment based on args
     os.environ["APP_ENV"] = args.env
     
+    # Pool flags override the DB_POOL_* environment variables read by the application
+    pool_flags = {
+        "DB_POOL_SIZE": args.pool_size,
+        "DB_MAX_OVERFLOW": args.max_overflow,
+        "DB_POOL_TIMEOUT": args.pool_timeout,
+        "DB_POOL_RECYCLE": args.pool_recycle,
+        "DB_POOL_PRE_PING": args.pool_pre_ping,
+        "DB_POOL_USE_LIFO": args.pool_use_lifo,
+    }
+    for name, value in pool_flags.items():
+        if value is not None:
+            os.environ[name] = str(value).lower() if isinstance(value, bool) else str(value)
+    
     print(f"Starting Hogwarts API in {args.env} mode on {args.host}:{args.port}")
     
     uvicorn.run(
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Tests import the application package from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database.db import Base  # noqa: E402
+from app.models.models import School  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """Session on an empty in-memory SQLite database with every table and school 1."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(School(id=1, name="Hogwarts"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
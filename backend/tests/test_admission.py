@@ -0,0 +1,25 @@
+"""
+Tests of the GraphQL request classification used by admission control.
+"""
+import app.middleware.admission as admission
+from app.middleware.admission import ANALYTICS, READS, WRITES, classify_graphql_query
+
+
+def test_classifies_operations():
+    document = "query Totals { houseTotals { house } } mutation Award { awardHousePoints { id } }"
+    assert classify_graphql_query(document, "Totals") == READS
+    assert classify_graphql_query(document, "Award") == WRITES
+    assert classify_graphql_query("{ standingsSeries { at } }") == ANALYTICS
+    assert classify_graphql_query("{ not valid") == READS
+
+
+def test_cache_keeps_digests_not_documents(monkeypatch):
+    monkeypatch.setattr(admission, "_classifications", admission.OrderedDict())
+    monkeypatch.setattr(admission, "GRAPHQL_CLASSIFICATION_CACHE_SIZE", 4)
+    padding = " " * 100_000
+    for index in range(10):
+        assert classify_graphql_query(f"query Q{index} {{ houseTotals {{ house }} }}{padding}") == READS
+
+    assert len(admission._classifications) == 4
+    for (digest, operation_name), request_class in admission._classifications.items():
+        assert len(digest) == 32 and operation_name is None and request_class == READS
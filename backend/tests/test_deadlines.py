@@ -0,0 +1,102 @@
+"""
+Tests of the statement deadlines when resolvers of one request share a session.
+
+A request's session is handed from resolver to resolver without ending its
+transaction, so nothing a deadline sets up for its statements may outlive
+them.
+"""
+from types import SimpleNamespace
+from typing import List
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import app.api.context as context_module
+from app.api.context import GraphQLContext
+from app.database.deadlines import (
+    QueryTimeoutError, _after_cursor_execute, _before_cursor_execute, install_statement_deadlines, statement_deadline
+)
+
+# Recursive query running long enough to outlast a short deadline on SQLite
+SLOW_QUERY = text(
+    "WITH RECURSIVE counter(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM counter WHERE n < 50000000) "
+    "SELECT count(*) FROM counter"
+)
+
+
+class RecordingCursor:
+    """DB-API cursor recording the statements executed through it."""
+
+    def __init__(self, executed: List[str]):
+        self.executed = executed
+
+    def execute(self, statement, parameters=None):
+        self.executed.append(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def postgresql_connection(executed: List[str]):
+    """Stand-in for a SQLAlchemy Connection to PostgreSQL, recording the statements of its cursors."""
+    dbapi_connection = SimpleNamespace(cursor=lambda: RecordingCursor(executed))
+    return SimpleNamespace(
+        dialect=SimpleNamespace(name="postgresql"),
+        connection=SimpleNamespace(dbapi_connection=dbapi_connection),
+        info={},
+    )
+
+
+def run_statement(conn, executed: List[str], statement: str) -> None:
+    """Runs a statement on the connection the way the engine does, with the deadline listeners."""
+    cursor = RecordingCursor(executed)
+    _before_cursor_execute(conn, cursor, statement, None, None, False)
+    cursor.execute(statement)
+    _after_cursor_execute(conn, cursor, statement, None, None, False)
+
+
+def test_postgresql_timeout_does_not_outlive_the_deadlined_resolver():
+    executed: List[str] = []
+    conn = postgresql_connection(executed)
+
+    # Deadlined resolver, then a resolver without a deadline in the same transaction
+    with statement_deadline("points_history", seconds=5):
+        run_statement(conn, executed, "SELECT history")
+    run_statement(conn, executed, "SELECT totals")
+
+    assert executed[0].startswith("SET LOCAL statement_timeout = ")
+    assert executed[1:] == ["SELECT history", "SET LOCAL statement_timeout = DEFAULT", "SELECT totals"]
+    assert conn.info == {}
+
+
+@pytest.fixture
+def sqlite_context(monkeypatch):
+    """GraphQL context whose sessions use an in-memory SQLite engine with deadlines installed."""
+    engine = create_engine("sqlite://")
+    install_statement_deadlines(engine)
+    monkeypatch.setattr(context_module, "SessionLocal", sessionmaker(bind=engine))
+    context = GraphQLContext(school_id=1)
+    yield context
+    context.close()
+    engine.dispose()
+
+
+def test_resolver_without_deadline_reuses_session_after_deadlined_one(sqlite_context):
+    with pytest.raises(QueryTimeoutError):
+        with sqlite_context.session() as db:
+            with statement_deadline("points_history_grouped", seconds=0.05):
+                db.execute(SLOW_QUERY).scalar()
+
+    with sqlite_context.session() as db:
+        with statement_deadline("points_history", seconds=5):
+            assert db.execute(text("SELECT 1")).scalar() == 1
+    # Well past both deadlines: the next resolver has none and must not be interrupted
+    time.sleep(0.1)
+    with sqlite_context.session() as db:
+        assert db.execute(text("SELECT count(*) FROM (SELECT 1 UNION ALL SELECT 2)")).scalar() == 2
+    assert len(sqlite_context._sessions) == 1
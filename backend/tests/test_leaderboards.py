@@ -0,0 +1,62 @@
+"""
+Tests of the wizard and teacher leaderboards, all-time and windowed.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import app.database.leaderboards as leaderboards_module
+from app.database.leaderboards import (
+    LEADERBOARD_MAX_LIMIT, SchoolLeaderboards, get_top_teachers, get_top_wizards, rebuild_totals
+)
+from app.models.models import House, HousePoints, Teacher, Wizard
+
+
+@pytest.fixture
+def school(db, monkeypatch):
+    """Wizards awarded points for their own house and for another one."""
+    monkeypatch.setattr(leaderboards_module, "leaderboards", SchoolLeaderboards())
+    wizards = {
+        "harry": Wizard(school_id=1, name="Harry Potter", house=House.GRYFFINDOR),
+        "ron": Wizard(school_id=1, name="Ron Weasley", house=House.GRYFFINDOR),
+        "draco": Wizard(school_id=1, name="Draco Malfoy", house=House.SLYTHERIN),
+    }
+    teacher = Teacher(school_id=1, name="Minerva McGonagall", subject="Transfiguration")
+    db.add_all([*wizards.values(), teacher])
+    db.flush()
+    now = datetime.utcnow()
+    db.add_all([
+        # Harry's points went to Slytherin's hourglass, but he ranks within Gryffindor
+        HousePoints(school_id=1, house=House.SLYTHERIN, points=50, teacher_id=teacher.id,
+                    wizard_id=wizards["harry"].id, timestamp=now - timedelta(days=1)),
+        HousePoints(school_id=1, house=House.GRYFFINDOR, points=10, teacher_id=teacher.id,
+                    wizard_id=wizards["ron"].id, timestamp=now - timedelta(days=1)),
+        HousePoints(school_id=1, house=House.SLYTHERIN, points=20, teacher_id=teacher.id,
+                    wizard_id=wizards["draco"].id, timestamp=now - timedelta(days=1)),
+    ])
+    db.commit()
+    rebuild_totals(db, 1)
+    return {name: wizard.id for name, wizard in wizards.items()}, teacher.id
+
+
+@pytest.mark.parametrize("house", [House.GRYFFINDOR, House.SLYTHERIN, None])
+def test_windowed_ranking_uses_the_wizards_own_house(db, school, house):
+    since = datetime.utcnow() - timedelta(days=7)
+    all_time = get_top_wizards(db, 1, house=house)
+    assert all_time == get_top_wizards(db, 1, house=house, since=since)
+
+
+def test_house_ranking_keeps_wizards_awarded_for_another_house(db, school):
+    wizards, _ = school
+    since = datetime.utcnow() - timedelta(days=7)
+    assert get_top_wizards(db, 1, house=House.GRYFFINDOR, since=since) == [(wizards["harry"], 50), (wizards["ron"], 10)]
+    assert get_top_wizards(db, 1, house=House.SLYTHERIN, since=since) == [(wizards["draco"], 20)]
+
+
+@pytest.mark.parametrize("since", [None, datetime.utcnow() - timedelta(days=7)])
+def test_limit_is_clamped(db, school, since):
+    wizards, teacher_id = school
+    assert get_top_wizards(db, 1, limit=-1, since=since) == [(wizards["harry"], 50)]
+    assert get_top_wizards(db, 1, limit=0, since=since) == [(wizards["harry"], 50)]
+    assert len(get_top_wizards(db, 1, limit=LEADERBOARD_MAX_LIMIT * 10, since=since)) == 3
+    assert get_top_teachers(db, 1, limit=-5, since=since) == [(teacher_id, 80)]
@@ -0,0 +1,74 @@
+"""
+Tests of the report jobs lifecycle: generation, the stale jobs sweep and retention.
+"""
+from datetime import datetime, timedelta
+import os
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import app.database.reports as reports
+from app.database.reports import create_report_job, fail_stale_report_jobs, prune_report_jobs, run_report
+from app.models.models import ReportJob, ReportKind, ReportStatus
+
+
+@pytest.fixture
+def report_db(db, tmp_path, monkeypatch):
+    """Database whose report processes share the test engine and write under tmp_path."""
+    monkeypatch.setattr(reports, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    monkeypatch.setattr(reports, "REPORTS_DIR", str(tmp_path))
+    return db
+
+
+def generator(on_run=None):
+    """Report generator returning two rows, after calling `on_run`."""
+    def generate(db, school_id, start, end, progress):
+        if on_run:
+            on_run()
+        return [("name", "points"), ("Harry", 50), ("Ron", 10)]
+    return generate
+
+
+def job_row(db, job_id: str) -> ReportJob:
+    db.expire_all()
+    return db.query(ReportJob).filter(ReportJob.id == job_id).first()
+
+
+def test_report_succeeds(report_db, monkeypatch):
+    monkeypatch.setitem(reports.REPORT_GENERATORS, ReportKind.STUDENT_TOTALS.value, generator())
+    job = create_report_job(report_db, 1, ReportKind.STUDENT_TOTALS, 30)
+
+    assert run_report(job.id) == ReportStatus.SUCCEEDED.value
+    job = job_row(report_db, job.id)
+    assert (job.status, job.rows, job.progress) == (ReportStatus.SUCCEEDED.value, 2, 1.0)
+    assert os.path.exists(job.path)
+
+
+def test_job_failed_by_the_sweep_while_running_stays_failed(report_db, monkeypatch):
+    def sweep():
+        # The sweep of another worker, long after the job started
+        sweeper = reports.SessionLocal()
+        try:
+            assert fail_stale_report_jobs(sweeper, 60, now=datetime.utcnow() + timedelta(hours=2)) == 1
+        finally:
+            sweeper.close()
+
+    monkeypatch.setitem(reports.REPORT_GENERATORS, ReportKind.STUDENT_TOTALS.value, generator(sweep))
+    job = create_report_job(report_db, 1, ReportKind.STUDENT_TOTALS, 30)
+
+    assert run_report(job.id) == ReportStatus.FAILED.value
+    job = job_row(report_db, job.id)
+    assert job.status == ReportStatus.FAILED.value and job.path is None
+    assert not os.path.exists(reports.report_path(job.id))
+
+
+def test_expired_jobs_and_files_are_pruned(report_db, monkeypatch):
+    monkeypatch.setitem(reports.REPORT_GENERATORS, ReportKind.STUDENT_TOTALS.value, generator())
+    job_id = create_report_job(report_db, 1, ReportKind.STUDENT_TOTALS, 30).id
+    run_report(job_id)
+    path = job_row(report_db, job_id).path
+
+    assert prune_report_jobs(report_db, 7) == 0
+    assert prune_report_jobs(report_db, 7, now=datetime.utcnow() + timedelta(days=8)) == 1
+    assert job_row(report_db, job_id) is None
+    assert not os.path.exists(path)
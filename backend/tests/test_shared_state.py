@@ -0,0 +1,202 @@
+"""
+Multi-process tests of the standings and data versions shared through shared memory.
+
+Every worker is a separate process importing the application, as under
+uvicorn/gunicorn: it attaches to the segment and publishes its school at
+import time. The workers then record awards and directory changes
+concurrently, and each one checks its view of the segment against the
+balances and versions read from the database.
+"""
+from multiprocessing import shared_memory
+from typing import Any, Dict
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKERS = 3
+AWARDS_PER_WORKER = 12
+SCHOOL_ID = 1
+
+# Seconds a worker may take to import the application and record its changes
+WORKER_TIMEOUT = 120
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the shared state needs fcntl")
+
+
+def _import_app(workdir: str, segment: str):
+    """Imports the application of a worker process against the database of `workdir`."""
+    os.chdir(workdir)
+    os.environ.update({"SHARED_STATE_ENABLED": "true", "SHARED_STATE_NAME": segment})
+    sys.path.insert(0, BACKEND_DIR)
+    import app.main as main
+    return main
+
+
+def _observe(main) -> Dict[str, Any]:
+    """Reads a worker's shared view of the school and the matching values from the database."""
+    from app.database.changes import get_last_change_id
+    from app.database.checkpoints import calculate_balance
+    from app.database.db import SessionLocal
+    from app.database.directory import directory, get_directory_version
+    from app.database.shared_state import HOUSES, shared_state
+
+    db = SessionLocal()
+    try:
+        directory.school(SCHOOL_ID).ensure_fresh(db)
+        return {
+            "shared_totals": shared_state.house_totals(SCHOOL_ID),
+            "shared_versions": shared_state.versions(SCHOOL_ID),
+            "directory_version": directory.school(SCHOOL_ID).version,
+            "sql_totals": {house: calculate_balance(db, SCHOOL_ID, house) for house in HOUSES},
+            "sql_versions": (get_last_change_id(db, SCHOOL_ID), get_directory_version(db, SCHOOL_ID)),
+        }
+    finally:
+        db.close()
+
+
+def _worker(workdir: str, segment: str, index: int, ready, done, results) -> None:
+    """Records awards and directory changes, then reports what the worker sees."""
+    try:
+        main = _import_app(workdir, segment)
+        from app.api.schema import HousePointsInput, WizardInput, create_wizard, modify_house_points
+        from app.database.db import SessionLocal
+        from app.database.shared_state import HOUSES
+        from app.models.models import Teacher
+
+        ready.wait(WORKER_TIMEOUT)
+        db = SessionLocal()
+        try:
+            teacher_id = db.query(Teacher.id).filter(Teacher.school_id == SCHOOL_ID).first()[0]
+            for award in range(AWARDS_PER_WORKER):
+                house = HOUSES[(index + award) % len(HOUSES)]
+                points = (index + 1) * (award + 1) * (-1 if award % 5 == 4 else 1)
+                modify_house_points(
+                    HousePointsInput(house=house, points=points, reason=f"worker {index}", teacher_id=teacher_id),
+                    db, SCHOOL_ID
+                )
+                if award % 4 == 0:
+                    create_wizard(WizardInput(name=f"Worker {index} {award}", house=house, wand="Oak"), db, SCHOOL_ID)
+        finally:
+            db.close()
+        # Every worker has published its changes before any of them observes
+        done.wait(WORKER_TIMEOUT)
+        results.put((index, _observe(main)))
+    except BaseException as e:
+        results.put((index, repr(e)))
+        raise
+
+
+def _worker_alone(workdir: str, segment: str, results) -> None:
+    """Runs a single worker, without waiting for others."""
+    barrier = multiprocessing.get_context("spawn").Barrier(1)
+    _worker(workdir, segment, 0, barrier, barrier, results)
+
+
+def _reader(workdir: str, segment: str, results) -> None:
+    """Starts a worker without recording anything and reports what it sees."""
+    try:
+        results.put((0, _observe(_import_app(workdir, segment))))
+    except BaseException as e:
+        results.put((0, repr(e)))
+        raise
+
+
+def _run(context, target, *args) -> None:
+    process = context.Process(target=target, args=args)
+    process.start()
+    process.join(WORKER_TIMEOUT)
+    assert process.exitcode == 0
+
+
+def _collect(results, count: int) -> Dict[int, Dict[str, Any]]:
+    observed = {}
+    for _ in range(count):
+        try:
+            index, observation = results.get(timeout=WORKER_TIMEOUT)
+        except queue.Empty:
+            pytest.fail("a worker did not report")
+        assert isinstance(observation, dict), f"worker {index} failed: {observation}"
+        observed[index] = observation
+    return observed
+
+
+def _assert_matches_database(observation: Dict[str, Any]) -> None:
+    assert observation["shared_totals"] == observation["sql_totals"]
+    assert observation["shared_versions"] == observation["sql_versions"]
+    assert observation["directory_version"] == observation["sql_versions"][1]
+
+
+@pytest.fixture
+def segment():
+    """Unique segment name, unlinked along with its lock file after the test."""
+    name = f"hogwarts_test_{uuid.uuid4().hex[:12]}"
+    yield name
+    try:
+        memory = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        pass
+    else:
+        memory.close()
+        memory.unlink()
+    lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+    if os.path.exists(lock_path):
+        os.remove(lock_path)
+
+
+@pytest.fixture
+def context():
+    # Every worker imports the application itself, as server workers do
+    return multiprocessing.get_context("spawn")
+
+
+def test_workers_share_balances_and_versions(tmp_path, segment, context):
+    workdir = str(tmp_path)
+    results = context.Queue()
+    # Creates and seeds the database before the workers start
+    _run(context, _reader, workdir, segment, results)
+    _assert_matches_database(_collect(results, 1)[0])
+
+    ready, done = context.Barrier(WORKERS), context.Barrier(WORKERS)
+    workers = [
+        context.Process(target=_worker, args=(workdir, segment, index, ready, done, results))
+        for index in range(WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        observed = _collect(results, WORKERS)
+    finally:
+        for worker in workers:
+            worker.join(WORKER_TIMEOUT)
+    assert [worker.exitcode for worker in workers] == [0] * WORKERS
+
+    for observation in observed.values():
+        _assert_matches_database(observation)
+    # Every award and directory change of every worker is reflected
+    last_change_id, directory_version = observed[0]["sql_versions"]
+    assert last_change_id >= WORKERS * AWARDS_PER_WORKER
+    assert directory_version >= WORKERS * len(range(0, AWARDS_PER_WORKER, 4))
+
+
+def test_stale_segment_is_replaced(tmp_path, segment, context):
+    results = context.Queue()
+    first = tmp_path / "first"
+    first.mkdir()
+    _run(context, _worker_alone, str(first), segment, results)
+    before = _collect(results, 1)[0]
+    assert before["shared_versions"][0] > 0
+
+    # A new database (e.g. after a reset) starts behind the change ids left in the segment
+    second = tmp_path / "second"
+    second.mkdir()
+    _run(context, _reader, str(second), segment, results)
+    after = _collect(results, 1)[0]
+    assert after["sql_versions"][0] < before["shared_versions"][0]
+    _assert_matches_database(after)